@@ -11,6 +11,10 @@ where U is the unit of measurement in the second column of the input.
 
 The returned power spectrum will be one sided and space delimited.
 
+Sequence mode (segmented) Lecroy trc files produce one power spectrum per
+segment, as if each segment had been saved to its own file named with
+-segNNNNN inserted before the extension.
+
 The sampling rate will be infered from the first 2 entries in the time column
 of the input file, i.e. fs = 1/(t[1]-t[0]). An implication of this is that
 samples are assumed to be uniform in time.
@@ -32,6 +36,46 @@ Both start_time and exposure_duration support the use of suffixes:
 
 e.g. 3u specifies 3e-6.
 
+Spectra are computed with a real input FFT, see SpectrumEngine. When -float32
+is given the spectra are computed in single precision, and saved that way in
+a spectrum store. The data matrix of npz and csv output is float64 either
+way, so the frequency column keeps its resolution.
+
+With -prefetch N, up to N inputs are read by reader threads while the spectra
+of earlier inputs are computed, which hides I/O latency on slow or network
+storage. -prefetch_mb caps the memory used by inputs read ahead.
+
+With -welch SEGMENT_DURATION each spectrum is instead the mean of the spectra
+of segments of the window, Welch's method, which has lower variance and
+fewer frequency bins. As with whole windows no windowing function is applied
+to the segments. -max_freq_bins averages groups of adjacent bins so spectra
+have no more than the given number of bins. Both shrink the output, and
+everything downstream of it.
+
+The header of each spectrum holds its trigger time twice: trigtime_epoch as
+float seconds since 1970-01-01, see lecroy.LecroyBinaryWaveform
+trig_time_epoch, and trigtime as str() of the datetime for older readers,
+which for whole trc files is str(TRIG_TIME). Use header_trigtimes to read
+trigger times back, which also parses headers saved before trigtime_epoch
+was added.
+
+Band integrals of each spectrum, the summed power in frequency bands, are
+computed along with it and saved in the bands entry of the header. Without
+-drive_freq this is just the total power. With it, harmonic, subharmonic,
+ultraharmonic and broadband power are computed as well, see band_matrix.
+Band integrals are computed before -max_freq_bins averaging. They are sums
+over bins, so like the sum of a spectrum they depend on the frequency
+resolution, and so on -welch.
+
+A summary of each spectrum is saved in the summary entry of the header: its
+total power, variance, the index of its peak bin, and with -summary_highpass
+the total power at and above each of the given frequencies, see
+spectrum_summary. Like band integrals it is computed before -max_freq_bins
+averaging, so its total is the total band, except that the peak bin is the
+index of the saved bin that holds the peak. Quantities like the cavitation
+energy of a whole run then only need a few numbers per spectrum, see
+thesis_calc_cavitation_energy.py.
+
 Merged NPZ
 ==========
 
@@ -42,6 +86,46 @@ becomes a key, and under the key is stored a dictionary containing the keys:
   - source: string identifying the source of the data
   - data: numpy array
 
+The summaries are also saved next to it as a table with one record per
+spectrum, in the order of the sorted keys, with the extension .summary.npy
+instead of .npz. Its fields are input_file, trigtime as seconds since epoch,
+the summary values and the band integrals, see band_field. load_summary
+reads it back.
+
+Spectrum Store
+==============
+
+When -merge is used with -merge_format store, the output is instead a
+spectrum store directory named like the merged NPZ file but ending in
+.power.spectra. All spectra share one frequency vector and are saved as a
+single (spectra, frequencies) matrix that can be memory mapped, with trigger
+times as seconds since epoch. Band integrals are saved as a (spectra, bands)
+matrix, and summaries as a (spectra, values) matrix, so analyses that only
+need band power or summaries never read the spectra. See spectrum_store.py.
+All spectra must then have the same number of samples in the window and
+sampling frequency.
+
+-resume STORE merges into the given store instead, and can be rerun as more
+inputs are added. Inputs are identified by real path, or real path of the zip
+archive and member name, together with their size and mtime, so they can be
+given relative or absolute. Only new and changed inputs are processed, and
+-start_at and -stop_after count only those. The window,
+-float32, -welch, -max_freq_bins and band options must be the same as when
+STORE was created, and -summary_highpass as well if STORE has summaries.
+
+Watch Mode
+==========
+
+-watch DIR processes trc files as the scope writes them into DIR, until
+interrupted with ^C. A file is processed once it has not changed between two
+checks of DIR, see -poll_interval, and is as long as its WAVEDESC says it
+should be. Spectra are merged into the spectrum store given by -resume, or
+DIR.power.spectra, which is updated after every file so it can be read while
+the experiment runs. Files already in the store are skipped, so a watch can
+be restarted. A file that cannot be processed is reported and skipped, and
+any spectra of it already in the store are kept. For each spectrum the input
+file, trigger time and total power are printed to stdout, tab separated.
+
 """
 
 import numpy as np
@@ -86,6 +170,227 @@ def calc_power_spectrum(x, fs):
 
   return freqs[idx], ps[idx]/len(x)
 
+class SpectrumEngine(object):
+  """
+  Computes the one sided power spectrum of real signals using a real input
+  FFT, so the negative frequencies are never computed and nothing needs
+  sorting. The output is the same as the non-negative half of
+  calc_power_spectrum, i.e. (len(x)+1)//2 bins starting at DC.
+
+  scipy.fftpack keeps the FFT work arrays of recently used lengths, and the
+  frequency vector of each (length, fs) is cached here, so processing many
+  traces of the same length only pays for setup once.
+
+  dtype: float64, or float32 to compute and return spectra in single
+         precision, which halves memory and is faster.
+  """
+  # number of (length, fs) entries to keep cached
+  _MAX_CACHED = 16
+
+  def __init__(self, dtype=np.float64):
+    super(SpectrumEngine, self).__init__()
+    self.dtype = np.dtype(dtype)
+    self._freqs = dict()
+
+  def frequencies(self, n, fs):
+    """
+    Returns the frequencies of the bins of the spectrum of n samples
+    """
+    key = (n, fs)
+    freqs = self._freqs.get(key)
+    if freqs is None:
+      if len(self._freqs) >= self._MAX_CACHED:
+        self._freqs.clear()
+      # same arithmetic as np.fft.fftfreq so the frequencies are identical
+      freqs = np.arange((n+1)//2) * (1.0/(n*(1.0/fs)))
+      self._freqs[key] = freqs
+    return freqs
+
+  def power(self, x, fs, overwrite_x=False):
+    """
+    Returns the one sided power spectrum of x along its last axis, see
+    calc_power_spectrum for units and normalisation. 2-D x computes the
+    spectra of all rows in one go.
+
+    x is not modified unless overwrite_x is True and x already has the
+    engine's dtype, in which case it is used as scratch space.
+    """
+    from scipy import fftpack
+    n = x.shape[-1]
+    nbins = (n+1)//2
+
+    x = np.array(x, dtype=self.dtype, copy=not overwrite_x)
+    x -= np.mean(x, axis=-1)[..., np.newaxis]
+
+    # fftpack packs the output as [y(0), Re(y(1)), Im(y(1)), ...]
+    X = fftpack.rfft(x, axis=-1, overwrite_x=True)
+    ps = np.empty(x.shape[:-1] + (nbins,), dtype=self.dtype)
+    ps[..., 0] = X[..., 0]**2
+    ps[..., 1:] = X[..., 1:2*nbins-1:2]**2 + X[..., 2:2*nbins:2]**2
+    ps /= fs * n
+
+    return ps
+
+  def power_spectrum(self, x, fs):
+    """
+    Returns (freqs, ps), the one sided power spectrum of 1-D x
+    """
+    return self.frequencies(len(x), fs), self.power(x, fs)
+
+  def welch(self, x, fs, nperseg, hop):
+    """
+    Returns Welch's estimate of the one sided power spectrum of x along its
+    last axis: the mean of the spectra, see power, of the segments of
+    nperseg samples that start every hop samples. Samples after the last
+    whole segment are not used. The frequencies of the bins are
+    frequencies(nperseg, fs).
+
+    The segments are strided views of x, and their spectra are computed in
+    one call.
+    """
+    from numpy.lib.stride_tricks import as_strided
+    n = x.shape[-1]
+    assert 0 < nperseg <= n, 'Welch segments must be no longer than the signal'
+    assert hop > 0
+
+    nsegments = (n - nperseg)//hop + 1
+    segments = as_strided(x,
+                          shape=x.shape[:-1] + (nsegments, nperseg),
+                          strides=x.strides[:-1] + (hop * x.strides[-1], x.strides[-1]))
+    return self.power(segments, fs).mean(axis=-2)
+
+_engines = dict()
+def get_engine(dtype=np.float64):
+  """
+  Returns the shared SpectrumEngine for dtype
+  """
+  dtype = np.dtype(dtype)
+  if dtype not in _engines:
+    _engines[dtype] = SpectrumEngine(dtype)
+  return _engines[dtype]
+
+def decimation_factor(nbins, max_bins):
+  """
+  Returns the number of adjacent bins decimate_spectrum averages into each
+  bin of a spectrum of nbins bins, 1 if it leaves it alone
+  """
+  if max_bins is None or nbins <= max_bins:
+    return 1
+  return -(-nbins // max_bins)
+
+def decimate_spectrum(freqs, ps, max_bins):
+  """
+  Averages groups of adjacent bins of ps, along its last axis, so that there
+  are no more than max_bins. Returns (freqs, ps) where each frequency is the
+  mean frequency of its group. The last group may have fewer bins than the
+  others. Nothing is done if max_bins is None.
+  """
+  nbins = len(freqs)
+  factor = decimation_factor(nbins, max_bins)
+  if factor == 1:
+    return freqs, ps
+
+  starts = np.arange(0, nbins, factor)
+  counts = np.diff(np.append(starts, nbins))
+
+  freqs = np.add.reduceat(freqs, starts) / counts
+  ps = (np.add.reduceat(ps, starts, axis=-1) / counts).astype(ps.dtype)
+  return freqs, ps
+
+BAND_NAMES = ('total', 'harmonic', 'subharmonic', 'ultraharmonic', 'broadband')
+SUMMARY_EXT = '.summary.npy'
+
+def band_field(band):
+  """
+  Returns the name of the field of band in summary tables, see load_summary.
+  Bands are prefixed so total does not clash with the summary value.
+  """
+  return 'band_' + band
+
+def band_matrix(freqs, drive_freq=None, band_width=None, nharmonics=10, dtype=np.float64):
+  """
+  Returns (names, matrix) where matrix has shape (len(freqs), len(names))
+  and np.dot(ps, matrix) are the band integrals of the spectra ps, i.e. the
+  sum of the power in the frequency bins of each band.
+
+  Without drive_freq the only band is total. Otherwise the bands are:
+
+    - total: every bin
+    - harmonic: bins within band_width/2 of k*drive_freq, k = 1..nharmonics
+    - subharmonic: bins within band_width/2 of drive_freq/2
+    - ultraharmonic: bins within band_width/2 of (k+1/2)*drive_freq,
+                     k = 1..nharmonics-1
+    - broadband: every bin not in the harmonic, subharmonic or ultraharmonic
+                 bands
+
+  Bins that would be both harmonic and (ultra|sub)harmonic are harmonic.
+  band_width defaults to drive_freq/10.
+  """
+  freqs = np.asarray(freqs)
+  if drive_freq is None:
+    return BAND_NAMES[:1], np.ones((len(freqs), 1), dtype=dtype)
+
+  if band_width is None:
+    band_width = drive_freq/10.0
+
+  def near(centres):
+    mask = np.zeros(len(freqs), dtype=bool)
+    for centre in centres:
+      mask |= np.abs(freqs - centre) <= band_width/2.0
+    return mask
+
+  harmonic = near(drive_freq * np.arange(1, nharmonics+1))
+  subharmonic = near([drive_freq/2.0]) & ~harmonic
+  ultraharmonic = near(drive_freq * (np.arange(1, nharmonics) + 0.5)) & ~harmonic
+  broadband = ~(harmonic | subharmonic | ultraharmonic)
+
+  matrix = np.column_stack((np.ones(len(freqs), dtype=bool),
+                            harmonic,
+                            subharmonic,
+                            ultraharmonic,
+                            broadband)).astype(dtype)
+  return BAND_NAMES, matrix
+
+def spectrum_summary(freqs, ps, highpass=()):
+  """
+  Returns (names, summary) where summary has shape (len(ps), len(names))
+  and holds the summary values of each of the spectra ps, a 2-D stack:
+
+    - total: sum of the power in every bin
+    - variance: variance of the power over the bins
+    - peak_bin: index of the bin with the most power
+    - highpass_F: sum of the power in the bins at and above F Hz, for each
+                  F in highpass
+
+  Names are sorted, as they are by sorted(header['summary']).
+  """
+  freqs = np.asarray(freqs)
+  values = dict(total=ps.sum(axis=-1, dtype=np.float64),
+                variance=ps.var(axis=-1, dtype=np.float64),
+                peak_bin=np.argmax(ps, axis=-1))
+  for cutoff in highpass:
+    values['highpass_%g'%(cutoff)] = ps[:, freqs >= cutoff].sum(axis=-1, dtype=np.float64)
+
+  names = sorted(values)
+  return names, np.column_stack([values[name] for name in names]).astype(np.float64)
+
+_band_matrices = dict()
+def _get_cmdargs_bands(freqs, dtype, cmdargs):
+  """
+  Returns band_matrix for freqs and the band command line arguments,
+  reusing the matrix of spectra with the same frequencies
+  """
+  key = (len(freqs), freqs[-1], np.dtype(dtype))
+  if key not in _band_matrices:
+    if len(_band_matrices) >= SpectrumEngine._MAX_CACHED:
+      _band_matrices.clear()
+    _band_matrices[key] = band_matrix(freqs,
+                                      cmdargs['drive_freq'],
+                                      cmdargs['band_width'],
+                                      cmdargs['nharmonics'],
+                                      dtype)
+  return _band_matrices[key]
+
 def parse_commandline_arguments():
   parser = get_commandline_parser()
   cmdargs = vars(parser.parse_args())
@@ -96,13 +401,31 @@ def get_commandline_parser():
   parser = argparse.ArgumentParser(description='Computer power spetrum of input files')
   parser.add_argument('start_time', type=str, help='Start time of ultrasound exposure')
   parser.add_argument('exposure_duration', type=str, help='Ultrasound exposure time')
-  parser.add_argument('inputfiles', nargs='+', help='Files to compute the power spectrum for')
+  parser.add_argument('inputfiles', nargs='*', help='Files to compute the power spectrum for')
   parser.add_argument('-npz', action='store_true', help='If given output will be .power.npz instead of csv')
   parser.add_argument('-suffix', type=str, default='', help='If given output will be added to file name just before .power')
   parser.add_argument('-merge', action='store_true', help='If given, output will be merged into a single npz')
+  parser.add_argument('-merge_format', choices=('npz', 'store'), default='npz', help='Format of merged output. npz is a dictionary of datadicts, store is a columnar spectrum store, see spectrum_store.py. Defaults to npz')
+  parser.add_argument('-watch', type=str, default=None, metavar='DIR', help='If given trc files are processed as they are written to DIR until interrupted, instead of processing inputfiles. Spectra are merged into a spectrum store')
+  parser.add_argument('-poll_interval', type=float, default=0.25, help='Seconds between checks of the -watch directory for new files. Defaults to 0.25')
+  parser.add_argument('-resume', type=str, default=None, metavar='STORE', help='If given spectra are merged into the spectrum store STORE, which is created if it does not exist. Inputs whose spectra are already in STORE, computed from a file of the same size and mtime, are skipped, and the spectra of changed inputs are replaced')
   parser.add_argument('-glob', type=str, default='*', help='If input is a zip file, this is a unix shell glob pattern to match files for processing')
   parser.add_argument('-stop_after', type=int, default=None, help='If given processing will stop after processing the specified number of spectrums')
   parser.add_argument('-start_at', type=int, default=0, help='If given processing will start only after the nth file')
+  parser.add_argument('-catalog', action='store_true', help='If given trc inputs are processed in order of trigger time, as recorded in the trace catalog, followed by any other inputs. See trc_catalog.py')
+  parser.add_argument('-float32', action='store_true', help='If given spectra are computed in single precision and saved that way in spectrum stores, frequencies stay float64')
+  parser.add_argument('-welch', type=str, default=None, metavar='SEGMENT_DURATION', help='If given spectra are Welch estimates, the mean of the spectra of segments of this duration, which lowers variance and the number of frequency bins. Supports the same suffixes as start_time')
+  parser.add_argument('-welch_overlap', type=float, default=0.5, help='Fraction of each Welch segment that overlaps the next. Defaults to 0.5')
+  parser.add_argument('-max_freq_bins', type=int, default=None, help='If given adjacent frequency bins are averaged so spectra have no more than this many bins')
+  parser.add_argument('-drive_freq', type=float, default=None, help='Ultrasound drive frequency in Hz. If given harmonic, subharmonic, ultraharmonic and broadband band integrals are computed as well as the total. See band_matrix')
+  parser.add_argument('-band_width', type=float, default=None, help='Width in Hz of the bands around each (sub|ultra)harmonic. Defaults to drive_freq/10')
+  parser.add_argument('-nharmonics', type=int, default=10, help='Number of harmonics of drive_freq to integrate. Defaults to 10')
+  parser.add_argument('-summary_highpass', type=float, nargs='+', default=[], metavar='HZ', help='If given the summary of each spectrum also holds its total power at and above each of these frequencies in Hz. See spectrum_summary')
+  parser.add_argument('-prefetch', type=int, default=0, help='If greater than 0, up to this many inputs are read ahead by reader threads while spectra are computed. Defaults to 0')
+  parser.add_argument('-prefetch_mb', type=float, default=None, help='If given inputs are not read ahead once the inputs waiting to be processed take this many MB')
+  parser.add_argument('-prefetch_threads', type=int, default=1, help='Number of reader threads for -prefetch. Defaults to 1')
+  parser.add_argument('-jobs', type=int, default=1, help='Number of worker processes to compute spectra with. Output order is the same as with one process. Defaults to 1')
+  parser.add_argument('-batch', type=int, default=1, help='If greater than 1, spectra of up to this many windows of equal length are computed in one vectorised call. Larger batches use more memory. Defaults to 1')
 
   return parser
 
@@ -133,82 +456,655 @@ def p(s):
   sys.stderr.write(s)
   sys.stderr.write('\n')
 
-def _process_data(inputfile, tvec, yvec, trigtime, **cmdargs):
-  start_time = cmdargs['start_time']
+def _window_bounds(tstart, start_time, exposure_duration):
+  """
+  Returns (start_time, end_time) of the window given the time of the first
+  sample and the start_time and exposure_duration command line arguments
+  """
   if start_time == 'start':
-    start_time = tvec[0]
+    start_time = tstart
   else:
     start_time = parse_number(start_time)
 
-  exposure_duration = parse_number(cmdargs['exposure_duration'])
-  end_time = start_time + exposure_duration
+  return start_time, start_time + parse_number(exposure_duration)
 
-  nsamples = len(tvec)
-  windowmask = np.logical_and(tvec >= start_time, tvec < end_time)
+def _window_samples(tvec, raw, window):
+  """
+  Returns (tvec, raw) cut down to window, a 2-tuple of the start_time and
+  exposure_duration command line arguments, where tvec is a TimeAxis.
+  """
+  start_time, end_time = _window_bounds(tvec[0], *window)
+  # uniform sampling means the window is just a range of indices
+  idx = tvec.window(start_time, end_time)
+  p('\t%d samples in window, %d samples total, (%.2f%%)'%(idx.stop - idx.start, len(tvec), 100.0*(idx.stop - idx.start)/len(tvec)))
+  return tvec[idx], raw[idx]
 
-  tvec = tvec[windowmask]
-  yvec = yvec[windowmask]
+def _window_data(inputfile, tvec, yvec, trigtime, **cmdargs):
+  """
+  Cuts yvec down to the window given by the command line arguments and
+  returns (inputfile, yvec, fs, window, trigtime) where window is
+  (start_time, end_time).
+
+  Samples of trc files, where tvec is a TimeAxis, are taken to be windowed
+  already as they were read, see _loadtrc.
+  """
+  start_time, end_time = _window_bounds(tvec[0], cmdargs['start_time'], cmdargs['exposure_duration'])
+
+  from lecroy import TimeAxis
+  if not isinstance(tvec, TimeAxis):
+    nsamples = len(tvec)
+    window = np.logical_and(tvec >= start_time, tvec < end_time)
+    tvec = tvec[window]
+    yvec = yvec[window]
+    p('\t%d samples in window, %d samples total, (%.2f%%)'%(len(tvec), nsamples, 100.0*len(tvec)/nsamples))
 
-  windownsamples = len(tvec)
-  windowpc = 100.0*windownsamples/nsamples
   p('\tWindow: %.2f us --> %.2f us'%(tvec[0]*1e6, tvec[-1]*1e6))
-  p('\t%d samples in window, %d samples total, (%.2f%%)'%(windownsamples, nsamples, windowpc))
 
   fs = 1.0/(tvec[1]-tvec[0])
 
   p('\tProcessing at %.2f MHz sampling frequency'%(fs/1e6))
-  freqs, ps = calc_power_spectrum(yvec, fs)
+  return inputfile, yvec, fs, (start_time, end_time), trigtime
 
-  # extracted only the one sided spectrum
-  onesidedmask = freqs >= 0
-  freqs = freqs[onesidedmask]
-  ps = ps[onesidedmask]
+def _make_datadict(inputfile, freqs, ps, fs, window, trigtime, bands, summary):
+  """
+  trigtime is seconds since 1970-01-01, or None if unknown.
+  """
+  trigtimestr = str(trigtime)
+  if trigtime is not None:
+    from lecroy import epoch_to_datetime
+    trigtimestr = str(epoch_to_datetime(trigtime))
 
   metadata = dict(input_file=inputfile,
                   sampling_freq=fs,
-                  window=(start_time,end_time),
-                  trigtime=str(trigtime))
-  outmat = np.column_stack((freqs, ps))
+                  window=window,
+                  trigtime=trigtimestr,
+                  trigtime_epoch=trigtime,
+                  bands=bands,
+                  summary=summary)
+  # float64 even with -float32, single precision would round frequencies of
+  # MHz spectra to whole Hz or worse
+  outmat = np.empty((len(ps), 2), dtype=np.float64)
+  outmat[:, 0] = freqs
+  outmat[:, 1] = ps
 
   datadict = dict(data=outmat, header=metadata, source='calc_power_spectrum.py')
   return datadict
 
-def _loadtrc(fname, fcontent=None):
+def header_trigtimes(headers):
+  """
+  Returns the trigger times in headers, as saved by _make_datadict, as an
+  array of float seconds since 1970-01-01, NaN where unknown. Headers saved
+  before trigtime_epoch was added are parsed from their trigtime strings, all
+  at once, see lecroy.trigtimes_to_epoch.
+  """
+  trigtimes = np.array([header.get('trigtime_epoch') for header in headers], dtype=np.float64)
+  legacy = [idx for idx, header in enumerate(headers) if 'trigtime_epoch' not in header]
+  if legacy:
+    from lecroy import trigtimes_to_epoch
+    trigtimes[legacy] = trigtimes_to_epoch([headers[idx]['trigtime'] for idx in legacy])
+  return trigtimes
+
+def _save_summary(outputfile, mergedict):
+  """
+  Saves the summaries of the spectra in mergedict as a table next to the
+  merged npz outputfile, see load_summary. Nothing is saved if there are no
+  spectra
+  """
+  names = sorted(mergedict)
+  if not names:
+    return
+  headers = [mergedict[name]['header'] for name in names]
+  summary_names = sorted(headers[0]['summary'])
+  band_names = [name for name in BAND_NAMES if name in headers[0].get('bands', ())]
+
+  namelen = max(len(name) for name in names)
+  dtype = [('input_file', 'S%d'%(namelen)), ('trigtime', 'f8')] + [(str(name), 'f8') for name in summary_names]
+  dtype += [(band_field(name), 'f8') for name in band_names]
+  table = np.zeros(len(names), dtype=dtype)
+  table['input_file'] = names
+  table['trigtime'] = header_trigtimes(headers)
+  for name in summary_names:
+    table[name] = [header['summary'][name] for header in headers]
+  for name in band_names:
+    table[band_field(name)] = [header['bands'][name] for header in headers]
+  np.save(outputfile + SUMMARY_EXT, table)
+
+def load_summary(powerfile):
+  """
+  Returns the summaries of the spectra in powerfile, a merged npz or
+  spectrum store, as a structured array with the fields input_file,
+  trigtime, one per summary value, see spectrum_summary, and one per band
+  integral, see band_field. Records are in the order of the spectra in
+  powerfile.
+
+  Returns None if powerfile has no summaries, e.g. it was made before they
+  were added, or the summary table of a merged npz is older than it.
+  """
+  import os
+  from spectrum_store import SpectrumStore, is_store
+  if is_store(powerfile):
+    store = SpectrumStore(powerfile)
+    if not store.summary_names:
+      return None
+    traces = store.traces
+    dtype = [('input_file', traces['input_file'].dtype), ('trigtime', 'f8')] + [(name, 'f8') for name in store.summary_names]
+    dtype += [(band_field(name), 'f8') for name in store.band_names]
+    table = np.zeros(len(traces), dtype=dtype)
+    table['input_file'] = traces['input_file']
+    table['trigtime'] = traces['trigtime']
+    summary = store.summary
+    for idx, name in enumerate(store.summary_names):
+      table[name] = summary[:, idx]
+    for name in store.band_names:
+      table[band_field(name)] = store.band(name)
+    return table
+
+  root, _ = os.path.splitext(powerfile)
+  summaryfile = root + SUMMARY_EXT
+  if not os.path.exists(summaryfile) or os.path.getmtime(summaryfile) < os.path.getmtime(powerfile):
+    return None
+  return np.load(summaryfile)
+
+def _get_cmdargs_engine(cmdargs):
+  return get_engine(np.float32 if cmdargs['float32'] else np.float64)
+
+def _compute_spectra(x, fs, engine, cmdargs, overwrite_x=False):
+  """
+  Returns (freqs, ps, names, bands, summary_names, summary) for x, 1-D or a
+  2-D stack of signals, as set by the command line arguments. ps is the
+  periodogram, or the Welch estimate with -welch, averaged down to
+  -max_freq_bins. bands are the band integrals, computed before averaging,
+  and names their names. summary is spectrum_summary of the spectra before
+  averaging too, except that peak_bin is the index of the averaged bin that
+  holds the peak.
+  """
+  n = x.shape[-1]
+  if cmdargs['welch'] is None:
+    freqs = engine.frequencies(n, fs)
+    ps = engine.power(x, fs, overwrite_x=overwrite_x)
+  else:
+    # windows shorter than a segment are one segment
+    nperseg = min(int(round(parse_number(cmdargs['welch']) * fs)), n)
+    hop = max(nperseg - int(cmdargs['welch_overlap'] * nperseg), 1)
+    freqs = engine.frequencies(nperseg, fs)
+    ps = engine.welch(x, fs, nperseg, hop)
+
+  names, matrix = _get_cmdargs_bands(freqs, engine.dtype, cmdargs)
+  bands = np.dot(ps, matrix)
+
+  # like the bands the summary is of the spectrum before averaging, so its
+  # total is the total band whatever -max_freq_bins is
+  summary_names, summary = spectrum_summary(freqs, np.atleast_2d(ps), cmdargs['summary_highpass'])
+  factor = decimation_factor(len(freqs), cmdargs['max_freq_bins'])
+  summary[:, summary_names.index('peak_bin')] //= factor
+  if ps.ndim == 1:
+    summary = summary[0]
+
+  freqs, ps = decimate_spectrum(freqs, ps, cmdargs['max_freq_bins'])
+  return freqs, ps, names, bands, summary_names, summary
+
+def _process_data(inputfile, tvec, yvec, trigtime, **cmdargs):
+  inputfile, yvec, fs, window, trigtime = _window_data(inputfile, tvec, yvec, trigtime, **cmdargs)
+
+  engine = _get_cmdargs_engine(cmdargs)
+  freqs, ps, names, bandvec, summary_names, summaryvec = _compute_spectra(yvec, fs, engine, cmdargs)
+  bands = _band_dict(names, bandvec)
+  summary = _band_dict(summary_names, summaryvec)
+
+  return _make_datadict(inputfile, freqs, ps, fs, window, trigtime, bands, summary)
+
+def _band_dict(names, values):
+  return dict(zip(names, [float(v) for v in values]))
+
+def _process_batch(windowed, engine, **cmdargs):
+  """
+  Computes the spectra of windowed, a list of the output of _window_data
+  that all have the same number of samples and sampling frequency, in one
+  call. Returns a list of (inputfile, datadict).
+  """
+  fs = windowed[0][2]
+  nsamples = len(windowed[0][1])
+
+  stack = np.empty((len(windowed), nsamples), dtype=engine.dtype)
+  for idx, w in enumerate(windowed):
+    stack[idx] = w[1]
+
+  freqs, psmat, names, bandmat, summary_names, summarymat = _compute_spectra(stack, fs, engine, cmdargs, overwrite_x=True)
+
+  results = list()
+  for (inputfile, _, fs, window, trigtime), ps, bandvec, summaryvec in zip(windowed, psmat, bandmat, summarymat):
+    bands = _band_dict(names, bandvec)
+    summary = _band_dict(summary_names, summaryvec)
+    results.append((inputfile, _make_datadict(inputfile, freqs, ps, fs, window, trigtime, bands, summary)))
+  return results
+
+def _process_batched(datagen, batch_size, **cmdargs):
+  """
+  Yields (inputfile, datadict) for every item of datagen, in order.
+
+  Windows are collected into batches of up to batch_size and the spectra of
+  a batch are computed in one vectorised call. A batch is cut short when the
+  number of samples or sampling frequency changes.
+  """
+  engine = _get_cmdargs_engine(cmdargs)
+  pending = list()
+  for datatuple in datagen:
+    w = _window_data(*datatuple, **cmdargs)
+    if pending and (len(w[1]) != len(pending[0][1]) or w[2] != pending[0][2]):
+      for result in _process_batch(pending, engine, **cmdargs):
+        yield result
+      pending = list()
+
+    pending.append(w)
+    if len(pending) >= batch_size:
+      for result in _process_batch(pending, engine, **cmdargs):
+        yield result
+      pending = list()
+
+  if pending:
+    for result in _process_batch(pending, engine, **cmdargs):
+      yield result
+
+def _loadtrc(fname, fcontent=None, zipfile=None, window=None):
+  """
+  Yields (name, tvec, yvec, trigtime) for the given file.
+
+  trigtime is seconds since 1970-01-01, see LecroyBinaryWaveform
+  trig_time_epoch, or None for files other than trc files.
+
+  Sequence mode trc files yield once per segment. The name of each segment is
+  fname with -segNNNNN inserted before the extension, and trigtime is the
+  trigger time of that segment.
+
+  zipfile: if given fname is a member of this ZipFile. Members stored
+           without compression are memory mapped out of the archive.
+  window: if given, a 2-tuple of the start_time and exposure_duration
+          command line arguments. Only samples of trc files inside the
+          window, or inside it in each segment, are read and scaled to volts.
+  """
   p('Loading %s'%(fname))
-  from dataloader import DataLoader
-  data = DataLoader(fname, fcontent)
-  tvec = data.matrix[:, 0]
-  yvec = data.matrix[:, 1]
-  if data.source == 'LECROYWR104Xi_binary':
-    trigtime = data.source_obj.TRIG_TIME
-    coupling = data.source_obj.VERT_COUPLING
-    assert coupling in ['DC_50_Ohms', 'DC_1MOhm']
-    if coupling == 'DC_1MOhm':
-      # if coupling is 1 MOhm not 50 MOhm then scale everything down by 2 as the
-      # SRS thinks it is driving a 50 Ohm load with a source impedance of 50 Ohm
-      p('\tCorrecting for 1 MOhm coupling')
-      yvec *= 0.5
+  if not fname.endswith('trc'):
+    from dataloader import DataLoader
+    if zipfile is not None:
+      fcontent = zipfile.read(fname)
+    data = DataLoader(fname, fcontent)
+    yield fname, data.matrix[:, 0], data.matrix[:, 1], None
+    return
+
+  # memory map the samples so only the pages we actually use get read
+  from lecroy import LecroyBinaryWaveform, TimeAxis
+  bwf = LecroyBinaryWaveform(fname, fcontent, mmap=True, zipfile=zipfile)
+
+  coupling = bwf.VERT_COUPLING
+  assert coupling in ['DC_50_Ohms', 'DC_1MOhm']
+  # if coupling is 1 MOhm not 50 MOhm then scale everything down by 2 as the
+  # SRS thinks it is driving a 50 Ohm load with a source impedance of 50 Ohm
+  correct_coupling = coupling == 'DC_1MOhm'
+  if correct_coupling:
+    p('\tCorrecting for 1 MOhm coupling')
+
+  if bwf.is_sequence:
+    from os.path import splitext
+    p('\t%d segments of %d samples'%(bwf.nsegments, bwf.samples_per_segment))
+
+    root, ext = splitext(fname)
+    trigger_times = bwf.segment_trigger_times
+    trigger_offsets = bwf.segment_trigger_offsets
+    for seg, raw in enumerate(bwf.raw_segments):
+      tvec = TimeAxis(trigger_offsets[seg], bwf.HORIZ_INTERVAL, bwf.samples_per_segment)
+      if window is not None:
+        tvec, raw = _window_samples(tvec, raw, window)
+      yvec = bwf.scale(raw)
+      if correct_coupling:
+        yvec *= 0.5
+      trigtime = bwf.trig_time_epoch + trigger_times[seg]
+      yield '%s-seg%05d%s'%(root, seg, ext), tvec, yvec, trigtime
   else:
-    trigtime = None
+    tvec = bwf.time_axis
+    raw = bwf.raw_wave_array
+    if window is not None:
+      tvec, raw = _window_samples(tvec, raw, window)
+    yvec = bwf.scale(raw)
+    if correct_coupling:
+      yvec *= 0.5
+    yield fname, tvec, yvec, bwf.trig_time_epoch
 
-  return tvec, yvec, trigtime
+def _list_inputs(inputfilelist, glob, catalog=False):
+  """
+  Returns the inputs to process as a list of (zipname, filename), where
+  zipname is None unless filename is a member of zip archive zipname.
 
-def _generate_data(inputfilelist, glob):
+  With catalog, .trc files are in order of trigger time, see trc_catalog.py,
+  and other inputs follow them in the order they were given.
+  """
   iszip = inputfilelist[0].endswith('zip')
 
   if iszip:
+    zipname = inputfilelist[0]
     from zipfile import ZipFile
     import fnmatch
-    zf = ZipFile(inputfilelist[0])
-    filenamelist = fnmatch.filter(zf.namelist(), glob)
-    for filename in filenamelist:
-      filecontent = zf.read(filename)
-      tvec, yvec, trigtime = _loadtrc(filename, filecontent)
-      yield filename, tvec, yvec, trigtime
+    filenamelist = fnmatch.filter(ZipFile(zipname).namelist(), glob)
+    if catalog:
+      from trc_catalog import build_catalog, is_trc
+      others = [filename for filename in filenamelist if not is_trc(filename)]
+      filenamelist = list(build_catalog(zipname, glob)['name']) + others
+    return [(zipname, filename) for filename in filenamelist]
+  else:
+    if catalog:
+      from trc_catalog import sort_by_trigtime, is_trc
+      others = [inputfile for inputfile in inputfilelist if not is_trc(inputfile)]
+      inputfilelist = sort_by_trigtime([inputfile for inputfile in inputfilelist if is_trc(inputfile)]) + others
+
+    return [(None, inputfile) for inputfile in inputfilelist]
+
+_zipfiles = dict()
+def _open_zip(zipname):
+  """
+  Returns a ZipFile for zipname, reusing one already opened by this process.
+  The ZipFile is opened by name, so each member read opens its own file
+  handle and -prefetch reader threads can share it.
+  """
+  if zipname not in _zipfiles:
+    from zipfile import ZipFile
+    _zipfiles[zipname] = ZipFile(zipname)
+  return _zipfiles[zipname]
+
+def _load_input(zipname, filename, window=None):
+  zf = None
+  if zipname is not None:
+    zf = _open_zip(zipname)
+  return _loadtrc(filename, zipfile=zf, window=window)
+
+def _load_inputs(inputs, window=None, prefetch_depth=0, prefetch_bytes=None, prefetch_threads=1):
+  """
+  Yields the output of _loadtrc for each (zipname, filename) in inputs
+
+  If prefetch_depth > 0, inputs are loaded in full by prefetch_threads
+  reader threads while earlier inputs are processed, see prefetch.py.
+  """
+  if prefetch_depth > 0:
+    from prefetch import prefetch
+    def load(inp):
+      return list(_load_input(inp[0], inp[1], window))
+    loaded = prefetch(load, inputs, prefetch_depth, prefetch_bytes, prefetch_threads)
+  else:
+    loaded = (_load_input(zipname, filename, window) for zipname, filename in inputs)
+
+  for datatuples in loaded:
+    for datatuple in datatuples:
+      yield datatuple
+
+def _generate_data(inputfilelist, glob, catalog=False, window=None):
+  return _load_inputs(_list_inputs(inputfilelist, glob, catalog), window)
+
+def _cmdargs_window(cmdargs):
+  """
+  Returns the window argument of _loadtrc given the command line arguments
+  """
+  return cmdargs['start_time'], cmdargs['exposure_duration']
+
+def _load_cmdargs_inputs(inputs, cmdargs):
+  """
+  _load_inputs with the window and prefetching given by the command line
+  arguments
+  """
+  prefetch_bytes = None
+  if cmdargs['prefetch_mb'] is not None:
+    prefetch_bytes = int(cmdargs['prefetch_mb'] * 2**20)
+  return _load_inputs(inputs,
+                      _cmdargs_window(cmdargs),
+                      cmdargs['prefetch'],
+                      prefetch_bytes,
+                      cmdargs['prefetch_threads'])
+
+def _process_stream(datagen, **cmdargs):
+  """
+  Yields (inputfile, datadict) for each item of datagen, in order
+  """
+  batch_size = cmdargs['batch']
+  if batch_size > 1:
+    for result in _process_batched(datagen, batch_size, **cmdargs):
+      yield result
+  else:
+    for datatuple in datagen:
+      yield datatuple[0], _process_data(*datatuple, **cmdargs)
+
+_worker_cmdargs = None
+def _worker_init(cmdargs):
+  global _worker_cmdargs
+  _worker_cmdargs = cmdargs
+
+def _worker_process(inputs):
+  """
+  Processes a chunk of inputs in a worker process and returns the list of
+  (inputfile, datadict). Zip members are read by the worker itself.
+  """
+  cmdargs = _worker_cmdargs
+  datagen = _load_cmdargs_inputs(inputs, cmdargs)
+  return list(_process_stream(datagen, **cmdargs))
+
+def _process_parallel(inputs, **cmdargs):
+  """
+  Yields (inputfile, datadict) for each of inputs, processed by a pool of
+  -jobs worker processes. Results are yielded in input order.
+
+  Each worker is sent chunks of -batch inputs, so batching still applies.
+  """
+  from multiprocessing import Pool
+  chunksize = max(1, cmdargs['batch'])
+  chunks = [inputs[i:i+chunksize] for i in range(0, len(inputs), chunksize)]
+
+  pool = Pool(cmdargs['jobs'], initializer=_worker_init, initargs=(cmdargs,))
+  try:
+    for results in pool.imap(_worker_process, chunks):
+      for result in results:
+        yield result
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+def _merged_outputfile(inputfilelist, suffix):
+  from os.path import splitext, extsep, basename
+  if len(inputfilelist) > 1:
+    filename0, _ = splitext(inputfilelist[0])
+    filenamelast, _ = splitext(inputfilelist[-1])
+    filename0, filenamelast = map(basename, (filename0, filenamelast))
+    name = filename0 + '__' + filenamelast
   else:
-    for inputfile in inputfilelist:
-      tvec, yvec, trigtime = _loadtrc(inputfile)
-      yield inputfile, tvec, yvec, trigtime
+    name = basename(inputfilelist[0])
+
+  return name + suffix + extsep + OUTPUT_EXT
+
+def _make_store_writer(storepath, **cmdargs):
+  from spectrum_store import StoreWriter
+  dtype = np.float32 if cmdargs['float32'] else np.float64
+  return StoreWriter(storepath,
+                     dtype=dtype,
+                     resume=cmdargs['resume'] is not None,
+                     start_time=cmdargs['start_time'],
+                     exposure_duration=cmdargs['exposure_duration'],
+                     welch=cmdargs['welch'],
+                     welch_overlap=cmdargs['welch_overlap'],
+                     max_freq_bins=cmdargs['max_freq_bins'],
+                     drive_freq=cmdargs['drive_freq'],
+                     band_width=cmdargs['band_width'],
+                     nharmonics=cmdargs['nharmonics'])
+
+def _input_sources(inputs):
+  """
+  Returns a dictionary mapping the filename of each of inputs to (source,
+  size, mtime), where source is the real path of the file, or
+  zipname/filename for zip members with zipname a real path, so the same
+  file has the same source however it was named on the command line.
+  """
+  import os
+  import calendar
+  sources = dict()
+  for zipname, filename in inputs:
+    if zipname is None:
+      st = os.stat(filename)
+      sources[filename] = (os.path.realpath(filename), st.st_size, st.st_mtime)
+    else:
+      info = _open_zip(zipname).getinfo(filename)
+      mtime = calendar.timegm(info.date_time + (0, 0, 0))
+      sources[filename] = (os.path.realpath(zipname) + '/' + filename, info.file_size, mtime)
+  return sources
+
+def _segment_file(name):
+  """
+  Returns the name of the file the segment name was made from by _loadtrc,
+  or name if it is not a segment
+  """
+  import re
+  m = re.match(r'^(.*)-seg\d{5}(\.[^./]*)?$', name)
+  if m is None:
+    return name
+  return m.group(1) + (m.group(2) or '')
+
+def _resume_inputs(writer, inputs, sources):
+  """
+  Returns the inputs whose spectra are not in the store of writer or are out
+  of date. Spectra of changed inputs are set to be replaced.
+  """
+  pending = list()
+  for zipname, filename in inputs:
+    source, size, mtime = sources[filename]
+    if writer.is_current(source, size, mtime):
+      continue
+    writer.replace(source)
+    pending.append((zipname, filename))
+
+  p('%d of %d inputs are new or changed'%(len(pending), len(inputs)))
+  return pending
+
+def _store_add(writer, datadict, sources):
+  header = datadict['header']
+  data = datadict['data']
+  inputfile = header['input_file']
+  if inputfile not in sources:
+    inputfile = _segment_file(inputfile)
+  source, size, mtime = sources[inputfile]
+
+  writer.add(data[:, 0],
+             data[:, 1],
+             header['input_file'],
+             header['trigtime_epoch'],
+             header['sampling_freq'],
+             header['window'],
+             source=source,
+             size=size,
+             mtime=mtime,
+             bands=[(name, header['bands'][name]) for name in BAND_NAMES if name in header['bands']],
+             summary=sorted(header['summary'].items()))
+
+def _store_results(writer, results, sources):
+  """
+  Adds results to the store of writer. If processing fails or is interrupted
+  the spectra of inputs that were completed are still saved, so a -resume
+  run carries on from there.
+  """
+  try:
+    for _, datadict in results:
+      _store_add(writer, datadict, sources)
+  except:
+    writer.abort()
+    raise
+  writer.close()
+
+def _watch_ready(path, size):
+  """
+  Returns True if all the samples of the trc file at path, which is size
+  bytes long, have been written
+  """
+  from lecroy import LecroyBinaryWaveform, WAVEDESC_SIZE
+  # the WAVEDESC block starts within the first 50 bytes
+  if size < 50 + WAVEDESC_SIZE:
+    return False
+  try:
+    bwf = LecroyBinaryWaveform(path, header_only=True)
+  except Exception:
+    # not a valid trc file, processing the file reports it
+    return True
+  return size >= bwf.data_end
+
+def _watch_poll(dirname, glob, writer, lastseen, done):
+  """
+  Returns the inputs in dirname that are ready to be processed. lastseen and
+  done map paths to the (size, mtime) they had at the last poll and when
+  they were processed.
+  """
+  import os
+  import fnmatch
+  pending = list()
+  for name in sorted(fnmatch.filter(os.listdir(dirname), glob)):
+    if not name.endswith('trc'):
+      continue
+
+    path = os.path.join(dirname, name)
+    try:
+      st = os.stat(path)
+    except OSError:
+      # removed since listdir
+      continue
+
+    key = (st.st_size, st.st_mtime)
+    if done.get(path) == key:
+      continue
+
+    if writer.is_current(os.path.realpath(path), *key):
+      done[path] = key
+    elif lastseen.get(path) == key and _watch_ready(path, st.st_size):
+      pending.append((None, path))
+
+    lastseen[path] = key
+
+  return pending
+
+def _watch(dirname, writer, **cmdargs):
+  """
+  Processes trc files as they are written to dirname until interrupted. See
+  Watch Mode above.
+  """
+  import time
+  window = _cmdargs_window(cmdargs)
+  lastseen = dict()
+  done = dict()
+
+  p('Watching %s, ^C to stop'%(dirname))
+  try:
+    while True:
+      pending = _watch_poll(dirname, cmdargs['glob'], writer, lastseen, done)
+      if not pending:
+        time.sleep(cmdargs['poll_interval'])
+        continue
+
+      sources = _input_sources(pending)
+      for zipname, filename in pending:
+        source, size, mtime = sources[filename]
+        try:
+          results = list(_process_stream(_load_inputs([(zipname, filename)], window), **cmdargs))
+        except Exception as e:
+          # one bad file, e.g. a truncated one, should not end the watch or
+          # lose the spectra already in the store
+          p('Skipping %s: %s: %s'%(filename, type(e).__name__, e))
+          done[filename] = (size, mtime)
+          continue
+
+        writer.replace(source)
+
+        for inputfile, datadict in results:
+          _store_add(writer, datadict, sources)
+          header = datadict['header']
+          print '%s\t%s\t%g'%(inputfile, header['trigtime'], header['bands']['total'])
+        writer.flush()
+        sys.stdout.flush()
+        done[filename] = (size, mtime)
+  except KeyboardInterrupt:
+    pass
+
+  writer.close()
+  p('Saved merged data to %s'%(writer.path))
 
 if __name__ == '__main__':
   parser = get_commandline_parser()
@@ -221,45 +1117,71 @@ if __name__ == '__main__':
   start_at = cmdargs['start_at']
 
   from os.path import splitext, extsep, basename
+  if cmdargs['watch'] is not None:
+    from os.path import normpath
+    from spectrum_store import STORE_EXT
+    if cmdargs['resume'] is None:
+      cmdargs['resume'] = basename(normpath(cmdargs['watch'])) + suffix + extsep + OUTPUT_EXT + STORE_EXT
+    sys.exit(_watch(cmdargs['watch'], _make_store_writer(cmdargs['resume'], **cmdargs), **cmdargs))
+
   inputfilelist = cmdargs['inputfiles']
-  for idx, datatuple in enumerate(_generate_data(inputfilelist, cmdargs['glob'])):
-    if stop_after is not None and idx >= stop_after:
-      break
+  assert len(inputfilelist) > 0, 'No input files given'
+  from itertools import islice
+  inputs = _list_inputs(inputfilelist, cmdargs['glob'], cmdargs['catalog'])
 
-    if idx < start_at:
-      continue
+  store_writer = None
+  if cmdargs['resume'] is not None:
+    store_writer = _make_store_writer(cmdargs['resume'], **cmdargs)
+  elif should_merge and cmdargs['merge_format'] == 'store':
+    from spectrum_store import STORE_EXT
+    storepath = _merged_outputfile(inputfilelist, suffix) + STORE_EXT
+    store_writer = _make_store_writer(storepath, **cmdargs)
 
-    datadict = _process_data(*datatuple, **cmdargs)
-    inputfile = datatuple[0]
+  if store_writer is not None:
+    sources = _input_sources(inputs)
+    if cmdargs['resume'] is not None:
+      inputs = _resume_inputs(store_writer, inputs, sources)
 
-    if should_merge:
-      mergedict[inputfile] = datadict
-    else:
-      filename, _ = splitext(inputfile)
-      filename = basename(filename)
-      outputfile = filename + suffix + extsep + OUTPUT_EXT
+  jobs = cmdargs['jobs']
+  if jobs > 1:
+    # every input gives at least one spectrum, so inputs beyond stop_after
+    # are never needed
+    if stop_after is not None:
+      inputs = inputs[:stop_after]
+    results = _process_parallel(inputs, **cmdargs)
+    results = islice(results, start_at, stop_after)
+  else:
+    datagen = _load_cmdargs_inputs(inputs, cmdargs)
+    datagen = islice(datagen, start_at, stop_after)
+    results = _process_stream(datagen, **cmdargs)
 
-      if cmdargs['npz']:
-        np.savez_compressed(outputfile, **datadict)
-        p('\tWrote power spectrum to %s.npz'%(outputfile))
+  if store_writer is not None:
+    _store_results(store_writer, results, sources)
+  else:
+    for inputfile, datadict in results:
+      if should_merge:
+        mergedict[inputfile] = datadict
       else:
-        import json
-        header = json.dumps(datadict['header'])
-        outmat = datadict['data']
-        np.savetxt(outputfile, outmat, delimiter=' ', header=header)
-        p('\tWrote power spectrum to %s'%(outputfile))
-
-  if should_merge:
-    if len(inputfilelist) > 1:
-      filename0, _ = splitext(inputfilelist[0])
-      filenamelast, _ = splitext(inputfilelist[-1])
-      filename0, filenamelast = map(basename, (filename0, filenamelast))
-      name = filename0 + '__' + filenamelast
-    else:
-      name = basename(inputfilelist[0])
+        filename, _ = splitext(inputfile)
+        filename = basename(filename)
+        outputfile = filename + suffix + extsep + OUTPUT_EXT
+
+        if cmdargs['npz']:
+          np.savez_compressed(outputfile, **datadict)
+          p('\tWrote power spectrum to %s.npz'%(outputfile))
+        else:
+          import json
+          header = json.dumps(datadict['header'])
+          outmat = datadict['data']
+          np.savetxt(outputfile, outmat, delimiter=' ', header=header)
+          p('\tWrote power spectrum to %s'%(outputfile))
 
-    outputfile = name + suffix + extsep + OUTPUT_EXT
+  if store_writer is not None:
+    p('Saved merged data to %s'%(store_writer.path))
+  elif should_merge:
+    outputfile = _merged_outputfile(inputfilelist, suffix)
 
     np.savez_compressed(outputfile, **mergedict)
+    _save_summary(outputfile, mergedict)
     p('Saved merged data to %s.npz'%(outputfile))
 
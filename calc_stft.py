@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Computes a short time Fourier transform (STFT) spectrogram of a single long
+Lecroy trc record.
+
+The record is cut into windows of segment_duration that overlap by the
+fraction given by -overlap, and the power spectrum of every window is
+computed the same way as calc_power_spectrum.py does for a whole file: the
+mean is removed, no windowing function is applied, and the spectrum is one
+sided with units of V^2/Hz. Band integrals are computed with every spectrum,
+see calc_power_spectrum.band_matrix, before -max_freq_bins averages adjacent
+frequency bins.
+
+Samples are streamed from the file in blocks of -windows_per_block windows,
+so records larger than memory can be processed. The windows of a block are
+strided views of it and their spectra are computed in one batched real FFT.
+
+segment_duration supports the same suffixes as calc_power_spectrum.py, e.g.
+10u is 10e-6 seconds. It is rounded to a whole number of samples.
+
+The output is a spectrum store, see spectrum_store.py, named after the input
+with extension .stft.spectra, that plot_spectrogram.py renders. Each window
+is one spectrum, named like the input with -winNNNNNNNNN inserted before the
+extension. Its trigtime is trig_time_epoch plus the time of the first sample
+of the window, and window_start and window_end are the times of its first
+and last samples relative to the trigger.
+
+Trigger times as float seconds since epoch only resolve about 0.24 us, so
+windows must start at least that far apart, or trigtimes would repeat or run
+backwards and the spectrogram could not be plotted. Shorter hops are
+rejected. window_start and window_end are exact whatever the hop.
+"""
+
+import numpy as np
+
+OUTPUT_EXT = 'stft'
+
+def p(s):
+  import sys
+  sys.stderr.write(s + '\n')
+
+def iter_stft(bwf, nperseg, hop, engine, windows_per_block=256):
+  """
+  Yields (start_index, psmat) for blocks of consecutive windows of bwf, a
+  LecroyBinaryWaveform, where psmat is (windows, nperseg//2 + nperseg%2) and
+  start_index the index of the first window in the block. Window i starts at
+  sample i*hop.
+  """
+  from numpy.lib.stride_tricks import as_strided
+  block_samples = nperseg + hop * (windows_per_block - 1)
+  fs = 1.0/bwf.HORIZ_INTERVAL
+
+  index = 0
+  for _, block in bwf.iter_blocks(block_samples, overlap=nperseg - hop):
+    if len(block) < nperseg:
+      break
+
+    nwindows = (len(block) - nperseg)//hop + 1
+    windows = as_strided(block,
+                         shape=(nwindows, nperseg),
+                         strides=(hop * block.strides[0], block.strides[0]))
+    yield index, engine.power(windows, fs)
+    index += nwindows
+
+    # the next block starts at the next window, so a short block is the
+    # last one
+    if nwindows < windows_per_block:
+      break
+
+def calc_stft(outputpath, **cmdargs):
+  """
+  Computes the STFT of the input file given by the command line arguments
+  and saves it as a spectrum store at outputpath. Returns the SpectrumStore.
+  """
+  import os
+  from lecroy import LecroyBinaryWaveform
+  from spectrum_store import SpectrumStore
+  from calc_power_spectrum import get_engine, band_matrix, decimate_spectrum, parse_number
+
+  inputfile = cmdargs['inputfile']
+  segment_duration = parse_number(cmdargs['segment_duration'])
+
+  bwf = LecroyBinaryWaveform(inputfile, header_only=True)
+  assert not bwf.is_sequence, 'STFT of sequence mode files is not supported'
+
+  coupling = bwf.VERT_COUPLING
+  assert coupling in ['DC_50_Ohms', 'DC_1MOhm']
+  # see calc_power_spectrum._loadtrc, volts are halved for 1 MOhm coupling
+  # which quarters the power
+  power_scale = 0.25 if coupling == 'DC_1MOhm' else 1.0
+
+  interval = bwf.HORIZ_INTERVAL
+  nperseg = int(round(segment_duration/interval))
+  hop = nperseg - int(cmdargs['overlap'] * nperseg)
+  assert nperseg >= 2, 'segment_duration is shorter than 2 samples'
+  assert hop >= 1, 'overlap must be less than 1'
+  assert nperseg <= bwf.nsamples, 'segment_duration is longer than the record'
+
+  nwindows = (bwf.nsamples - nperseg)//hop + 1
+  # trigtimes of consecutive windows must differ, see the module docstring
+  trigtime = bwf.trig_time_epoch
+  resolution = np.spacing(trigtime + bwf.HORIZ_OFFSET + nwindows * hop * interval)
+  assert hop * interval >= resolution, 'Windows start every %g s, which trigger times as seconds since epoch cannot resolve (%g s). Use a longer segment_duration or less overlap'%(hop * interval, resolution)
+
+  fs = 1.0/interval
+  p('%s: %d samples at %.2f MHz'%(inputfile, bwf.nsamples, fs/1e6))
+  p('\t%d windows of %d samples every %d samples (%g s)'%(nwindows, nperseg, hop, hop*interval))
+
+  dtype = np.float32 if cmdargs['float32'] else np.float64
+  engine = get_engine(dtype)
+  freqs = engine.frequencies(nperseg, fs)
+  names, matrix = band_matrix(freqs,
+                              cmdargs['drive_freq'],
+                              cmdargs['band_width'],
+                              cmdargs['nharmonics'],
+                              dtype)
+
+  max_freq_bins = cmdargs['max_freq_bins']
+  store = SpectrumStore.create(outputpath,
+                               decimate_spectrum(freqs, freqs, max_freq_bins)[0],
+                               dtype,
+                               source='calc_stft.py',
+                               bands=names,
+                               segment_duration=nperseg*interval,
+                               overlap=cmdargs['overlap'],
+                               max_freq_bins=max_freq_bins,
+                               drive_freq=cmdargs['drive_freq'],
+                               band_width=cmdargs['band_width'],
+                               nharmonics=cmdargs['nharmonics'])
+
+  root, ext = os.path.splitext(inputfile)
+  st = os.stat(inputfile)
+
+  for index, psmat in iter_stft(bwf, nperseg, hop, engine, cmdargs['windows_per_block']):
+    if power_scale != 1.0:
+      psmat *= power_scale
+
+    indices = np.arange(index, index + len(psmat))
+    starts = bwf.HORIZ_OFFSET + indices * hop * interval
+
+    names = ['%s-win%09d%s'%(root, idx, ext) for idx in indices]
+    store.fit_strings(input_file=names, source=[inputfile])
+    records = store.make_records(len(psmat))
+    records['input_file'] = names
+    records['source'] = inputfile
+    records['size'] = st.st_size
+    records['mtime'] = st.st_mtime
+    records['trigtime'] = trigtime + starts
+    records['sampling_freq'] = fs
+    records['window_start'] = starts
+    records['window_end'] = starts + (nperseg - 1) * interval
+
+    bands = np.dot(psmat, matrix)
+    _, psmat = decimate_spectrum(freqs, psmat, max_freq_bins)
+    store.append(psmat, records, bands)
+    p('\t%d/%d windows'%(index + len(psmat), nwindows))
+
+  return store
+
+def parse_commandline_arguments():
+  parser = get_commandline_parser()
+  cmdargs = vars(parser.parse_args())
+  return cmdargs
+
+def get_commandline_parser():
+  import argparse
+  parser = argparse.ArgumentParser(description='Computes the STFT spectrogram of a long Lecroy trc record into a spectrum store')
+  parser.add_argument('segment_duration', type=str, help='Duration of each STFT window')
+  parser.add_argument('inputfile', type=str, help='Lecroy trc file')
+  parser.add_argument('-overlap', type=float, default=0.5, help='Fraction of each window that overlaps the next. Defaults to 0.5')
+  parser.add_argument('-windows_per_block', type=int, default=256, help='Number of windows read and transformed at once. Larger blocks use more memory. Defaults to 256')
+  parser.add_argument('-max_freq_bins', type=int, default=None, help='If given adjacent frequency bins are averaged so spectra have no more than this many bins')
+  parser.add_argument('-float32', action='store_true', help='If given spectra are computed and saved in single precision')
+  parser.add_argument('-suffix', type=str, default='', help='If given output will be added to file name just before .stft')
+  parser.add_argument('-drive_freq', type=float, default=None, help='Ultrasound drive frequency in Hz, see calc_power_spectrum.py')
+  parser.add_argument('-band_width', type=float, default=None, help='Width in Hz of the bands around each (sub|ultra)harmonic. Defaults to drive_freq/10')
+  parser.add_argument('-nharmonics', type=int, default=10, help='Number of harmonics of drive_freq to integrate. Defaults to 10')
+
+  return parser
+
+def main(**cmdargs):
+  from os.path import splitext, basename, extsep
+  from spectrum_store import STORE_EXT
+
+  name, _ = splitext(basename(cmdargs['inputfile']))
+  outputpath = name + cmdargs['suffix'] + extsep + OUTPUT_EXT + STORE_EXT
+
+  store = calc_stft(outputpath, **cmdargs)
+  p('Saved %d spectra to %s'%(len(store), outputpath))
+
+if __name__ == '__main__':
+  import sys
+  cmdargs = parse_commandline_arguments()
+  sys.exit(main(**cmdargs))
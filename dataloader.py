@@ -8,8 +8,11 @@ class DataLoader(object):
   """
   _datafilepath = None
 
-  # data matrix
-  matrix = None
+  # data matrix, see the matrix property
+  _matrix = None
+
+  # callable that builds the data matrix on first access, if any
+  _make_matrix = None
 
   # string identifying the source of the data
   source = None
@@ -24,11 +27,12 @@ class DataLoader(object):
   # labels for the x and y axys
   xy_labels = None
 
-  def __init__(self, datafilepath, file_content=None):
+  def __init__(self, datafilepath, file_content=None, header_only=False):
     """
     Creates a data loader for the given file. The resulting object
     will expose:
-      - matrix: numpy array
+      - matrix: numpy array. For Lecroy trc files this is only built when
+                first accessed
       - source: string identifying source of the data, determined from content
                 and extension of datafilepath
       - header: data metadata as a string, which maybe a JSON string.
@@ -38,6 +42,9 @@ class DataLoader(object):
     datafilepath: path to the datafile
     file_content: content of the file. If given no attempt will be made to load
                  the file from disk
+    header_only: if True and the source supports it only the metadata is
+                 loaded and matrix will be None. Currently only Lecroy trc
+                 files support this.
     """
 
     self._datafilepath = datafilepath
@@ -65,8 +72,9 @@ class DataLoader(object):
 
     if datafilepath.endswith('trc'):
       from lecroy import LecroyBinaryWaveform
-      bwave = LecroyBinaryWaveform(datafilepath, file_content)
-      matrix = bwave.mat
+      bwave = LecroyBinaryWaveform(datafilepath, file_content, mmap=True, header_only=header_only)
+      if not header_only:
+        self._make_matrix = lambda: bwave.mat
       source = 'LECROYWR104Xi_binary'
       source_obj = bwave
       xylabel = 'Time (seconds)', 'Voltage (V)'
@@ -82,6 +90,14 @@ class DataLoader(object):
       else:
         source = None
 
+      if source == 'lecroy.py':
+        from lecroy import load_npz
+        time_axis, yvec, header = load_npz(npzfile)
+        matrix = np.empty((len(time_axis), 2))
+        matrix[:, 0] = time_axis.values
+        matrix[:, 1] = yvec
+        xylabel = 'Time (seconds)', 'Voltage (V)'
+
       if source == 'fig2npz.py':
         matrix = npzfile['data']
         xylabel = npzfile['xlabel'], npzfile['ylabel']
@@ -136,11 +152,20 @@ class DataLoader(object):
       import json
       header = json.dumps(header, indent=1, sort_keys=True)
 
-    assert matrix is not None
+    assert matrix is not None or self._make_matrix is not None or header_only
     assert type(header) == str
 
-    self.matrix = matrix
+    self._matrix = matrix
     self.header = header
     self.source = source
     self.source_obj = source_obj
     self.xy_labels = xylabel
+
+  @property
+  def matrix(self):
+    """
+    Data matrix. Built on first access when the source supports it.
+    """
+    if self._matrix is None and self._make_matrix is not None:
+      self._matrix = self._make_matrix()
+    return self._matrix
@@ -12,9 +12,97 @@ def read_timetrace(filename):
   bwf = LecroyBinaryWaveform(filename)
   return bwf.WAVE_ARRAY_1_time, bwf.WAVE_ARRAY_1.ravel()
 
+def zip_member_offset(zf, name):
+  """
+  Returns the offset in the archive file of the data of member name of
+  ZipFile zf if the member is stored uncompressed, None otherwise.
+  """
+  import zipfile
+  import struct
+  info = zf.getinfo(name)
+  if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+    return None
+
+  # the local file header can have a different extra field to the central
+  # directory, so the data offset has to come from the local header
+  with open(zf.filename, 'rb') as fh:
+    fh.seek(info.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader, fh.read(zipfile.sizeFileHeader))
+
+  return (info.header_offset +
+          zipfile.sizeFileHeader +
+          fheader[zipfile._FH_FILENAME_LENGTH] +
+          fheader[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+class _MemberFile(object):
+  """
+  File-like object over the part of a file starting at base, so that
+  offsets within a zip member can be used as is.
+  """
+  def __init__(self, fh, base):
+    super(_MemberFile, self).__init__()
+    self.fh = fh
+    self.base = base
+    self.fh.seek(base)
+
+  def seek(self, addr):
+    self.fh.seek(self.base + addr)
+
+  def read(self, nbytes):
+    return self.fh.read(nbytes)
+
+  def close(self):
+    self.fh.close()
+
+class _StreamFile(object):
+  """
+  File-like object over a stream that can only be read forwards, such as a
+  compressed zip member. Seeking forwards skips data, seeking backwards
+  starts the stream again.
+  """
+  def __init__(self, opener):
+    super(_StreamFile, self).__init__()
+    self.opener = opener
+    self.fh = opener()
+    self.pos = 0
+
+  def seek(self, addr):
+    if addr < self.pos:
+      self.fh.close()
+      self.fh = self.opener()
+      self.pos = 0
+
+    while self.pos < addr:
+      n = len(self.fh.read(min(addr - self.pos, 1 << 20)))
+      if n == 0:
+        break
+      self.pos += n
+
+  def read(self, nbytes):
+    s = self.fh.read(nbytes)
+    self.pos += len(s)
+    return s
+
+  def close(self):
+    self.fh.close()
+
 from contextlib import contextmanager
 @contextmanager
-def _open(filename, file_content):
+def _open(filename, file_content, zipfile=None, member_offset=None):
+  """
+  Opens the trace as a file-like object where offset 0 is the start of the
+  trace. If zipfile is given filename is a member of it, and member_offset
+  the offset of its data in the archive if it is stored uncompressed.
+  """
+  if zipfile is not None and file_content is None:
+    if member_offset is None:
+      fh = _StreamFile(lambda: zipfile.open(filename))
+    else:
+      fh = _MemberFile(open(zipfile.filename, 'rb'), member_offset)
+    yield fh
+    fh.close()
+    return
+
   if file_content is None:
     fh = open(filename, 'rb')
     yield fh
@@ -29,6 +117,208 @@ def _open(filename, file_content):
     yield fh
     fh.close()
 
+# Size of the WAVEDESC block of the LECROY_2_3 template
+WAVEDESC_SIZE = 346
+
+# (name, format, offset) of the WAVEDESC fields we decode. Formats are given
+# without byte order, which is dictated by COMM_ORDER
+_WAVEDESC_FIELDS = [
+  ('TEMPLATE_NAME',       'S16',  16),
+  ('COMM_TYPE',           'u2',   32),
+  ('COMM_ORDER',          'u2',   34),
+  ('WAVE_DESCRIPTOR',     'i4',   36),
+  ('USER_TEXT',           'i4',   40),
+  ('RES_DESC1',           'i4',   44),
+  ('TRIGTIME_ARRAY',      'i4',   48),
+  ('RIS_TIME_ARRAY',      'i4',   52),
+  ('RES_ARRAY1',          'i4',   56),
+  ('WAVE_ARRAY_1',        'i4',   60),
+  ('INSTRUMENT_NAME',     'S16',  76),
+  ('INSTRUMENT_NUMBER',   'i4',   92),
+  ('TRACE_LABEL',         'S16',  96),
+  ('SUBARRAY_COUNT',      'i4',   144),
+  ('VERTICAL_GAIN',       'f4',   156),
+  ('VERTICAL_OFFSET',     'f4',   160),
+  ('HORIZ_INTERVAL',      'f4',   176),
+  ('HORIZ_OFFSET',        'f8',   180),
+  # time_stamp: seconds, minutes, hours, days, months, year
+  ('TRIGGER_TIME',        [('second', 'f8'),
+                           ('minute', 'u1'),
+                           ('hour',   'u1'),
+                           ('day',    'u1'),
+                           ('month',  'u1'),
+                           ('year',   'i2')], 296),
+  ('RECORD_TYPE',         'u2',   316),
+  ('PROCESSING_DONE',     'u2',   318),
+  ('VERT_COUPLING',       'u2',   326),
+  ('FIXED_VERT_GAIN',     'u2',   332),
+  ('WAVE_SOURCE',         'u2',   344),
+]
+
+def _make_wavedesc_dtype(byteorder):
+  def with_order(fmt):
+    if type(fmt) == list:
+      return [(name, byteorder + f) for name, f in fmt]
+    return byteorder + fmt
+
+  return np.dtype(dict(names=[f[0] for f in _WAVEDESC_FIELDS],
+                       formats=[with_order(f[1]) for f in _WAVEDESC_FIELDS],
+                       offsets=[f[2] for f in _WAVEDESC_FIELDS],
+                       itemsize=WAVEDESC_SIZE))
+
+# keyed by HIFIRST
+_WAVEDESC_DTYPES = {True: _make_wavedesc_dtype('>'),
+                    False: _make_wavedesc_dtype('<')}
+
+COUPLING_DESC = ['DC_50_Ohms',
+                 'ground',
+                 'DC_1MOhm',
+                 'ground',
+                 'AC_1MOhm']
+
+PROCESSING_DESC = ['no_processing',
+                   'fir_filter',
+                   'interpolated',
+                   'sparsed',
+                   'autoscaled',
+                   'no_result',
+                   'rolling',
+                   'cumulative']
+
+RECORD_TYPES = ['single_sweep',
+                'interleaved',
+                'histogram',
+                'graph',
+                'filter_coefficient',
+                'complex',
+                'extrema',
+                'sequence_obsolete',
+                'centered_RIS',
+                'peak_detect']
+
+def _make_timestamp(ts):
+  """
+  Turns a decoded time_stamp into a datetime
+  """
+  from datetime import datetime
+  second = ts['second']
+  s = int(second)
+  us = int((second - s) * 1000000)
+  return datetime(ts['year'], ts['month'], ts['day'], ts['hour'], ts['minute'], s, us)
+
+def _make_epoch(ts):
+  """
+  Turns a decoded time_stamp into float seconds since 1970-01-01. Seconds
+  are truncated to whole microseconds as by _make_timestamp, so
+  epoch_to_datetime gives the same datetime back. Float seconds since epoch
+  cannot resolve much less than a microsecond anyway.
+  """
+  return datetime_to_epoch(_make_timestamp(ts))
+
+def datetime_to_epoch(dt):
+  """
+  Converts a trigger time into float seconds since 1970-01-01. The scope
+  clock has no timezone so none is applied.
+  """
+  from datetime import datetime
+  return (dt - datetime(1970, 1, 1)).total_seconds()
+
+def epoch_to_datetime(t):
+  """
+  Inverse of datetime_to_epoch, rounded to the nearest microsecond
+  """
+  from datetime import datetime, timedelta
+  return datetime(1970, 1, 1) + timedelta(seconds=float(t))
+
+def trigtimes_to_epoch(trigtimes):
+  """
+  Returns trigtimes as an array of float seconds since 1970-01-01.
+
+  trigtimes is a sequence of seconds since 1970-01-01, datetimes, or
+  str(datetime) as in the headers of power spectra saved by older versions
+  of calc_power_spectrum.py. Strings are parsed all at once as numpy
+  datetime64, with or without microseconds, rather than one at a time with
+  strptime. None and 'None' give NaN.
+  """
+  trigtimes = np.asarray(trigtimes)
+  if trigtimes.dtype.kind in 'fiu':
+    return trigtimes.astype(np.float64)
+
+  if trigtimes.dtype.kind in 'SU':
+    trigtimes = np.where(trigtimes == trigtimes.dtype.type('None'), 'NaT', trigtimes)
+  stamps = trigtimes.astype('datetime64[us]')
+  epoch = stamps.astype(np.int64) / 1e6
+  epoch[np.isnat(stamps)] = np.nan
+  return epoch
+
+class TimeAxis(object):
+  """
+  Time of each sample of a uniformly sampled waveform, described by
+  (offset, interval, n) rather than an array:
+
+    t[i] = offset + i * interval, 0 <= i < n
+
+  Indexing with an integer gives the time of that sample, indexing with a
+  slice gives another TimeAxis. Use values, or np.asarray, to get an array.
+  """
+  def __init__(self, offset, interval, n):
+    super(TimeAxis, self).__init__()
+    self.offset = np.float64(offset)
+    self.interval = np.float64(interval)
+    self.n = int(n)
+
+  def __len__(self):
+    return self.n
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      start, stop, step = idx.indices(self.n)
+      n = max(0, (stop - start + step - (1 if step > 0 else -1)) // step)
+      return TimeAxis(self[start] if n else self.offset, self.interval * step, n)
+
+    if idx < 0:
+      idx += self.n
+    if not 0 <= idx < self.n:
+      raise IndexError('index out of range')
+    return idx * self.interval + self.offset
+
+  def __array__(self, dtype=None):
+    values = self.values
+    if dtype is not None:
+      values = values.astype(dtype)
+    return values
+
+  def __repr__(self):
+    return 'TimeAxis(offset=%r, interval=%r, n=%d)'%(self.offset, self.interval, self.n)
+
+  @property
+  def values(self):
+    return np.arange(self.n) * self.interval + self.offset
+
+  def index(self, t):
+    """
+    Returns the index of the first sample at or after time t, which is n if
+    there is no such sample.
+    """
+    idx = int(np.ceil((t - self.offset) / self.interval))
+    idx = min(max(idx, 0), self.n)
+
+    # guard against rounding so the result agrees with comparing against
+    # values
+    while idx > 0 and self[idx-1] >= t:
+      idx -= 1
+    while idx < self.n and self[idx] < t:
+      idx += 1
+
+    return idx
+
+  def window(self, start_time, end_time):
+    """
+    Returns the slice of samples with start_time <= t < end_time
+    """
+    start = self.index(start_time)
+    return slice(start, max(start, self.index(end_time)))
+
 class LecroyBinaryWaveform(object):
   """
   Implemented according to specs at:
@@ -40,91 +330,114 @@ class LecroyBinaryWaveform(object):
     http://qtwork.tudelft.nl/gitdata/users/guen/qtlabanalysis/analysis_modules/general/lecroy.py
   """
 
-  def __init__(self, inputfilename, file_content=None):
+  def __init__(self, inputfilename, file_content=None, mmap=False, header_only=False, zipfile=None):
     """
     inputfilename: path to .trc file to read
     file_content: if given, will be used in place of data on disk. Useful when
                   loading data from zips
+    mmap: if True the samples are not read into memory. Instead the sample
+          block is memory mapped from disk (or viewed in place when
+          file_content is given) and exposed unscaled via raw_wave_array.
+          Scaling to volts only happens when WAVE_ARRAY_1 is accessed.
+    header_only: if True only the WAVEDESC block is read. Metadata such as
+                 TRIG_TIME is available but the samples are not.
+    zipfile: if given, inputfilename is the name of a member of this
+             ZipFile. Members stored uncompressed are read, or memory
+             mapped, in place from the archive. Compressed members are
+             streamed, so only the parts needed are decompressed.
     """
     super(LecroyBinaryWaveform, self).__init__()
 
-    with _open(inputfilename, file_content) as fh:
-      self.fh = fh
-      header = self.fh.read(50)
-      self.aWAVEDESC = header.decode('ascii').find('WAVEDESC')
+    self._inputfilename = inputfilename
+    self._file_content = file_content
+    self._zipfile = zipfile
+    self._member_offset = None
+    if zipfile is not None and file_content is None:
+      self._member_offset = zip_member_offset(zipfile, inputfilename)
 
-      def at(offset):
-        return self.aWAVEDESC + offset
+    self._header_only = header_only
+    self._WAVE_ARRAY_1 = None
+    self._raw_wave_array = None
 
-      # the lecroy format says COMM_ORDER is an enum, which is a 16 bit
-      # value and therefore subject to endianness. However COMM_ORDER
-      # dictates the endianness! However, since the possible values are
-      # either 0, which is the same in either endianness, or 0x1 or 0x7000
-      # in big/small endianness, we can just check for 0. Since all read_*
-      # methods needs a define endianness, we can default to 0 and not
-      # worry about being wrong because of the preceding argument.
-
-      # XXX The attribute names are important! Any attribute that is all
-      # caps and does not start with '_' is considered metadata and will
-      # be exported as part of the metadata property. This means it will
-      # also be written to file when saving as CSV
-
-      self.COMM_ORDER             = 0
+    with self._open_source() as fh:
+      self.fh = fh
+      # the WAVEDESC block starts within the first 50 bytes, so one read
+      # gets us the whole descriptor
+      header = self.fh.read(50 + WAVEDESC_SIZE)
+      self.aWAVEDESC = header[:50].decode('ascii').find('WAVEDESC')
+      self._read_wavedesc(header[self.aWAVEDESC:self.aWAVEDESC+WAVEDESC_SIZE])
+
+      self._data_offset = self.aWAVEDESC + (self._WAVE_DESCRIPTOR_SIZE +
+                                            self._USER_TEXT_SIZE +
+                                            self._TRIGTIME_ARRAY_SIZE)
+
+      self._TRIGTIME_ARRAY = None
+      if self._TRIGTIME_ARRAY_SIZE > 0:
+        self._TRIGTIME_ARRAY = self.read_trigtime_array(self.aWAVEDESC +
+                                                        self._WAVE_DESCRIPTOR_SIZE +
+                                                        self._USER_TEXT_SIZE)
+
+      if not header_only and not mmap:
+        self._WAVE_ARRAY_1 = self.read_wave_array(self._data_offset)
+    self.fh = None
 
-      # We do a double read because after the first read, we will know the
-      # correct endianness based on the above argument, and therefore will
-      # have the correct value for COMM_ORDER. Otherwise 1 becomes 0x0100
-      # iff in little endian mode.
-      self.COMM_ORDER             = self.read_enum(at(34))
-      self.COMM_ORDER             = self.read_enum(at(34))
+    if not header_only and mmap:
+      self._raw_wave_array = self._map_wave_array()
 
+  def _read_wavedesc(self, wavedesc):
+    """
+    Decodes the WAVEDESC block in one go and sets the corresponding
+    attributes.
+    """
+    assert len(wavedesc) == WAVEDESC_SIZE, 'Truncated WAVEDESC block'
 
-      self.TEMPLATE_NAME          = self.read_string(at(16))
-      self.COMM_TYPE              = self.read_enum(at(32))
-      self._WAVE_DESCRIPTOR_SIZE  = self.read_long(at(36))
-      self._USER_TEXT_SIZE        = self.read_long(at(40))
-      self._RES_DESC1_SIZE        = self.read_long(at(44))
-      self._TRIGTIME_ARRAY_SIZE   = self.read_long(at(48))
-      self._RIS_TIME_ARRAY_SIZE   = self.read_long(at(52))
-      self._RES_ARRAY1_SIZE       = self.read_long(at(56))
-      self._WAVE_ARRAY_1_SIZE     = self.read_long(at(60))
+    # the lecroy format says COMM_ORDER is an enum, which is a 16 bit
+    # value and therefore subject to endianness. However COMM_ORDER
+    # dictates the endianness! However, since the possible values are
+    # either 0, which is the same in either endianness, or 0x1 or 0x7000
+    # in big/small endianness, we can just check for 0.
+    hifirst = wavedesc[34:36] == b'\x00\x00'
+    desc = np.frombuffer(wavedesc, dtype=_WAVEDESC_DTYPES[hifirst])[0]
 
-      self.INSTRUMENT_NAME        = self.read_string(at(76))
-      self.INSTRUMENT_NUMBER      = self.read_long(at(92))
+    # XXX The attribute names are important! Any attribute that is all
+    # caps and does not start with '_' is considered metadata and will
+    # be exported as part of the metadata property. This means it will
+    # also be written to file when saving as CSV
 
-      self.WAVE_SOURCE            = self.read_enum(at(344))
+    self.COMM_ORDER             = desc['COMM_ORDER']
 
-      self.TRACE_LABEL            = self.read_string(at(96))
+    self.TEMPLATE_NAME          = desc['TEMPLATE_NAME']
+    self.COMM_TYPE              = desc['COMM_TYPE']
+    self._WAVE_DESCRIPTOR_SIZE  = desc['WAVE_DESCRIPTOR']
+    self._USER_TEXT_SIZE        = desc['USER_TEXT']
+    self._RES_DESC1_SIZE        = desc['RES_DESC1']
+    self._TRIGTIME_ARRAY_SIZE   = desc['TRIGTIME_ARRAY']
+    self._RIS_TIME_ARRAY_SIZE   = desc['RIS_TIME_ARRAY']
+    self._RES_ARRAY1_SIZE       = desc['RES_ARRAY1']
+    self._WAVE_ARRAY_1_SIZE     = desc['WAVE_ARRAY_1']
+    self._SUBARRAY_COUNT        = desc['SUBARRAY_COUNT']
 
-      self.TRIG_TIME              = self.read_timestamp(at(296))
+    self.INSTRUMENT_NAME        = desc['INSTRUMENT_NAME']
+    self.INSTRUMENT_NUMBER      = desc['INSTRUMENT_NUMBER']
 
-      self.RECORD_TYPE            = self.read_record_type(at(316))
-      self.PROCESSING_DONE        = self.read_processing_done(at(318))
+    self.WAVE_SOURCE            = desc['WAVE_SOURCE']
 
-      self.VERTICAL_GAIN          = self.read_float(at(156))
-      self.VERTICAL_OFFSET        = self.read_float(at(160))
+    self.TRACE_LABEL            = desc['TRACE_LABEL']
 
-      self.FIXED_VERT_GAIN        = self.read_enum(at(332))
+    self.TRIG_TIME              = _make_timestamp(desc['TRIGGER_TIME'])
 
-      self.HORIZ_INTERVAL         = self.read_float(at(176))
-      self.HORIZ_OFFSET           = self.read_double(at(180))
+    self.RECORD_TYPE            = RECORD_TYPES[desc['RECORD_TYPE']]
+    self.PROCESSING_DONE        = PROCESSING_DESC[desc['PROCESSING_DONE']]
 
-      self.VERT_COUPLING            = self.read_vert_coupling(at(326))
+    self.VERTICAL_GAIN          = desc['VERTICAL_GAIN']
+    self.VERTICAL_OFFSET        = desc['VERTICAL_OFFSET']
 
-      a_WAVE_ARRAY_1             = at(self._WAVE_DESCRIPTOR_SIZE +
-                                      self._USER_TEXT_SIZE +
-                                      self._TRIGTIME_ARRAY_SIZE)
+    self.FIXED_VERT_GAIN        = desc['FIXED_VERT_GAIN']
 
-###      print '_WAVE_DESCRIPTOR_SIZE', self._WAVE_DESCRIPTOR_SIZE
-###      print '_USER_TEXT_SIZE', self._USER_TEXT_SIZE
-###      print '_RES_DESC1_SIZE', self._RES_DESC1_SIZE
-###      print '_TRIGTIME_ARRAY_SIZE', self._TRIGTIME_ARRAY_SIZE
-###      print '_RIS_TIME_ARRAY_SIZE', self._RIS_TIME_ARRAY_SIZE
-###      print '_RES_ARRAY1_SIZE', self._RES_ARRAY1_SIZE
-###      print '_WAVE_ARRAY_1_SIZE', self._WAVE_ARRAY_1_SIZE
+    self.HORIZ_INTERVAL         = desc['HORIZ_INTERVAL']
+    self.HORIZ_OFFSET           = desc['HORIZ_OFFSET']
 
-      self._WAVE_ARRAY_1 = self.read_wave_array(a_WAVE_ARRAY_1)
-    self.fh = None
+    self.VERT_COUPLING          = COUPLING_DESC[desc['VERT_COUPLING']]
 
   @property
   def sampling_frequency(self):
@@ -138,18 +451,216 @@ class LecroyBinaryWaveform(object):
   def HIFIRST(self):
     return self.COMM_ORDER == 0
 
+  @property
+  def data_offset(self):
+    """
+    Offset in bytes of the first sample from the start of the trace
+    """
+    return self._data_offset
+
+  @property
+  def data_end(self):
+    """
+    Offset in bytes just past the last sample of WAVE_ARRAY_1. A trace file
+    shorter than this has not been completely written.
+    """
+    return self._data_offset + self._WAVE_ARRAY_1_SIZE
+
+  @property
+  def nsamples(self):
+    """
+    Number of samples in WAVE_ARRAY_1
+    """
+    return self._WAVE_ARRAY_1_SIZE // self._sample_dtype.itemsize
+
+  @property
+  def _sample_dtype(self):
+    if self.COMM_TYPE == 0:
+      return np.dtype(self._make_fmt('i1'))
+    else:
+      return np.dtype(self._make_fmt('i2'))
+
   @property
   def WAVE_ARRAY_1(self):
+    """
+    Samples in volts. When the waveform was opened with mmap=True the scaling
+    is done on every access, so hold on to the result if you need it more
+    than once.
+    """
+    assert not self._header_only, 'Samples not loaded: opened with header_only=True'
+    if self._WAVE_ARRAY_1 is None:
+      return self.scale(self.raw_wave_array).reshape(1, -1)
     return self._WAVE_ARRAY_1
 
+  @property
+  def raw_wave_array(self):
+    """
+    1-D array of the unscaled int8/int16 samples. When opened with mmap=True
+    this is a read-only view onto the file and no data is read until it is
+    indexed. Otherwise the samples are read again from the source.
+    """
+    assert not self._header_only, 'Samples not loaded: opened with header_only=True'
+    if self._raw_wave_array is None:
+      with self._open_source() as fh:
+        fh.seek(self._data_offset)
+        s = fh.read(self._WAVE_ARRAY_1_SIZE)
+      return np.fromstring(s, dtype=self._sample_dtype)
+    return self._raw_wave_array
+
+  @property
+  def is_sequence(self):
+    """
+    True if this is a sequence (segmented) acquisition
+    """
+    return self._TRIGTIME_ARRAY is not None
+
+  @property
+  def nsegments(self):
+    """
+    Number of segments, which is 1 unless this is a sequence acquisition
+    """
+    if self._TRIGTIME_ARRAY is None:
+      return 1
+    return len(self._TRIGTIME_ARRAY)
+
+  @property
+  def samples_per_segment(self):
+    return self.nsamples // self.nsegments
+
+  @property
+  def trig_time_epoch(self):
+    """
+    TRIG_TIME as float seconds since 1970-01-01, see datetime_to_epoch
+    """
+    return datetime_to_epoch(self.TRIG_TIME)
+
+  @property
+  def segment_trigger_times(self):
+    """
+    Time in seconds of each segment's trigger relative to the first trigger,
+    which is TRIG_TIME.
+    """
+    if self._TRIGTIME_ARRAY is None:
+      return np.zeros(1)
+    return self._TRIGTIME_ARRAY[:, 0]
+
+  @property
+  def segment_trigger_offsets(self):
+    """
+    Time in seconds from each segment's trigger to its first sample, i.e. the
+    HORIZ_OFFSET of each segment.
+    """
+    if self._TRIGTIME_ARRAY is None:
+      return np.array([self.HORIZ_OFFSET], dtype=np.float64)
+    return self._TRIGTIME_ARRAY[:, 1]
+
+  @property
+  def raw_segments(self):
+    """
+    Unscaled samples as a (nsegments, samples_per_segment) array. This is a
+    view of raw_wave_array, so it is memory mapped when raw_wave_array is.
+    """
+    raw = self.raw_wave_array
+    return raw[:self.nsegments * self.samples_per_segment].reshape(self.nsegments, -1)
+
+  @property
+  def segments(self):
+    """
+    Samples in volts as a (nsegments, samples_per_segment) array
+    """
+    return self.scale(self.raw_segments)
+
+  def _open_source(self):
+    return _open(self._inputfilename, self._file_content, self._zipfile, self._member_offset)
+
+  def read_window(self, start_time, end_time):
+    """
+    Returns (time_axis, yvec) for the samples with start_time <= t < end_time,
+    where time_axis is a TimeAxis and yvec is in volts.
+
+    Only the samples inside the window are read from the source, which may be
+    a fraction of the record. This works even if the waveform was opened with
+    header_only=True. Sequence mode segments are not treated specially.
+    """
+    time_axis = self.time_axis
+    window = time_axis.window(start_time, end_time)
+
+    if self._WAVE_ARRAY_1 is not None:
+      return time_axis[window], self._WAVE_ARRAY_1.ravel()[window]
+
+    if self._raw_wave_array is not None:
+      raw = self._raw_wave_array[window]
+    else:
+      dtype = self._sample_dtype
+      with self._open_source() as fh:
+        fh.seek(self._data_offset + window.start * dtype.itemsize)
+        s = fh.read((window.stop - window.start) * dtype.itemsize)
+      raw = np.fromstring(s, dtype=dtype)
+
+    return time_axis[window], self.scale(raw)
+
+  def iter_blocks(self, block_samples, overlap=0):
+    """
+    Yields (start_time, block) where block is at most block_samples samples
+    in volts, and start_time the time of its first sample. Consecutive blocks
+    share overlap samples. The last block may be shorter than block_samples.
+
+    Samples are read sequentially from the source, so no more than
+    block_samples samples are held in memory at once. This works even if the
+    waveform was opened with header_only=True. Sequence mode segments are
+    not treated specially, blocks run over the concatenated segments.
+    """
+    assert block_samples > 0
+    assert 0 <= overlap < block_samples, 'overlap must be less than block_samples'
+
+    step = block_samples - overlap
+    dtype = self._sample_dtype
+    remaining = self.nsamples
+    start = 0
+    tail = None
+
+    with self._open_source() as fh:
+      fh.seek(self._data_offset)
+      nread = block_samples
+      while remaining > 0:
+        n = min(nread, remaining)
+        raw = np.fromstring(fh.read(n * dtype.itemsize), dtype=dtype)
+        if len(raw) == 0:
+          break
+        remaining -= len(raw)
+
+        if tail is not None:
+          raw = np.concatenate((tail, raw))
+        if overlap > 0:
+          tail = raw[len(raw)-overlap:]
+
+        yield self.HORIZ_OFFSET + start * self.HORIZ_INTERVAL, self.scale(raw)
+
+        start += step
+        nread = step
+
+  def scale(self, raw):
+    """
+    Converts raw samples to volts
+    """
+    # as per documentation, the actual value is gain * data - offset
+    return self.VERTICAL_GAIN * raw - self.VERTICAL_OFFSET
+
+  @property
+  def time_axis(self):
+    """
+    TimeAxis of WAVE_ARRAY_1, based on HORIZ_OFFSET and HORIZ_INTERVAL.
+    """
+    return TimeAxis(self.HORIZ_OFFSET, self.HORIZ_INTERVAL, self.nsamples)
+
   @property
   def WAVE_ARRAY_1_time(self):
     """
     A calculated array of when each sample in wave_form_1 was measured,
-    based on HORIZ_OFFSET and HORIZ_INTERVAL.
+    based on HORIZ_OFFSET and HORIZ_INTERVAL. Prefer time_axis, which does
+    not materialise the array.
     """
-    tvec = np.arange(0, self._WAVE_ARRAY_1.size)
-    return tvec * self.HORIZ_INTERVAL + self.HORIZ_OFFSET
+    return self.time_axis.values
 
   @property
   def metadata(self):
@@ -165,10 +676,14 @@ class LecroyBinaryWaveform(object):
 
   @property
   def mat(self):
-    x = np.reshape(self.WAVE_ARRAY_1_time, (-1, 1))
-    y = np.reshape(self.WAVE_ARRAY_1, (-1, 1))
+    """
+    (N, 2) matrix of time and voltage. This is built on every access.
+    """
+    mat = np.empty((self.nsamples, 2))
+    mat[:, 0] = self.time_axis.values
+    mat[:, 1] = self.WAVE_ARRAY_1.ravel()
 
-    return np.column_stack((x,y))
+    return mat
 
   @property
   def comments(self):
@@ -187,6 +702,38 @@ class LecroyBinaryWaveform(object):
     All headers will be prepended with '#'
     """
     mat = self.mat
+    header = self._export_header()
+
+    np.savetxt(csvfname, mat, delimiter=',', header=header)
+
+  def savenpz(self, npzfname):
+    """
+    Saves the binary waveform as an uncompressed NPZ of the raw samples. This
+    is far faster to write and read than CSV, and about the size of the trc
+    file. The NPZ contains:
+
+      - raw: the unscaled int8/int16 samples
+      - VERTICAL_GAIN, VERTICAL_OFFSET: volts = gain * raw - offset
+      - HORIZ_OFFSET, HORIZ_INTERVAL: sample i is at offset + i * interval
+      - TRIGTIME_ARRAY: only for sequence mode, see read_trigtime_array
+      - header: metadata as a JSON string, as used for CSV export
+      - source: 'lecroy.py'
+
+    Use load_npz or DataLoader to read it back.
+    """
+    arrays = dict(raw=self.raw_wave_array,
+                  VERTICAL_GAIN=self.VERTICAL_GAIN,
+                  VERTICAL_OFFSET=self.VERTICAL_OFFSET,
+                  HORIZ_OFFSET=self.HORIZ_OFFSET,
+                  HORIZ_INTERVAL=self.HORIZ_INTERVAL,
+                  header=self._export_header(),
+                  source='lecroy.py')
+    if self._TRIGTIME_ARRAY is not None:
+      arrays['TRIGTIME_ARRAY'] = self._TRIGTIME_ARRAY
+
+    np.savez(npzfname, **arrays)
+
+  def _export_header(self):
     metadata = self.metadata
     jmeta = dict()
     for name, value in metadata.items():
@@ -196,9 +743,7 @@ class LecroyBinaryWaveform(object):
     jmeta['AUTHOR'] = '@freespace'
 
     import json
-    header = json.dumps(jmeta, sort_keys=True, indent=1)
-
-    np.savetxt(csvfname, mat, delimiter=',', header=header)
+    return json.dumps(jmeta, sort_keys=True, indent=1)
 
   def _make_fmt(self, fmt):
     if self.HIFIRST:
@@ -233,90 +778,121 @@ class LecroyBinaryWaveform(object):
   def read_string(self, addr, length=16):
     return self._read(addr, length, 'S%d'%(length))
 
-  def read_timestamp(self, addr):
-    second  = self.read_double(addr)
-    addr += 8 # double is 64 bits = 8 bytes
-
-    minute  = self.read_byte(addr)
-    addr   += 1
-
-    hour    = self.read_byte(addr)
-    addr   += 1
-
-    day     = self.read_byte(addr)
-    addr   += 1
-
-    month   = self.read_byte(addr)
-    addr   += 1
-
-    year    = self.read_word(addr)
-    addr   += 2
-
-    from datetime import datetime
-    s = int(second)
-    us = int((second - s) * 1000000)
-    return datetime(year, month, day, hour, minute, s, us)
+  def read_timestamp(self, addr, epoch=False):
+    """
+    Returns the time_stamp at addr as a datetime, or if epoch is True as
+    float seconds since 1970-01-01, see _make_epoch.
+    """
+    self.fh.seek(addr)
+    s = self.fh.read(16)
+    ts = np.frombuffer(s, dtype=_WAVEDESC_DTYPES[self.HIFIRST]['TRIGGER_TIME'])[0]
+    if epoch:
+      return _make_epoch(ts)
+    return _make_timestamp(ts)
 
   def read_vert_coupling(self, addr):
-    v = self.read_enum(addr)
-    coupling_desc = ['DC_50_Ohms',
-                     'ground',
-                     'DC_1MOhm',
-                     'ground',
-                     'AC_1MOhm']
-    return coupling_desc[v]
+    return COUPLING_DESC[self.read_enum(addr)]
 
   def read_processing_done(self, addr):
-    v = self.read_enum(addr)
-    processsing_desc = ['no_processing',
-                        'fir_filter',
-                        'interpolated',
-                        'sparsed',
-                        'autoscaled',
-                        'no_result',
-                        'rolling',
-                        'cumulative']
-    return processsing_desc[v]
+    return PROCESSING_DESC[self.read_enum(addr)]
 
   def read_record_type(self, addr):
-    v = self.read_enum(addr)
-    record_types = ['single_sweep',
-                    'interleaved',
-                    'histogram',
-                    'graph',
-                    'filter_coefficient',
-                    'complex',
-                    'extrema',
-                    'sequence_obsolete',
-                    'centered_RIS',
-                    'peak_detect']
-    return record_types[v]
+    return RECORD_TYPES[self.read_enum(addr)]
+
+  def read_trigtime_array(self, addr):
+    """
+    Returns the TRIGTIME array as a (nsegments, 2) array. The first column is
+    TRIGGER_TIME and the second TRIGGER_OFFSET.
+    """
+    self.fh.seek(addr)
+    s = self.fh.read(self._TRIGTIME_ARRAY_SIZE)
+    return np.fromstring(s, dtype=self._make_fmt('f8')).reshape(-1, 2)
 
   def read_wave_array(self, addr):
     self.fh.seek(addr)
     s = self.fh.read(self._WAVE_ARRAY_1_SIZE)
-    nsamples = self._WAVE_ARRAY_1_SIZE
-    if self.COMM_TYPE == 0:
-      fmt = self._make_fmt('i1')
-    else:
-      fmt = self._make_fmt('i2')
-      # if each sample is a 2 bytes, then we have
-      # half as many samples as there are bytes in the wave
-      # array
-      nsamples //= 2
-    dt = np.dtype((fmt, nsamples))
+    dt = np.dtype((self._sample_dtype, self.nsamples))
     data = np.fromstring(s, dtype=dt)
 
-    # as per documentation, the actual value is gain * data - offset
-    return self.VERTICAL_GAIN * data - self.VERTICAL_OFFSET
+    return self.scale(data)
+
+  def _map_wave_array(self):
+    """
+    Returns the raw samples without reading them. Files on disk and zip
+    members stored uncompressed are memory mapped, file_content is viewed in
+    place. Compressed zip members cannot be mapped, so their samples are
+    streamed into memory.
+    """
+    if self._file_content is None and self._zipfile is None:
+      return np.memmap(self._inputfilename,
+                       dtype=self._sample_dtype,
+                       mode='r',
+                       offset=self._data_offset,
+                       shape=(self.nsamples,))
+    elif self._file_content is None and self._member_offset is not None:
+      return np.memmap(self._zipfile.filename,
+                       dtype=self._sample_dtype,
+                       mode='r',
+                       offset=self._member_offset + self._data_offset,
+                       shape=(self.nsamples,))
+    elif self._file_content is None:
+      with self._open_source() as fh:
+        fh.seek(self._data_offset)
+        s = fh.read(self._WAVE_ARRAY_1_SIZE)
+      return np.frombuffer(s, dtype=self._sample_dtype)
+    else:
+      return np.frombuffer(self._file_content,
+                           dtype=self._sample_dtype,
+                           count=self.nsamples,
+                           offset=self._data_offset)
+
+def load_npz(npz):
+  """
+  Reads back a waveform saved by LecroyBinaryWaveform.savenpz. npz is a
+  filename or an already loaded NPZ.
+
+  Returns (time_axis, yvec, header) where time_axis is a TimeAxis, yvec the
+  samples in volts and header the metadata JSON string.
+  """
+  if not hasattr(npz, 'files'):
+    npz = np.load(npz)
+
+  raw = npz['raw']
+  yvec = npz['VERTICAL_GAIN'][()] * raw - npz['VERTICAL_OFFSET'][()]
+  time_axis = TimeAxis(npz['HORIZ_OFFSET'][()], npz['HORIZ_INTERVAL'][()], len(raw))
+
+  return time_axis, yvec, str(npz['header'][()])
+
+def _convert(task):
+  """
+  Converts a trace, task being (tracefile, format). Runs in worker processes
+  so needs to be at module level.
+  """
+  tf, fmt = task
+  if fmt == 'csv':
+    outputfile = tf + '.csv'
+    LecroyBinaryWaveform(tf).savecsv(outputfile)
+  else:
+    outputfile = tf + '.npz'
+    LecroyBinaryWaveform(tf, mmap=True).savenpz(outputfile)
+  return outputfile
 
 def parse_commandline_arguments():
   import argparse
-  parser = argparse.ArgumentParser(description='Reads binary Lecroy DSO traces and converts them to CSV')
+  parser = argparse.ArgumentParser(description='Reads binary Lecroy DSO traces and converts them to CSV or NPZ')
   parser.add_argument('-csv',
                       action='store_true',
                       help='Converts inputs to csv. Outputs to the same filename with .csv appended')
 
+  parser.add_argument('-npz',
+                      action='store_true',
+                      help='Converts inputs to npz holding the raw samples and scaling. Outputs to the same filename with .npz appended')
+
+  parser.add_argument('-jobs',
+                      type=int,
+                      default=1,
+                      help='Number of processes to convert with. Defaults to 1')
+
   parser.add_argument('-trigtime',
                       action='store_true',
                       help='Print the trigtime of inputs')
@@ -329,14 +905,32 @@ def parse_commandline_arguments():
 def main(**cmdargs):
   tracefiles = cmdargs['traces']
   print_trigtime = cmdargs['trigtime']
-  convert_csv = cmdargs['csv']
+  jobs = cmdargs['jobs']
+
+  convert = None
+  if cmdargs['csv']:
+    convert = 'csv'
+  elif cmdargs['npz']:
+    convert = 'npz'
+
+  if convert is not None:
+    tasks = [(tf, convert) for tf in tracefiles]
+    if jobs > 1:
+      from multiprocessing import Pool
+      pool = Pool(jobs)
+      results = pool.imap(_convert, tasks)
+    else:
+      from itertools import imap
+      results = imap(_convert, tasks)
+
+    for outputfile in results:
+      print 'Wrote', outputfile
 
   for tf in tracefiles:
-    bwf = LecroyBinaryWaveform(tf)
+    # the samples are not needed to show metadata
+    bwf = LecroyBinaryWaveform(tf, header_only=True)
 
-    if convert_csv:
-      bwf.savecsv(tf+'.csv')
-    else:
+    if convert is None:
       print 'Metadata:'
       for key,value in bwf.metadata.items():
         print '%s=%s'%(key, value)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Loads traces of the same trigger recorded on several channels of a Lecroy
+DSO as one array.
+
+The scope names traces C<channel><name>.trc, e.g. C1Trace00042.trc and
+C3Trace00042.trc are channels 1 and 3 of the same trigger. Files are grouped
+on <name> and the directory they are in, and the grouping is confirmed by
+checking that TRIG_TIME agrees.
+
+All channels of a group must share the same timebase, i.e. HORIZ_INTERVAL,
+HORIZ_OFFSET and number of samples, so that the group can be returned as a
+single (channels, samples) array with one lecroy.TimeAxis.
+"""
+
+import os
+import re
+import numpy as np
+
+_CHANNEL_RE = re.compile(r'^C([1-4])(.+)$')
+
+def split_channel(filename):
+  """
+  Returns (channel, key) for a trace filename, where key identifies the
+  trigger, or None if the filename does not follow the C<n> convention.
+  """
+  dirname, name = os.path.split(filename)
+  m = _CHANNEL_RE.match(name)
+  if m is None:
+    return None
+  return int(m.group(1)), os.path.join(dirname, m.group(2))
+
+def group_channel_files(tracefiles):
+  """
+  Groups tracefiles by trigger. Returns a list of (key, filelist) sorted by
+  key, where filelist is a list of (channel, filename) sorted by channel.
+  Files that do not follow the C<n> naming convention are ignored.
+  """
+  groups = dict()
+  for tf in tracefiles:
+    split = split_channel(tf)
+    if split is None:
+      continue
+    channel, key = split
+    groups.setdefault(key, list()).append((channel, tf))
+
+  return [(key, sorted(groups[key])) for key in sorted(groups)]
+
+def load_channel_group(filelist, zipfile=None, max_trigtime_diff=1e-3):
+  """
+  Loads the channels of one trigger and returns (channels, time_axis, data,
+  trigtime) where data has shape (len(channels), nsamples) and is in volts.
+
+  filelist: list of (channel, filename) as produced by group_channel_files
+  zipfile: if given filenames are members of this ZipFile
+  max_trigtime_diff: maximum difference in seconds between the TRIG_TIME of
+                     the channels
+
+  Samples are memory mapped and scaled straight into the output array.
+  """
+  from lecroy import LecroyBinaryWaveform
+
+  channels = [channel for channel, _ in filelist]
+  bwfvec = [LecroyBinaryWaveform(fname, mmap=True, zipfile=zipfile) for _, fname in filelist]
+
+  bwf0 = bwfvec[0]
+  fname0 = filelist[0][1]
+  for (_, fname), bwf in zip(filelist[1:], bwfvec[1:]):
+    assert bwf.HORIZ_INTERVAL == bwf0.HORIZ_INTERVAL, 'HORIZ_INTERVAL of %s differs from %s'%(fname, fname0)
+    assert bwf.HORIZ_OFFSET == bwf0.HORIZ_OFFSET, 'HORIZ_OFFSET of %s differs from %s'%(fname, fname0)
+    assert bwf.nsamples == bwf0.nsamples, 'Number of samples of %s differs from %s'%(fname, fname0)
+
+    dt = abs((bwf.TRIG_TIME - bwf0.TRIG_TIME).total_seconds())
+    assert dt <= max_trigtime_diff, 'TRIG_TIME of %s is %g s from %s'%(fname, dt, fname0)
+
+  row0 = bwf0.scale(bwf0.raw_wave_array)
+  data = np.empty((len(bwfvec), bwf0.nsamples), dtype=row0.dtype)
+  data[0] = row0
+  for idx, bwf in enumerate(bwfvec[1:], 1):
+    data[idx] = bwf.scale(bwf.raw_wave_array)
+
+  return channels, bwf0.time_axis, data, bwf0.TRIG_TIME
+
+def iter_channel_groups(tracefiles, zipfile=None, channels=None, max_trigtime_diff=1e-3):
+  """
+  Yields (key, channels, time_axis, data, trigtime) for every trigger in
+  tracefiles, see load_channel_group.
+
+  channels: if given only these channels are loaded, and triggers missing
+            any of them are skipped
+  """
+  for key, filelist in group_channel_files(tracefiles):
+    if channels is not None:
+      filelist = [(ch, fname) for ch, fname in filelist if ch in channels]
+      if len(filelist) != len(channels):
+        continue
+
+    loaded = load_channel_group(filelist, zipfile, max_trigtime_diff)
+    yield (key,) + loaded
+
+def parse_commandline_arguments():
+  parser = get_commandline_parser()
+  cmdargs = vars(parser.parse_args())
+  return cmdargs
+
+def get_commandline_parser():
+  import argparse
+  parser = argparse.ArgumentParser(description='Groups Lecroy trc files by trigger and checks that the channels of each trigger share a timebase')
+  parser.add_argument('-channels', type=int, nargs='+', default=None, help='If given only these channels are considered')
+  parser.add_argument('-max_trigtime_diff', type=float, default=1e-3, help='Maximum difference in seconds between trigger times of channels of the same trigger. Defaults to 1e-3')
+  parser.add_argument('traces', nargs='+', help='Lecroy binary trc files')
+
+  return parser
+
+def main(**cmdargs):
+  for key, channels, time_axis, data, trigtime in iter_channel_groups(cmdargs['traces'],
+                                                                       channels=cmdargs['channels'],
+                                                                       max_trigtime_diff=cmdargs['max_trigtime_diff']):
+    print '%s\t%s\tchannels=%s\t%d samples'%(key, trigtime, ','.join(map(str, channels)), len(time_axis))
+
+if __name__ == '__main__':
+  import sys
+  cmdargs = parse_commandline_arguments()
+  sys.exit(main(**cmdargs))
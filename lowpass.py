@@ -11,3 +11,22 @@ def lowpassfilter(yvec, sampling_rate, cutoff_freq, order=5):
     b, a = signal.butter(order, cutoff_freq/nyq_freq, 'lowpass')
 
     return signal.lfilter(b, a, yvec)
+
+def lowpassfilter_blocks(blocks, sampling_rate, cutoff_freq, order=5):
+    """
+    Streaming version of lowpassfilter. blocks is an iterable of
+    (start_time, yvec), e.g. LecroyBinaryWaveform.iter_blocks with no
+    overlap. Yields (start_time, filtered yvec) for each block, carrying the
+    filter state across blocks so the result is the same as filtering the
+    whole signal in one go.
+    """
+    nyq_freq = 0.5 * sampling_rate
+    b, a = signal.butter(order, cutoff_freq/nyq_freq, 'lowpass')
+
+    zi = None
+    for start_time, yvec in blocks:
+        if zi is None:
+            # lfilter starts from rest, so do the same
+            zi = signal.lfiltic(b, a, [])
+        filtered, zi = signal.lfilter(b, a, yvec, zi=zi)
+        yield start_time, filtered
@@ -1,11 +1,25 @@
 #!/usr/bin/env python
 """
 This script takes individual .power.npz files and constructs a spectrogram by
-stacking the power spectrum contained in each file.
+stacking the power spectrum contained in each file. A single merged npz or
+spectrum store, see spectrum_store.py, produced by calc_power_spectrum.py
+-merge can be given instead.
 
 When binning is performed, the timestamp of a bin is the timestamp of the fist
 power spectrum in the bin, and power at each frequency is the _mean_ power at
-each frequency of the power spectrums in the bin.
+each frequency of the power spectrums in the bin. Spectra are binned a chunk
+of -chunk_mb at a time, see spectrogram_binning.py, and a store is read
+straight from its memory map. Each chunk is reduced to the image and to the
+total power of its bins before the next is read, so memory holds a chunk,
+the image and a total per bin, however many spectra there are.
+
+The spectrogram image is reduced to no more than -raster_size pixels, by
+taking the mean, or with -reduce max the max, of blocks of bins and
+frequencies, as matplotlib would throw the extra pixels away anyway. For a
+store or merged npz the image and the power-over-time plot come from a level
+of detail cache kept next to the spectra, see spectrogram_lod.py, which is
+built the first time it is needed. Re-plotting with different cosmetic
+options then does not read the spectra again.
 
 Note that this used to produce spectrograms with a logged colourbar, but this is
 a bad idea b/c it sacrifices visibility of high power signals, which is what
@@ -33,23 +47,31 @@ def savefig(fig, *args, **kwargs):
 
   print 'Plot saved to file:',args[0]
 
-def _process_data(data, header, highpass):
-  hp_filter = data[:,0]<highpass
-  freqvec = data[:,0]
-  powervec = data[:,1]
-
-  powervec[hp_filter] = 0
-
-  trigtimestr = header['trigtime']
-
-  from datetime import datetime
-  # really should standardise on a datetime format, e.g. ISO 8601. However
-  # python is unlikely to change how str(datetime) works so this is probably
-  # ok for now.
-  trigtime = datetime.strptime(trigtimestr, '%Y-%m-%d %H:%M:%S.%f')
-
+def _store_chunks(storepath, head_skip, chunk_bytes):
+  from spectrum_store import SpectrumStore
+  print 'Processing spectrum store'
+  store = SpectrumStore(storepath)
+  print '\t%d spectra'%(len(store))
+  print '\t%d will be skipped'%(head_skip)
+
+  freqs = np.asarray(store.freqs)
+  power = store.power
+  traces = store.traces
+
+  # same order as the sorted keys of a merged npz
+  order = np.argsort(traces['input_file'], kind='mergesort')[head_skip:]
+  chunksize = max(1, chunk_bytes//(power.shape[1] * power.itemsize))
+  for cdx in xrange(0, len(order), chunksize):
+    idx = order[cdx:cdx+chunksize]
+    records = traces[idx]
+    if np.all(np.diff(idx) == 1):
+      # usually the store is in name order already, and a slice of the
+      # memory map avoids the copy of fancy indexing
+      chunk = power[idx[0]:idx[-1]+1]
+    else:
+      chunk = power[idx]
 
-  return freqvec, powervec, trigtime
+    yield freqs, records['input_file'], records['trigtime'], chunk
 
 def _data_generator(powerfilevec, **cmdargs):
   head_skip = cmdargs['head_skip']
@@ -81,89 +103,232 @@ def _data_generator(powerfilevec, **cmdargs):
 
       yield (pfile, data, header)
 
-def plot_spectrogram(**cmdargs):
-  powerfilevec = cmdargs['powerfiles']
+def _spectra_chunks(powerfilevec, **cmdargs):
+  """
+  Yields (freqvec, names, trigtimes, power) for consecutive chunks of the
+  spectra in powerfilevec, where power is (spectra, frequencies) and holds
+  about -chunk_mb MB, and trigtimes are seconds since 1970-01-01.
+  """
+  from spectrum_store import is_store
+  from calc_power_spectrum import header_trigtimes
+  chunk_bytes = int(cmdargs['chunk_mb'] * 2**20)
+  if len(powerfilevec) == 1 and is_store(powerfilevec[0]):
+    for chunk in _store_chunks(powerfilevec[0], cmdargs['head_skip'], chunk_bytes):
+      yield chunk
+    return
+
+  freqvec0 = None
+  names, headers, rows = list(), list(), list()
+  for pfile, data, header in _data_generator(powerfilevec, **cmdargs):
+    if freqvec0 is None:
+      freqvec0 = data[:,0]
+
+    names.append(pfile)
+    headers.append(header)
+    rows.append(data[:,1])
+    if len(rows) * rows[0].nbytes >= chunk_bytes:
+      yield freqvec0, np.array(names), header_trigtimes(headers), np.array(rows)
+      names, headers, rows = list(), list(), list()
+
+  if len(rows):
+    yield freqvec0, np.array(names), header_trigtimes(headers), np.array(rows)
+
+def _raster_layout(nspectra, freqvec, **cmdargs):
+  """
+  Returns (colbins, fstart, fstop, rowsize): the image of the spectrogram has
+  a column for every colbins bins, and a row for every rowsize frequency bins
+  from fstart to fstop-1, so that it is no larger than -raster_size. Both
+  colbins and rowsize are powers of 2, so that they line up with the blocks
+  of the LOD cache.
+  """
+  binsize = cmdargs['binsize']
+  width, height = cmdargs['raster_size']
+  freq_lim = cmdargs['freq_lim']
+
+  nbins = -(-nspectra//binsize)
+  colbins = 1
+  while -(-nbins//colbins) > width:
+    colbins *= 2
+
+  fstart, fstop = 0, len(freqvec)
+  if freq_lim is not None:
+    fstart = np.searchsorted(freqvec, freq_lim[0]*1e6, 'left')
+    fstop = np.searchsorted(freqvec, freq_lim[1]*1e6, 'right')
+    assert fstop > fstart, 'No frequencies within %g..%g MHz'%tuple(freq_lim)
+
+  rowsize = 1
+  while -(-(fstop - fstart)//rowsize) > height:
+    rowsize *= 2
+
+  fstart = fstart//rowsize * rowsize
+  fstop = min(len(freqvec), -(-fstop//rowsize) * rowsize)
+  return colbins, fstart, fstop, rowsize
+
+def _binned_spectrogram(powerfilevec, **cmdargs):
+  """
+  Reduces the spectra a chunk at a time straight to the image, see
+  _raster_layout, and bins their total power in the same pass, so memory use
+  is bounded by -chunk_mb and the size of the image rather than by the
+  number of spectra. Returns (freqvec, bintrigtimes, total_power, image,
+  spec_count, fstart, fstop) where image is (columns, rows).
+  """
+  from spectrogram_binning import SpectrogramBinner, SpectrogramRaster, reduce_blocks
   binsize = cmdargs['binsize']
   max_bins = cmdargs['max_bins']
-  no_debug = cmdargs['no_debug']
-  power_only = cmdargs['power_only']
   max_tduration = cmdargs['max_tduration']
   highpass = cmdargs['highpass']
-  spectrogram_max = cmdargs['spectrogram_max']
+  how = cmdargs['reduce']
+  width, _ = cmdargs['raster_size']
 
-  binpower = None
-  bincount = 0
-  bintrigtime = None
+  # bins the total power of each spectrum, which also keeps track of
+  # max_bins and the trigger time of each bin
+  binner = SpectrogramBinner(binsize, max_bins)
+  raster = SpectrogramRaster(binsize, width, how)
 
   freqvec0 = None
-
   lastrigtime = None
-  starttime = None
-  # contains 2-tuple of (trigger time, power spectrum)
-  powerspecvec = list()
-  spec_count = 0
-  for pfile, data, header in _data_generator(powerfilevec, **cmdargs):
-    freqvec, powervec, trigtime = _process_data(data, header, highpass)
-    spec_count += 1
+  endtime = None
+  for freqvec, names, trigtimes, power in _spectra_chunks(powerfilevec, **cmdargs):
+    if freqvec0 is None:
+      freqvec0 = freqvec
+      # the row layout only depends on the frequencies
+      _, fstart, fstop, rowsize = _raster_layout(1, freqvec0, **cmdargs)
+      # zeroing the frequencies below highpass of every spectrum
+      hpstop = np.searchsorted(freqvec0, highpass, 'left')
+
+    cropped = False
+    if max_tduration is not None:
+      if endtime is None:
+        endtime = trigtimes[0] + max_tduration
+      later = np.flatnonzero(trigtimes > endtime)
+      if len(later):
+        cropped = True
+        trigtimes = trigtimes[:later[0]]
+        power = power[:later[0]]
+
+    total = power[:,hpstop:].sum(axis=1, dtype=np.float64)
+    used = binner.add(trigtimes, total[:,np.newaxis])
+    power = power[:used]
+
+    tile = power[:,fstart:fstop]
+    if hpstop > fstart:
+      tile = np.array(tile)
+      tile[:,:hpstop-fstart] = 0
+    tile, _ = reduce_blocks(tile, rowsize, axis=1, how=how)
+    raster.add(tile)
+
     # enforce the condition that power spectrums are monotically into the
     # future
+    trigtimes = trigtimes[:used]
     if lastrigtime is not None:
-      assert trigtime > lastrigtime, pfile
+      trigtimes = np.append(lastrigtime, trigtimes)
+      names = np.append('', names)
+    notlater = np.flatnonzero(trigtimes[1:] <= trigtimes[:-1])
+    assert len(notlater) == 0, names[notlater[0]+1]
+    lastrigtime = trigtimes[-1]
 
-    if starttime is None:
-      starttime = trigtime
+    if binner.full or cropped:
+      break
 
-    lastrigtime = trigtime
+    import sys
+    sys.stdout.write('.')
+    sys.stdout.flush()
 
-    if binpower is None:
-      binpower = powervec
-      bintrigtime = trigtime
-      bincount = 1
-    else:
-      binpower += powervec
-      bincount += 1
+  print ''
 
-    if freqvec0 is None:
-      freqvec0 = freqvec
+  bintrigtimes, total_power = binner.finish()
+  image = raster.finish()
+  return freqvec0, bintrigtimes, total_power[:,0], image, binner.nspectra, fstart, fstop
 
-    if bincount >= binsize:
-      powerspecvec.append((bintrigtime, binpower/bincount))
-      binpower = None
-      bincount = 0
+def _lod_spectrogram(lod, **cmdargs):
+  """
+  Same as _binned_spectrogram, but from the LOD cache lod. Returns None if
+  the cache has no level that fits the layout of the image.
+  """
+  from spectrogram_binning import bin_spectra
+  binsize = cmdargs['binsize']
+  max_bins = cmdargs['max_bins']
+  max_tduration = cmdargs['max_tduration']
+  head_skip = cmdargs['head_skip']
 
-      if max_bins is not None and len(powerspecvec) >= max_bins:
-        break
+  nspectra = lod.nspectra
+  # same as slicing the sorted spectra with [head_skip:]
+  start = head_skip if head_skip >= 0 else max(0, nspectra + head_skip)
+  stop = nspectra
+  if max_bins is not None:
+    stop = min(stop, start + binsize * max_bins)
+  assert stop > start, 'No spectra left after skipping %d'%(head_skip)
 
-    if (spec_count+1)%10 == 0:
-      import sys
-      sys.stdout.write('.')
-      sys.stdout.flush()
+  trigtime = lod.trigtime
+  # enforce the condition that power spectrums are monotically into the
+  # future
+  notlater = np.flatnonzero(np.diff(trigtime[start:stop]) <= 0)
+  assert len(notlater) == 0, lod.name(start + notlater[0] + 1)
 
-  print ''
+  if max_tduration is not None:
+    stop = min(stop, np.searchsorted(trigtime, trigtime[start] + max_tduration, 'right'))
 
-  # if the last bin is not full it will not have been added, so do it now
-  if binpower is not None:
-    powerspecvec.append((bintrigtime, binpower/bincount))
+  colbins, fstart, fstop, rowsize = _raster_layout(stop - start, lod.freqs, **cmdargs)
+  k = lod.choose_level(start, stop, colbins * binsize, rowsize, cmdargs['highpass'])
+  if k is None:
+    print 'LOD cache has no level for columns of %d spectra and rows of %d bins with -highpass %g'%(colbins * binsize, rowsize, cmdargs['highpass'])
+    return None
 
-  # sort by trigger time
-  powerspecvec.sort(key=lambda x:x[0])
+  print 'Using LOD level %d of %s'%(k, lod.path)
+  image = lod.render(k, start, stop, colbins * binsize, fstart, fstop, rowsize,
+                     how=cmdargs['reduce'],
+                     highpass=cmdargs['highpass'],
+                     chunk_bytes=int(cmdargs['chunk_mb'] * 2**20))
 
-  tstart = powerspecvec[0][0]
-  tend = powerspecvec[-1][0]
+  total = lod.total_above(cmdargs['highpass'])
+  _, total_power = bin_spectra(total[start:stop], binsize)
+  bintrigtimes = np.asarray(trigtime[start:stop:binsize])
+  return lod.freqs, bintrigtimes, total_power, image, stop - start, fstart, fstop
+
+def plot_spectrogram(**cmdargs):
+  powerfilevec = cmdargs['powerfiles']
+  binsize = cmdargs['binsize']
+  max_bins = cmdargs['max_bins']
+  no_debug = cmdargs['no_debug']
+  power_only = cmdargs['power_only']
+  max_tduration = cmdargs['max_tduration']
+  spectrogram_max = cmdargs['spectrogram_max']
+
+  result = None
+  if len(powerfilevec) == 1 and not cmdargs['no_lod']:
+    from spectrogram_lod import open_lod
+    try:
+      lod = open_lod(powerfilevec[0],
+                     rebuild=cmdargs['lod_rebuild'],
+                     chunk_bytes=int(cmdargs['chunk_mb'] * 2**20))
+    except (IOError, OSError) as ex:
+      # e.g. the spectra are on a read only share
+      print 'LOD cache not available:', ex
+    else:
+      result = _lod_spectrogram(lod, **cmdargs)
+
+  if result is None:
+    result = _binned_spectrogram(powerfilevec, **cmdargs)
+
+  freqvec0, bintrigtimes, total_power, image, spec_count, fstart, fstop = result
+
+  from lecroy import epoch_to_datetime
+  tstart = starttime = epoch_to_datetime(bintrigtimes[0])
+  tend = epoch_to_datetime(bintrigtimes[-1])
 
   # turn these into MHz
-  freqstart = freqvec0[0]/1e6
-  freqend = freqvec0[-1]/1e6
+  freqstart = freqvec0[fstart]/1e6
+  freqend = freqvec0[fstop-1]/1e6
 
-  print 'Binned %d power spectrums into %d bins of size %d'%(spec_count, len(powerspecvec), binsize)
+  print 'Binned %d power spectrums into %d bins of size %d'%(spec_count, len(total_power), binsize)
   print '   Duration: %s (%s --> %s)'%(tend - tstart, tstart, tend)
   if max_bins is not None:
     print '   Max bins =', max_bins
 
-  spectrogram = np.column_stack(map(lambda x:x[1], powerspecvec))
+  # frequency along the rows, time along the columns
+  spectrogram = image.T
 
-  tduration = tend - tstart
-  tdurationsecs = tduration.total_seconds()
+  tdurationsecs = bintrigtimes[-1] - bintrigtimes[0]
 
   if max_tduration is not None:
     tdurationsecs = min(tdurationsecs, max_tduration)
@@ -226,7 +391,6 @@ def plot_spectrogram(**cmdargs):
   power_vlines = cmdargs['power_vlines']
   power_ylim = cmdargs['power_ylim']
 
-  total_power = map(lambda x:np.sum(x[1]), powerspecvec)
   plt.subplot(gs[-1])
   dt = tdurationsecs/len(total_power)
   tvec = np.arange(len(total_power)) * dt
@@ -381,7 +545,7 @@ def get_commandline_parser():
 
   parser.add_argument('-no_debug', action='store_true', default=False, help='Debugging information at lower-left will not be plotted.')
 
-  parser.add_argument('-max_tduration', type=float, help='Sets the maximum duration in seconds')
+  parser.add_argument('-max_tduration', type=float, help='Only spectra up to this many seconds after the first are plotted')
 
   parser.add_argument('-highpass', type=float, default=0, help='Removes signals below the specified frequency (Hz)')
 
@@ -400,9 +564,17 @@ def get_commandline_parser():
   parser.add_argument('-ancillary_hline2', type=float, help='Adds a second horizontal line to the ancillary')
   parser.add_argument('-ancillary_xoffset', type=float, help='Offset added to x values of ancillary data')
 
+  parser.add_argument('-freq_lim', type=float, nargs=2, default=None, help='Only frequencies between these two, in MHz, are shown in the spectrogram')
+  parser.add_argument('-raster_size', type=int, nargs=2, default=[1600, 900], help='Maximum width and height in pixels of the spectrogram image. Bins and frequencies are reduced in powers of 2 to fit. Defaults to 1600 900')
+  parser.add_argument('-reduce', choices=['mean', 'max'], default='mean', help='How bins and frequencies are reduced to fit -raster_size. max keeps short bursts visible. Defaults to mean')
+  parser.add_argument('-no_lod', action='store_true', help='If given the LOD cache of a store or merged npz is not used, see spectrogram_lod.py')
+  parser.add_argument('-lod_rebuild', action='store_true', help='If given the LOD cache is rebuilt even if it is up to date')
+
+  parser.add_argument('-chunk_mb', type=float, default=64, help='Spectra are read and binned this many MB at a time, so the spectra themselves never have to fit in memory. Defaults to 64')
+
   parser.add_argument('-head_skip', type=int, default=0, help='Number of files to skip before head of the queue. Files will be sorted before skip is applied. Negative values are allowed, in which case it turns into tail skip')
 
-  parser.add_argument('powerfiles', nargs='+', help='.power.npz files produced by calc_power_spectrum.py')
+  parser.add_argument('powerfiles', nargs='+', help='.power.npz files produced by calc_power_spectrum.py, or a single merged npz or .power.spectra store')
 
   return parser
 
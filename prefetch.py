@@ -0,0 +1,103 @@
+"""
+Read-ahead of slow to load items, e.g. traces on a network share, so that
+loading overlaps with processing.
+
+prefetch(func, items) yields func(item) for each item in order, like
+itertools.imap, while reader threads compute the results of the items that
+follow. Threads help as long as func spends its time waiting on I/O, or in
+code that releases the GIL such as zlib and most of numpy.
+
+The read-ahead is bounded by depth, the number of results computed ahead of
+the one being consumed, and optionally by max_bytes, the memory held by
+results waiting to be consumed as counted by sizeof. The result that is
+needed next is always computed, even if it alone exceeds max_bytes.
+"""
+
+import sys
+import threading
+import numpy as np
+
+def sizeof(obj):
+  """
+  Returns the number of bytes in the numpy arrays in obj, which may be an
+  array or nested tuples and lists of them. Other objects count as 0.
+  """
+  if isinstance(obj, np.ndarray):
+    return obj.nbytes
+  if isinstance(obj, (tuple, list)):
+    return sum(sizeof(o) for o in obj)
+  return 0
+
+def prefetch(func, items, depth=4, max_bytes=None, threads=1):
+  """
+  Yields func(item) for each of items, in order, while up to depth results
+  ahead are computed by threads reader threads. max_bytes, if given, caps
+  the memory held by results waiting to be consumed.
+
+  An exception raised by func is raised when its result would have been
+  yielded. Reader threads stop when the generator is closed or garbage
+  collected.
+  """
+  assert depth > 0
+  assert threads > 0
+
+  items = list(items)
+  results = dict()
+  cond = threading.Condition()
+  # next_item: index of the next item to start on
+  # next_yield: index of the next result to yield
+  # nbytes: memory held by finished results
+  state = dict(next_item=0, next_yield=0, nbytes=0, stop=False)
+
+  def can_start(idx):
+    if idx - state['next_yield'] >= depth:
+      return False
+    if max_bytes is not None and state['nbytes'] >= max_bytes and idx != state['next_yield']:
+      return False
+    return True
+
+  def reader():
+    while True:
+      with cond:
+        while not state['stop'] and state['next_item'] < len(items) and not can_start(state['next_item']):
+          cond.wait()
+        if state['stop'] or state['next_item'] >= len(items):
+          return
+        idx = state['next_item']
+        state['next_item'] += 1
+
+      try:
+        result = (True, func(items[idx]))
+      except Exception:
+        result = (False, sys.exc_info())
+      nbytes = sizeof(result[1]) if result[0] else 0
+
+      with cond:
+        results[idx] = result + (nbytes,)
+        state['nbytes'] += nbytes
+        cond.notify_all()
+
+  for _ in xrange(threads):
+    thread = threading.Thread(target=reader)
+    # so an interrupted program exits without waiting for reads
+    thread.daemon = True
+    thread.start()
+
+  try:
+    for idx in xrange(len(items)):
+      with cond:
+        while idx not in results:
+          # a timeout keeps the wait interruptible with ^C
+          cond.wait(0.1)
+        ok, result, nbytes = results.pop(idx)
+        state['next_yield'] = idx + 1
+        state['nbytes'] -= nbytes
+        cond.notify_all()
+
+      if not ok:
+        raise result[0], result[1], result[2]
+      yield result
+  finally:
+    with cond:
+      state['stop'] = True
+      cond.notify_all()
@@ -0,0 +1,281 @@
+"""
+Bins spectrograms in time. A spectrogram here is a (spectra, frequencies)
+power matrix whose rows are in trigger time order, e.g. the power column of a
+spectrum store, see spectrum_store.py.
+
+A bin holds binsize consecutive spectra. Its power is the mean power at each
+frequency of the spectra in it, or the max power if how is 'max', and its
+trigger time is the trigger time of the first spectrum in it. The last bin
+holds the spectra left over, so it may have fewer than binsize spectra.
+
+bin_spectra bins a matrix held in memory with a single np.add.reduceat.
+SpectrogramBinner does the same for a matrix given one chunk of rows at a
+time, e.g. slices of a memory mapped store, so only one chunk and the bins
+need to be in memory.
+
+reduce_blocks reduces blocks of any axis, taking into account how many
+spectra went into each element, and is used to bring spectrograms down to
+the resolution they are displayed at, see spectrogram_lod.py.
+
+SpectrogramRaster reduces a spectrogram given one chunk of rows at a time
+straight to an image of no more than a given number of columns, so only one
+chunk and the image need to be in memory however many spectra there are.
+"""
+
+import numpy as np
+
+REDUCTIONS = ('mean', 'max')
+
+def bin_spectra(power, binsize, dtype=np.float64, how='mean'):
+  """
+  Returns (starts, binned) where binned[i] is the mean, or max, of rows
+  starts[i]:starts[i]+binsize of power, computed in dtype. The last bin may
+  have fewer than binsize rows.
+  """
+  assert binsize > 0
+  assert how in REDUCTIONS
+  nspectra = len(power)
+  starts = np.arange(0, nspectra, binsize)
+  if nspectra == 0:
+    return starts, np.empty((0,) + power.shape[1:], dtype=dtype)
+
+  if how == 'max':
+    return starts, np.maximum.reduceat(power, starts, axis=0).astype(dtype, copy=False)
+
+  binned = np.add.reduceat(power, starts, axis=0, dtype=dtype)
+  counts = np.diff(np.append(starts, nspectra))
+  binned /= counts.reshape((-1,) + (1,) * (binned.ndim - 1))
+  return starts, binned
+
+def reduce_blocks(a, blocksize, axis=0, how='mean', weights=None):
+  """
+  Reduces blocks of blocksize consecutive elements of a along axis to their
+  mean or max, the last block may be smaller. Returns (reduced, weights).
+
+  weights: weight of each element along axis when computing the mean, e.g.
+           the number of spectra in each bin. Defaults to 1. The returned
+           weights are the sum of the weights in each block.
+  """
+  assert blocksize > 0
+  assert how in REDUCTIONS
+  n = a.shape[axis]
+  starts = np.arange(0, n, blocksize)
+  if weights is None:
+    weights = np.ones(n)
+  assert len(weights) == n
+  blockweights = np.add.reduceat(weights, starts)
+
+  if how == 'max':
+    return np.maximum.reduceat(a, starts, axis=axis), blockweights
+
+  shape = [1] * a.ndim
+  shape[axis] = -1
+  if np.all(weights == 1):
+    reduced = np.add.reduceat(a, starts, axis=axis, dtype=np.float64)
+  else:
+    reduced = np.add.reduceat(a * weights.reshape(shape), starts, axis=axis, dtype=np.float64)
+  reduced /= blockweights.reshape(shape)
+  return reduced, blockweights
+
+class SpectrogramBinner(object):
+  """
+  Bins a spectrogram given as consecutive chunks of rows. Chunks need not be
+  multiples of binsize, a bin that straddles chunks is carried over as a
+  running sum.
+
+  Usage:
+    binner = SpectrogramBinner(binsize, max_bins)
+    for trigtimes, power in chunks:
+      binner.add(trigtimes, power)
+      if binner.full:
+        break
+    trigtimes, binned = binner.finish()
+  """
+  def __init__(self, binsize, max_bins=None, dtype=np.float64, how='mean'):
+    assert binsize > 0
+    assert max_bins is None or max_bins > 0
+    assert how in REDUCTIONS
+    self.binsize = binsize
+    self.max_bins = max_bins
+    self.dtype = dtype
+    self.how = how
+
+    # number of spectra binned so far
+    self.nspectra = 0
+
+    self._trigtimes = list()
+    self._bins = list()
+    self._nbins = 0
+    # (trigtime, sum or max, count) of the bin being filled
+    self._carry = None
+
+  @property
+  def full(self):
+    """
+    True when max_bins bins are full, after which add ignores further spectra.
+    """
+    return self.max_bins is not None and self._nbins >= self.max_bins
+
+  def _reduce(self, power):
+    if self.how == 'max':
+      return power.max(axis=0).astype(self.dtype)
+    return power.sum(axis=0, dtype=self.dtype)
+
+  def _close(self, trigtime, binacc, count):
+    if self.how == 'mean':
+      binacc = binacc/count
+    self._append([trigtime], binacc[np.newaxis])
+
+  def _append(self, trigtimes, binned):
+    self._trigtimes.extend(trigtimes)
+    self._bins.append(binned)
+    self._nbins += len(binned)
+
+  def add(self, trigtimes, power):
+    """
+    Adds the spectra in the rows of power, whose trigger times are the
+    array trigtimes. Returns the number of spectra used, which is less than
+    len(power) once max_bins is reached.
+    """
+    assert len(trigtimes) == len(power)
+    if self.full:
+      return 0
+
+    binsize = self.binsize
+    used = 0
+
+    if self._carry is not None:
+      trigtime, binacc, count = self._carry
+      used = min(binsize - count, len(power))
+      if self.how == 'max':
+        binacc = np.maximum(binacc, self._reduce(power[:used]))
+      else:
+        binacc += self._reduce(power[:used])
+      count += used
+      if count < binsize:
+        self._carry = (trigtime, binacc, count)
+        self.nspectra += used
+        return used
+
+      self._carry = None
+      self._close(trigtime, binacc, count)
+
+    rest = len(power) - used
+    if self.max_bins is not None:
+      rest = min(rest, (self.max_bins - self._nbins) * binsize)
+
+    nfull = rest//binsize
+    if nfull > 0:
+      end = used + nfull * binsize
+      starts, binned = bin_spectra(power[used:end], binsize, self.dtype, self.how)
+      self._append(trigtimes[used:end][starts], binned)
+      used = end
+
+    if used < len(power) and not self.full:
+      self._carry = (trigtimes[used],
+                     self._reduce(power[used:]),
+                     len(power) - used)
+      used = len(power)
+
+    self.nspectra += used
+    return used
+
+  def finish(self):
+    """
+    Closes the last, possibly partial, bin and returns (trigtimes, binned),
+    where binned has one row per bin.
+    """
+    if self._carry is not None:
+      self._close(*self._carry)
+      self._carry = None
+
+    assert self._nbins > 0, 'No spectra were binned'
+    trigtimes = np.array(self._trigtimes)
+    binned = np.concatenate(self._bins)
+    return trigtimes, binned
+
+class SpectrogramRaster(object):
+  """
+  Reduces a spectrogram given as consecutive chunks of rows to an image of
+  no more than width columns. Column j is the mean, or max, of spectra
+  j*colsize to (j+1)*colsize-1, where colsize is the smallest of colsize0
+  times a power of 2 that keeps the image within width columns. The number
+  of spectra need not be known in advance: colsize starts at colsize0 and
+  doubles, merging pairs of columns, whenever the image gets too wide.
+
+  Rows are usually reduced to image resolution before they are added, e.g.
+  with reduce_blocks along axis 1.
+
+  Usage:
+    raster = SpectrogramRaster(binsize, width)
+    for power in chunks:
+      raster.add(reduce_blocks(power, rowsize, axis=1)[0])
+    image = raster.finish()
+    # raster.colsize is now the number of spectra in each column
+  """
+  def __init__(self, colsize0, width, how='mean'):
+    assert colsize0 > 0
+    assert width > 0
+    assert how in REDUCTIONS
+    self.colsize = colsize0
+    self.width = width
+    self.how = how
+
+    # number of spectra added so far
+    self.nspectra = 0
+
+    # sum, or max, and number of spectra of each column
+    self._acc = None
+    self._counts = np.zeros(0, dtype=np.int64)
+
+  def add(self, rows):
+    """
+    Adds the spectra in rows, which must all have the same number of columns.
+    """
+    if len(rows) == 0:
+      return
+
+    cols = (self.nspectra + np.arange(len(rows)))//self.colsize
+    starts = np.flatnonzero(np.diff(cols)) + 1
+    starts = np.append(0, starts)
+    if self.how == 'max':
+      acc = np.maximum.reduceat(rows, starts, axis=0)
+    else:
+      acc = np.add.reduceat(rows, starts, axis=0, dtype=np.float64)
+    counts = np.diff(np.append(starts, len(rows)))
+
+    if self._acc is None:
+      self._acc = acc
+      self._counts = counts
+    else:
+      if cols[0] < len(self._counts):
+        # the first column is the last one of the previous chunk
+        if self.how == 'max':
+          self._acc[-1] = np.maximum(self._acc[-1], acc[0])
+        else:
+          self._acc[-1] += acc[0]
+        self._counts[-1] += counts[0]
+        acc, counts = acc[1:], counts[1:]
+      self._acc = np.concatenate((self._acc, acc))
+      self._counts = np.append(self._counts, counts)
+    self.nspectra += len(rows)
+
+    while len(self._counts) > self.width:
+      # columns start at multiples of colsize, so pairs of them are the
+      # columns of twice the size
+      pairs = np.arange(0, len(self._counts), 2)
+      if self.how == 'max':
+        self._acc = np.maximum.reduceat(self._acc, pairs, axis=0)
+      else:
+        self._acc = np.add.reduceat(self._acc, pairs, axis=0)
+      self._counts = np.add.reduceat(self._counts, pairs)
+      self.colsize *= 2
+
+  def finish(self):
+    """
+    Returns the image, which has one row per column of colsize spectra.
+    """
+    assert self._acc is not None, 'No spectra were added'
+    if self.how == 'max':
+      return self._acc
+    return self._acc/self._counts.reshape((-1,) + (1,) * (self._acc.ndim - 1))
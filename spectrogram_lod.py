@@ -0,0 +1,350 @@
+"""
+Level of detail (LOD) cache of the spectrogram of a spectrum store or merged
+npz, so that long sessions can be plotted at the resolution of the output
+image without reading every spectrum each time, see plot_spectrogram.py.
+
+The cache is a pyramid of levels. Level k reduces blocks of 2**k consecutive
+spectra and freq_blocksize frequency bins to both their mean and their max.
+freq_blocksize is the smallest power of 2 that brings the spectra down to at
+most LOD_FREQ_BINS frequency bins. Levels are built from the first k that
+reduces the spectra at least LOD_MIN_REDUCTION times, so the cache stays
+small next to the spectra, up to the k that leaves a single row. Plots that
+need finer levels than that read the spectra.
+
+The cache also holds the trigger time, as epoch seconds, and the total power
+of every spectrum, and the total power above every -highpass frequency asked
+for so far. So the power-over-time plot never needs the spectra either.
+
+Spectra are in the order plot_spectrogram.py plots them, i.e. sorted by input
+file name. The cache of a store is the lod directory inside it, and the cache
+of a merged npz is the directory with .lod appended to its name. It is
+rebuilt when the size or modification time of the spectra changes.
+"""
+
+import os
+import json
+import numpy as np
+
+from spectrogram_binning import reduce_blocks
+
+LOD_DIRNAME = 'lod'
+LOD_EXT = '.lod'
+LOD_VERSION = 1
+LOD_FREQ_BINS = 2048
+LOD_MIN_REDUCTION = 16
+
+def p(s):
+  import sys
+  sys.stderr.write(s + '\n')
+
+def block_counts(blocksize, total, first, last):
+  """
+  Returns the number of elements in blocks first to last-1 of blocksize
+  elements, when there are total elements in all, i.e. the last block may
+  be smaller.
+  """
+  starts = np.arange(first, last) * blocksize
+  return np.minimum(blocksize, total - starts)
+
+def lod_path(powerfile):
+  from spectrum_store import is_store
+  if is_store(powerfile):
+    return os.path.join(powerfile, LOD_DIRNAME)
+  return powerfile.rstrip(os.sep) + LOD_EXT
+
+class _StoreSource(object):
+  def __init__(self, path):
+    from spectrum_store import SpectrumStore
+    self.path = path
+    self.store = SpectrumStore(path)
+    self.traces = self.store.traces
+    self.order = np.argsort(self.traces['input_file'], kind='mergesort')
+    self.nspectra = len(self.order)
+    self.freqs = np.asarray(self.store.freqs)
+    self.power = self.store.power
+
+  def key(self):
+    # rows are replaced in place when a store is resumed, which changes the
+    # mtime but not the size
+    stats = [os.stat(os.path.join(self.path, name)) for name in ('power.bin', 'traces.bin')]
+    return dict(nspectra=self.nspectra,
+                size=sum(st.st_size for st in stats),
+                mtime=max(st.st_mtime for st in stats))
+
+  def name(self, index):
+    return self.traces['input_file'][self.order[index]]
+
+  def read(self, start, stop):
+    idx = self.order[start:stop]
+    if np.all(np.diff(idx) == 1):
+      power = self.power[idx[0]:idx[-1]+1]
+    else:
+      power = self.power[idx]
+    return self.traces['trigtime'][idx], power
+
+class _NpzSource(object):
+  def __init__(self, path):
+    self.path = path
+    self.npz = np.load(path)
+    self.keys = sorted(self.npz.keys())
+    self.nspectra = len(self.keys)
+    self.freqs = self.npz[self.keys[0]].item()['data'][:,0]
+
+  def key(self):
+    st = os.stat(self.path)
+    return dict(nspectra=self.nspectra, size=st.st_size, mtime=st.st_mtime)
+
+  def name(self, index):
+    return self.keys[index]
+
+  def read(self, start, stop):
+    from calc_power_spectrum import header_trigtimes
+    headers = list()
+    power = list()
+    for fname in self.keys[start:stop]:
+      datadict = self.npz[fname].item()
+      headers.append(datadict['header'])
+      power.append(datadict['data'][:,1])
+    return header_trigtimes(headers), np.array(power)
+
+def _open_source(powerfile):
+  from spectrum_store import is_store
+  if is_store(powerfile):
+    return _StoreSource(powerfile)
+  return _NpzSource(powerfile)
+
+def _chunk_rows(nfreqs, chunk_bytes, multiple):
+  rows = max(1, chunk_bytes//(nfreqs * 8))
+  return max(multiple, rows - rows % multiple)
+
+class SpectrogramLOD(object):
+  """
+  Use open_lod to open, and if need be build, the cache of a store or merged
+  npz.
+
+  Attributes:
+    - nspectra, freqs: number of spectra and their frequency vector
+    - freq_blocksize: number of frequency bins in a block of every level
+    - levels: list of k of the levels in the cache
+    - trigtime: trigger time of every spectrum, as epoch seconds
+    - total: total power of every spectrum
+  """
+  def __init__(self, path, source):
+    self.path = path
+    self.source = source
+    with open(self._file('lod.json')) as f:
+      self.info = json.load(f)
+
+    self.nspectra = self.info['nspectra']
+    self.freq_blocksize = self.info['freq_blocksize']
+    self.levels = self.info['levels']
+    self.freqs = source.freqs
+
+  def _file(self, name):
+    return os.path.join(self.path, name)
+
+  @classmethod
+  def build(cls, path, source, chunk_bytes=64 * 2**20):
+    from numpy.lib.format import open_memmap
+    nspectra = source.nspectra
+    nfreqs = len(source.freqs)
+    assert nspectra > 0, 'No spectra in %s'%(source.path)
+
+    freq_blocksize = 1
+    while -(-nfreqs//freq_blocksize) > LOD_FREQ_BINS:
+      freq_blocksize *= 2
+    ncols = -(-nfreqs//freq_blocksize)
+
+    # finer levels would make the cache a sizeable fraction of the spectra
+    first = 0
+    while (-(-nspectra//2**first) > 1 and
+           -(-nspectra//2**first) * ncols * LOD_MIN_REDUCTION > nspectra * nfreqs):
+      first += 1
+    last = first
+    while -(-nspectra//2**last) > 1:
+      last += 1
+    levels = range(first, last + 1)
+
+    if not os.path.isdir(path):
+      os.mkdir(path)
+    for name in os.listdir(path):
+      os.remove(os.path.join(path, name))
+
+    p('Building LOD cache %s: %d spectra, %d frequency bins per block, levels %d..%d'%(path, nspectra, freq_blocksize, first, last))
+
+    def open_level(k):
+      shape = (-(-nspectra//2**k), ncols)
+      return [open_memmap(os.path.join(path, '%s%02d.npy'%(how, k)), mode='w+', dtype=np.float32, shape=shape)
+              for how in ('mean', 'max')]
+
+    # the first level and the per spectrum columns come from the spectra
+    trigtime = np.empty(nspectra)
+    total = np.empty(nspectra)
+    meanlevel, maxlevel = open_level(first)
+    chunksize = _chunk_rows(nfreqs, chunk_bytes, 2**first)
+    for start in xrange(0, nspectra, chunksize):
+      stop = min(nspectra, start + chunksize)
+      trigtime[start:stop], power = source.read(start, stop)
+      total[start:stop] = power.sum(axis=1)
+
+      rows = slice(start//2**first, -(-stop//2**first))
+      for how, level in (('mean', meanlevel), ('max', maxlevel)):
+        reduced, _ = reduce_blocks(power, freq_blocksize, axis=1, how=how)
+        reduced, _ = reduce_blocks(reduced, 2**first, axis=0, how=how)
+        level[rows] = reduced
+
+    # every further level halves the rows of the one before
+    for k in levels[1:]:
+      prev = (meanlevel, maxlevel)
+      meanlevel, maxlevel = open_level(k)
+      chunksize = _chunk_rows(ncols, chunk_bytes, 2)
+      for start in xrange(0, len(prev[0]), chunksize):
+        stop = min(len(prev[0]), start + chunksize)
+        weights = block_counts(2**(k-1), nspectra, start, stop)
+        rows = slice(start//2, -(-stop//2))
+        for how, src, level in (('mean', prev[0], meanlevel), ('max', prev[1], maxlevel)):
+          level[rows], _ = reduce_blocks(src[start:stop], 2, axis=0, how=how, weights=weights)
+      for level in prev:
+        level.flush()
+    meanlevel.flush()
+    maxlevel.flush()
+
+    np.save(os.path.join(path, 'trigtime.npy'), trigtime)
+    np.save(os.path.join(path, 'total.npy'), total)
+
+    # last, so an interrupted build is never taken as current
+    info = dict(version=LOD_VERSION,
+                key=source.key(),
+                nspectra=nspectra,
+                nfreqs=nfreqs,
+                freq_bins=LOD_FREQ_BINS,
+                min_reduction=LOD_MIN_REDUCTION,
+                freq_blocksize=freq_blocksize,
+                levels=levels)
+    with open(os.path.join(path, 'lod.json'), 'w') as f:
+      json.dump(info, f, indent=2)
+
+    return cls(path, source)
+
+  def is_current(self):
+    return (self.info.get('version') == LOD_VERSION and
+            self.info.get('key') == self.source.key() and
+            self.info.get('nfreqs') == len(self.freqs) and
+            self.info.get('freq_bins') == LOD_FREQ_BINS and
+            self.info.get('min_reduction') == LOD_MIN_REDUCTION)
+
+  @property
+  def trigtime(self):
+    return np.load(self._file('trigtime.npy'), mmap_mode='r')
+
+  @property
+  def total(self):
+    return np.load(self._file('total.npy'), mmap_mode='r')
+
+  def name(self, index):
+    return self.source.name(index)
+
+  def level(self, k, how='mean'):
+    return np.load(self._file('%s%02d.npy'%(how, k)), mmap_mode='r')
+
+  def total_above(self, highpass, chunk_bytes=64 * 2**20):
+    """
+    Returns the total power at frequencies of at least highpass of every
+    spectrum. The first call for a highpass reads the spectra, after which
+    the result is cached.
+    """
+    if highpass <= 0:
+      return self.total
+
+    fname = self._file('total-hp%r.npy'%(float(highpass)))
+    if not os.path.exists(fname):
+      keep = self.freqs >= highpass
+      total = np.empty(self.nspectra)
+      chunksize = _chunk_rows(len(self.freqs), chunk_bytes, 1)
+      for start in xrange(0, self.nspectra, chunksize):
+        stop = min(self.nspectra, start + chunksize)
+        _, power = self.source.read(start, stop)
+        total[start:stop] = power[:,keep].sum(axis=1)
+      np.save(fname, total)
+
+    return np.load(fname, mmap_mode='r')
+
+  def choose_level(self, start, stop, colsize, rowsize, highpass=0):
+    """
+    Returns the coarsest level whose blocks tile columns of colsize spectra
+    from start to stop and rows of rowsize frequency bins, or None if there
+    is no such level in the cache and the spectra have to be used. That is
+    also the case if highpass falls inside a block of frequency bins, as
+    only whole blocks can be zeroed.
+    """
+    if rowsize % self.freq_blocksize:
+      return None
+
+    hpstop = np.searchsorted(self.freqs, highpass, 'left')
+    if hpstop % self.freq_blocksize and hpstop < len(self.freqs):
+      return None
+
+    def tiles(k):
+      blocksize = 2**k
+      return (colsize % blocksize == 0 and
+              start % blocksize == 0 and
+              (stop == self.nspectra or stop % blocksize == 0))
+
+    k = 0
+    while k < self.levels[-1] and tiles(k + 1):
+      k += 1
+
+    if k < self.levels[0]:
+      return None
+    return k
+
+  def render(self, k, start, stop, colsize, fstart, fstop, rowsize, how='mean', highpass=0, chunk_bytes=64 * 2**20):
+    """
+    Returns the (columns, rows) image of spectra start to stop-1 and
+    frequency bins fstart to fstop-1 at level k, see choose_level. Each
+    column is colsize spectra, and each row rowsize frequency bins, reduced
+    to their mean or max.
+
+    Blocks of the level below highpass are zeroed, so highpass has to be on
+    a block boundary, see choose_level.
+    """
+    blocksize = 2**k
+    fblocksize = self.freq_blocksize
+    level = self.level(k, how)
+
+    cstart, cstop = fstart//fblocksize, -(-fstop//fblocksize)
+    colweights = block_counts(fblocksize, len(self.freqs), cstart, cstop)
+    blockend = self.freqs[np.minimum(np.arange(cstart + 1, cstop + 1) * fblocksize, len(self.freqs)) - 1]
+    below = blockend < highpass
+    hpstop = np.searchsorted(self.freqs, highpass, 'left')
+    assert hpstop % fblocksize == 0 or hpstop >= len(self.freqs), 'highpass %g Hz is inside a block of %d frequency bins'%(highpass, fblocksize)
+
+    rstart, rstop = start//blocksize, -(-stop//blocksize)
+    rows_per_column = colsize//blocksize
+    chunksize = _chunk_rows(cstop - cstart, chunk_bytes, rows_per_column)
+
+    image = list()
+    for row in xrange(rstart, rstop, chunksize):
+      rowend = min(rstop, row + chunksize)
+      tile = np.array(level[row:rowend, cstart:cstop], dtype=np.float64)
+      tile[:,below] = 0
+      tile, _ = reduce_blocks(tile, rowsize//fblocksize, axis=1, how=how, weights=colweights)
+      weights = block_counts(blocksize, self.nspectra, row, rowend)
+      tile, _ = reduce_blocks(tile, rows_per_column, axis=0, how=how, weights=weights)
+      image.append(tile)
+
+    return np.concatenate(image)
+
+def open_lod(powerfile, rebuild=False, chunk_bytes=64 * 2**20):
+  """
+  Returns the SpectrogramLOD of powerfile, a spectrum store or merged npz,
+  building it if it does not exist, is out of date, or rebuild is True.
+  """
+  path = lod_path(powerfile)
+  source = _open_source(powerfile)
+  if not rebuild and os.path.exists(os.path.join(path, 'lod.json')):
+    lod = SpectrogramLOD(path, source)
+    if lod.is_current():
+      return lod
+
+  return SpectrogramLOD.build(path, source, chunk_bytes)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+"""
+Columnar store of power spectra that share a frequency vector, as produced
+by calc_power_spectrum.py -merge -merge_format store.
+
+A store is a directory, by convention ending in .spectra, containing:
+
+  - store.json: layout of the store and attributes of how it was made
+  - freqs.npy: the frequency vector shared by every spectrum
+  - power.bin: (ntraces, nfreqs) power matrix, raw and C ordered, float32 or
+               float64
+  - bands.bin: (ntraces, nbands) float64 matrix of band integrals, e.g.
+               total and harmonic power, if the store has bands
+  - summary.bin: (ntraces, nsummary) float64 matrix of summary values of
+                 each spectrum, e.g. total power and variance, if the store
+                 has them. See calc_power_spectrum.spectrum_summary
+  - traces.bin: one record per spectrum, raw numpy structured array with the
+                fields of TRACE_FIELDS
+
+Everything can be memory mapped, so opening a store is independent of the
+number of spectra in it. The .bin files are appended to, which is why they
+are raw rather than .npy files. Records go into traces.bin after everything
+else about their spectra has been written, and only rows present in every
+.bin file are considered part of the store, so an interrupted append leaves
+a readable store.
+
+trigtime is stored as float seconds since 1970-01-01, see
+lecroy.datetime_to_epoch, and is NaN if unknown.
+
+source, size and mtime identify the file a spectrum was computed from, which
+is not input_file for segments of sequence mode trc files. They let a store
+be updated with only new or changed files, see StoreWriter.
+
+input_file and source start out 256 bytes wide. Longer values widen them,
+see SpectrumStore.fit_strings, and the widths are saved in store.json with
+the rest of the layout.
+"""
+
+import os
+import json
+import numpy as np
+
+STORE_EXT = '.spectra'
+STORE_VERSION = 1
+
+TRACE_FIELDS = [('input_file', 'S256'),
+                ('source', 'S256'),
+                ('size', 'i8'),
+                ('mtime', 'f8'),
+                ('trigtime', 'f8'),
+                ('sampling_freq', 'f8'),
+                ('window_start', 'f8'),
+                ('window_end', 'f8')]
+
+def is_store(path):
+  return os.path.isdir(path) and os.path.exists(os.path.join(path, 'store.json'))
+
+def _descr_to_dtype(descr):
+  # json turns tuples into lists, which np.dtype does not accept
+  return np.dtype([tuple(field) for field in descr])
+
+class SpectrumStore(object):
+  """
+  Open an existing store with SpectrumStore(path), or make a new one with
+  SpectrumStore.create.
+
+  Attributes:
+    - freqs: frequency vector
+    - power: (ntraces, nfreqs) memory mapped power matrix
+    - bands: (ntraces, len(band_names)) memory mapped matrix of band
+             integrals, see calc_power_spectrum.band_matrix
+    - band_names: names of the columns of bands
+    - summary: (ntraces, len(summary_names)) memory mapped matrix of summary
+               values, see calc_power_spectrum.spectrum_summary
+    - summary_names: names of the columns of summary
+    - traces: memory mapped structured array with one record per spectrum
+    - trigtime: traces['trigtime']
+    - attrs: dictionary of attributes given when the store was created
+  """
+  def __init__(self, path):
+    super(SpectrumStore, self).__init__()
+    assert is_store(path), '%s is not a spectrum store'%(path)
+    self.path = path
+
+    with open(self._file('store.json')) as fh:
+      meta = json.load(fh)
+
+    assert meta['version'] <= STORE_VERSION, 'Store version %d is too new'%(meta['version'])
+    self.power_dtype = np.dtype(str(meta['power_dtype']))
+    self.traces_dtype = _descr_to_dtype(meta['traces_dtype'])
+    self.nfreqs = meta['nfreqs']
+    self.band_names = [str(name) for name in meta.get('bands', list())]
+    self.summary_names = [str(name) for name in meta.get('summary', list())]
+    self.source = meta['source']
+    self.attrs = meta.get('attrs', dict())
+
+    # (file, dtype, shape of a row) of every per spectrum column, in the
+    # order they are appended to. traces.bin goes last so that a spectrum
+    # only becomes part of the store once everything else about it has been
+    # written.
+    self._columns = [('power.bin', self.power_dtype, (self.nfreqs,))]
+    if self.band_names:
+      self._columns.append(('bands.bin', np.dtype(np.float64), (len(self.band_names),)))
+    if self.summary_names:
+      self._columns.append(('summary.bin', np.dtype(np.float64), (len(self.summary_names),)))
+    self._columns.append(('traces.bin', self.traces_dtype, ()))
+
+  @classmethod
+  def create(cls, path, freqs, dtype=np.float64, source='calc_power_spectrum.py', bands=(), summary=(), **attrs):
+    """
+    Creates an empty store at path for spectra with the frequency vector
+    freqs, stored with the given dtype. bands and summary are the names of
+    the band integrals and summary values saved with each spectrum. Any
+    extra keyword arguments are saved as attributes of the store, and need
+    to be JSON serialisable.
+    """
+    assert not os.path.exists(path), '%s already exists'%(path)
+    os.makedirs(path)
+
+    freqs = np.asarray(freqs)
+    np.save(os.path.join(path, 'freqs.npy'), freqs)
+
+    meta = dict(version=STORE_VERSION,
+                source=source,
+                nfreqs=len(freqs),
+                power_dtype=np.dtype(dtype).str,
+                traces_dtype=np.dtype(TRACE_FIELDS).descr,
+                bands=list(bands),
+                summary=list(summary),
+                attrs=attrs)
+    with open(os.path.join(path, 'store.json'), 'w') as fh:
+      json.dump(meta, fh, indent=1, sort_keys=True)
+
+    store = cls(path)
+    for name, _, _ in store._columns:
+      open(store._file(name), 'wb').close()
+    return store
+
+  def _file(self, name):
+    return os.path.join(self.path, name)
+
+  @staticmethod
+  def _rowsize(dtype, rowshape):
+    return dtype.itemsize * int(np.prod(rowshape))
+
+  @property
+  def ntraces(self):
+    return min(os.path.getsize(self._file(name)) // self._rowsize(dtype, rowshape)
+               for name, dtype, rowshape in self._columns)
+
+  def __len__(self):
+    return self.ntraces
+
+  @property
+  def freqs(self):
+    return np.load(self._file('freqs.npy'), mmap_mode='r')
+
+  def _map(self, name, mode='r'):
+    for cname, dtype, rowshape in self._columns:
+      if cname == name:
+        break
+    else:
+      raise KeyError(name)
+
+    shape = (self.ntraces,) + rowshape
+    if shape[0] == 0:
+      return np.zeros(shape, dtype=dtype)
+    return np.memmap(self._file(name), dtype=dtype, mode=mode, shape=shape)
+
+  @property
+  def power(self):
+    return self._map('power.bin')
+
+  @property
+  def bands(self):
+    if not self.band_names:
+      return np.zeros((self.ntraces, 0))
+    return self._map('bands.bin')
+
+  def band(self, name):
+    """
+    Returns the band integral called name of every spectrum
+    """
+    return self.bands[:, self.band_names.index(name)]
+
+  @property
+  def summary(self):
+    if not self.summary_names:
+      return np.zeros((self.ntraces, 0))
+    return self._map('summary.bin')
+
+  def summary_value(self, name):
+    """
+    Returns the summary value called name of every spectrum
+    """
+    return self.summary[:, self.summary_names.index(name)]
+
+  @property
+  def traces(self):
+    return self._map('traces.bin')
+
+  @property
+  def trigtime(self):
+    return self.traces['trigtime']
+
+  def make_records(self, n):
+    """
+    Returns n zeroed trace records to be filled in and passed to append.
+    Strings longer than the fields are cut short, see fit_strings.
+    """
+    return np.zeros(n, dtype=self.traces_dtype)
+
+  def fit_strings(self, chunksize=4096, **values):
+    """
+    Widens the string fields of the trace records so they hold values, e.g.
+    fit_strings(source=[path]), rewriting traces.bin and store.json if they
+    do not already.
+    """
+    fields = list()
+    for name in self.traces_dtype.names:
+      dtype = self.traces_dtype.fields[name][0]
+      if name in values:
+        width = max([len(value) for value in values[name]] + [dtype.itemsize])
+        dtype = np.dtype('S%d'%(width))
+      fields.append((name, dtype))
+    traces_dtype = np.dtype(fields)
+    if traces_dtype == self.traces_dtype:
+      return
+
+    traces = self.traces
+    tmpname = self._file('traces.bin.tmp')
+    with open(tmpname, 'wb') as fh:
+      for start in xrange(0, len(traces), chunksize):
+        traces[start:start+chunksize].astype(traces_dtype).tofile(fh)
+    del traces
+
+    with open(self._file('store.json')) as fh:
+      meta = json.load(fh)
+    meta['traces_dtype'] = traces_dtype.descr
+    with open(self._file('store.json.tmp'), 'w') as fh:
+      json.dump(meta, fh, indent=1, sort_keys=True)
+
+    os.rename(tmpname, self._file('traces.bin'))
+    os.rename(self._file('store.json.tmp'), self._file('store.json'))
+    self.traces_dtype = traces_dtype
+    self._columns[-1] = ('traces.bin', traces_dtype, ())
+
+  def _column_data(self, power, records, bands, summary):
+    data = [power]
+    if self.band_names:
+      assert bands is not None, 'Band integrals %s are needed'%(', '.join(self.band_names))
+      data.append(bands)
+    if self.summary_names:
+      assert summary is not None, 'Summary values %s are needed'%(', '.join(self.summary_names))
+      data.append(summary)
+    data.append(records)
+
+    arrays = list()
+    for (name, dtype, rowshape), arr in zip(self._columns, data):
+      arrays.append(np.ascontiguousarray(arr, dtype=dtype).reshape((-1,) + rowshape))
+    assert len(set(len(arr) for arr in arrays)) == 1
+    return arrays
+
+  def append(self, power, records, bands=None, summary=None):
+    """
+    Appends spectra to the store. power is (n, nfreqs), records is a
+    structured array of n records, see make_records, bands is
+    (n, len(band_names)) and summary is (n, len(summary_names)).
+    """
+    arrays = self._column_data(power, records, bands, summary)
+
+    # truncate any partial rows left by an interrupted append, so the new
+    # rows line up
+    ntraces = self.ntraces
+    for name, dtype, rowshape in self._columns:
+      with open(self._file(name), 'r+b') as fh:
+        fh.truncate(ntraces * self._rowsize(dtype, rowshape))
+
+    for (name, _, _), arr in zip(self._columns, arrays):
+      with open(self._file(name), 'ab') as fh:
+        arr.tofile(fh)
+
+  def write(self, rows, power, records, bands=None, summary=None):
+    """
+    Overwrites the spectra at the given row indices
+    """
+    arrays = self._column_data(power, records, bands, summary)
+    for (name, _, _), arr in zip(self._columns, arrays):
+      mapped = self._map(name, mode='r+')
+      mapped[rows] = arr
+      mapped.flush()
+      del mapped
+
+  def remove(self, rows, chunksize=1024):
+    """
+    Removes the spectra at the given row indices. Every column file is
+    rewritten.
+    """
+    keep = np.ones(self.ntraces, dtype=bool)
+    keep[rows] = False
+    for name, _, _ in self._columns:
+      arr = self._map(name)
+      tmpname = self._file(name + '.tmp')
+      with open(tmpname, 'wb') as fh:
+        for start in xrange(0, len(arr), chunksize):
+          arr[start:start+chunksize][keep[start:start+chunksize]].tofile(fh)
+      del arr
+      os.rename(tmpname, self._file(name))
+
+  def sources(self):
+    """
+    Returns a dictionary mapping each source to the row indices of its
+    spectra
+    """
+    sources = dict()
+    for row, source in enumerate(self.traces['source']):
+      sources.setdefault(source, list()).append(row)
+    return sources
+
+class StoreWriter(object):
+  """
+  Buffers spectra and appends them to a store in blocks. The store is
+  created from the first spectrum, so the frequency vector does not need to
+  be known in advance.
+
+  With resume=True an existing store at path is updated instead. Its dtype
+  and attributes must match those given. Spectra of sources passed to
+  replace are written over the old spectra of that source, any old spectra
+  left over once a source is done are removed when the writer is closed.
+  Summary values are not saved when resuming a store made before they were.
+  """
+  def __init__(self, path, dtype=np.float64, blocksize=256, resume=False, **attrs):
+    super(StoreWriter, self).__init__()
+    self.path = path
+    self.dtype = dtype
+    self.blocksize = blocksize
+    self.attrs = attrs
+    self.store = None
+    self._freqs = None
+    self._power = list()
+    self._bands = list()
+    self._summary = list()
+    self._records = list()
+    self._sources = dict()
+    self._replace = dict()
+    self._replaced = set()
+
+    if resume and is_store(path):
+      self.store = SpectrumStore(path)
+      self._sources = self.store.sources()
+      assert self.store.power_dtype == np.dtype(dtype), '%s holds %s spectra'%(path, self.store.power_dtype)
+      for key, value in attrs.items():
+        oldvalue = self.store.attrs.get(key)
+        assert oldvalue == value, '%s was made with %s=%s, not %s'%(path, key, oldvalue, value)
+    else:
+      assert not os.path.exists(path), '%s already exists'%(path)
+
+  def has_source(self, source):
+    """
+    Returns True if the store holds spectra of source
+    """
+    return source in self._sources
+
+  def is_current(self, source, size, mtime):
+    """
+    Returns True if the store holds spectra of source computed from a file
+    of the given size and mtime
+    """
+    rows = self._sources.get(source)
+    if rows is None:
+      return False
+    traces = self.store.traces
+    return bool(np.all(traces['size'][rows] == size) and np.all(traces['mtime'][rows] == mtime))
+
+  def replace(self, source):
+    """
+    Spectra added for source are written over its spectra already in the
+    store, rather than appended
+    """
+    if source in self._sources:
+      self._replace[source] = list(self._sources[source])
+
+  def add(self, freqs, ps, input_file, trigtime, sampling_freq, window, source='', size=-1, mtime=np.nan, bands=(), summary=()):
+    """
+    Adds a spectrum. trigtime is seconds since epoch, or None if unknown.
+    source, size and mtime describe the file it was computed from. bands and
+    summary are lists of (name, value) of its band integrals and summary
+    values, which must have the same names for every spectrum.
+    """
+    band_names = [name for name, _ in bands]
+    summary_names = [name for name, _ in summary]
+    if self.store is None:
+      self.store = SpectrumStore.create(self.path, freqs, self.dtype, bands=band_names, summary=summary_names, **self.attrs)
+
+    assert len(ps) == self.store.nfreqs, 'All spectra in a store need the same frequencies: %s'%(input_file)
+    if self._freqs is None:
+      self._freqs = np.asarray(self.store.freqs)
+    # e.g. a different sampling frequency, -welch or -max_freq_bins can give
+    # the same number of bins at different frequencies
+    assert np.allclose(freqs, self._freqs), '%s has different frequencies than the spectra in %s'%(input_file, self.path)
+    assert band_names == self.store.band_names, '%s has bands %s, not %s'%(self.path, self.store.band_names, band_names)
+    if not self.store.summary_names:
+      summary = ()
+      summary_names = list()
+    assert summary_names == self.store.summary_names, '%s has summary values %s, not %s'%(self.path, self.store.summary_names, summary_names)
+    bandvec = [value for _, value in bands]
+    summaryvec = [value for _, value in summary]
+
+    if trigtime is None:
+      trigtime = np.nan
+
+    self.store.fit_strings(input_file=[input_file], source=[source])
+    record = (input_file, source, size, mtime, trigtime, sampling_freq, window[0], window[1])
+
+    rows = self._replace.get(source)
+    if rows:
+      self._replaced.add(source)
+      records = np.array([record], dtype=self.store.traces_dtype)
+      self.store.write([rows.pop(0)], ps, records, [bandvec], [summaryvec])
+      return
+
+    # only flush between sources, so an interrupted run never leaves part
+    # of a sequence mode file in the store
+    if len(self._power) >= self.blocksize and self._records[-1][1] != source:
+      self.flush()
+
+    self._power.append(ps)
+    self._bands.append(bandvec)
+    self._summary.append(summaryvec)
+    self._records.append(record)
+
+  def flush(self):
+    if not self._power:
+      return
+    records = np.array(self._records, dtype=self.store.traces_dtype)
+    start = self.store.ntraces
+    self.store.append(np.array(self._power), records, np.array(self._bands), np.array(self._summary))
+    for row, source in enumerate(records['source'], start):
+      self._sources.setdefault(source, list()).append(row)
+    self._power = list()
+    self._bands = list()
+    self._summary = list()
+    self._records = list()
+
+  def abort(self):
+    """
+    Saves the spectra added so far, except those of the last source which
+    may be incomplete. Old spectra of replaced sources are kept.
+    """
+    if self._records:
+      last = self._records[-1][1]
+      while self._records and self._records[-1][1] == last:
+        self._records.pop()
+        self._power.pop()
+        self._bands.pop()
+        self._summary.pop()
+    if self.store is not None:
+      self.flush()
+
+  def close(self):
+    self.flush()
+
+    leftover = list()
+    for source in self._replaced:
+      leftover.extend(self._replace[source])
+    if leftover:
+      self.store.remove(leftover)
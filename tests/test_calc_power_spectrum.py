@@ -0,0 +1,227 @@
+"""
+Checks the spectra, band integrals and summaries calc_power_spectrum.py
+saves, and that merged npz files and spectrum stores of the same inputs
+give the same results.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from calc_power_spectrum import get_engine, load_summary, _watch_ready
+from spectrum_store import SpectrumStore
+from tests.trc_fixtures import make_trc, sine_samples
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_script(script, cwd, *args):
+  env = dict(os.environ)
+  # thesis scripts refuse to run without them
+  env.setdefault('SIOS_PATH', cwd)
+  env.setdefault('DPHIL_BIN', cwd)
+  with open(os.devnull, 'w') as devnull:
+    return subprocess.check_output([sys.executable, os.path.join(REPO, script)] + list(args),
+                                   cwd=cwd, stderr=devnull, env=env)
+
+class MergeTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.names = ['C1T%05d.trc'%(idx) for idx in range(5)]
+    for idx, name in enumerate(self.names):
+      make_trc(os.path.join(self.tmpdir, name), sine_samples(2000, period=10 + idx, seed=idx),
+               trigtime=(float(idx), 0, 12, 1, 1, 2015))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def merge(self, *args):
+    args = ['-merge', '-drive_freq', '1e7', '0', '10u'] + self.names + ['-summary_highpass', '2e7'] + list(args)
+    run_script('calc_power_spectrum.py', self.tmpdir, *args)
+    npz = os.path.join(self.tmpdir, 'C1T00000__C1T00004.power.npz')
+    store = os.path.join(self.tmpdir, 'C1T00000__C1T00004.power.spectra')
+    return npz, store
+
+  def test_npz_and_store(self):
+    npz, _ = self.merge('-max_freq_bins', '100')
+    _, store = self.merge('-max_freq_bins', '100', '-merge_format', 'store')
+    store = SpectrumStore(store)
+    merged = np.load(npz)
+    for row, name in enumerate(self.names):
+      datadict = merged[name].item()
+      np.testing.assert_allclose(store.power[row], datadict['data'][:,1], rtol=1e-12)
+      np.testing.assert_allclose(store.freqs, datadict['data'][:,0], rtol=1e-12)
+      for band in store.band_names:
+        self.assertAlmostEqual(store.band(band)[row], datadict['header']['bands'][band])
+
+    npzsummary = load_summary(npz)
+    storesummary = load_summary(store.path)
+    for field in npzsummary.dtype.names:
+      np.testing.assert_array_equal(npzsummary[field], storesummary[field])
+
+  def test_summary_before_averaging(self):
+    _, full = self.merge('-merge_format', 'store', '-suffix', 'full')
+    _, store = self.merge('-max_freq_bins', '100', '-merge_format', 'store')
+    full = SpectrumStore(full.replace('.power.', 'full.power.'))
+    store = SpectrumStore(store)
+    self.assertLessEqual(store.power.shape[1], 100)
+
+    summary = load_summary(store.path)
+    fullsummary = load_summary(full.path)
+    # summaries and bands are of the spectra before -max_freq_bins averaging
+    np.testing.assert_allclose(summary['total'], store.band('total'), rtol=1e-12)
+    for field in ('total', 'variance', 'highpass_2e+07'):
+      np.testing.assert_allclose(summary[field], fullsummary[field], rtol=1e-12)
+
+    # except peak_bin, which is the saved bin that holds the peak
+    factor = -(-full.power.shape[1]//store.power.shape[1])
+    np.testing.assert_array_equal(summary['peak_bin'], np.argmax(full.power, axis=1)//factor)
+
+  def test_cavitation_energy(self):
+    npz, _ = self.merge('-max_freq_bins', '100')
+    _, store = self.merge('-max_freq_bins', '100', '-merge_format', 'store')
+    for args in ((), ('-highpass', '2e7'), ('-band', 'harmonic'), ('-variance',)):
+      energies = [run_script('thesis_calc_cavitation_energy.py', self.tmpdir, *(args + (path,))).split()[0]
+                  for path in (npz, store)]
+      self.assertAlmostEqual(float(energies[0]), float(energies[1]), delta=abs(float(energies[0]))*1e-9)
+
+  def test_bands_from_summary(self):
+    npz, _ = self.merge()
+    summary = load_summary(npz)
+    merged = np.load(npz)
+    for row, name in enumerate(self.names):
+      bands = merged[name].item()['header']['bands']
+      self.assertEqual(summary['band_harmonic'][row], bands['harmonic'])
+    del merged
+
+    energy = run_script('thesis_calc_cavitation_energy.py', self.tmpdir, '-band', 'harmonic', npz).split()[0]
+    # the spectra are not needed, only the summary table
+    with open(npz, 'wb') as fh:
+      fh.write(b'not an npz')
+    mtime = os.path.getmtime(os.path.splitext(npz)[0] + '.summary.npy')
+    os.utime(npz, (mtime - 10, mtime - 10))
+    self.assertEqual(run_script('thesis_calc_cavitation_energy.py', self.tmpdir, '-band', 'harmonic', npz).split()[0], energy)
+
+  def load_merged(self, *args):
+    npz, _ = self.merge(*args)
+    merged = np.load(npz)
+    return dict((name, merged[name].item()) for name in merged.files)
+
+  def assertMergedEqual(self, merged, reference):
+    self.assertEqual(sorted(merged), sorted(reference))
+    for name in reference:
+      np.testing.assert_array_equal(merged[name]['data'], reference[name]['data'])
+      header = merged[name]['header']
+      expected = reference[name]['header']
+      for key in ('input_file', 'sampling_freq', 'window', 'trigtime', 'trigtime_epoch'):
+        self.assertEqual(header[key], expected[key])
+      # the matrix products of a batch sum in a different order
+      for key in ('bands', 'summary'):
+        self.assertEqual(sorted(header[key]), sorted(expected[key]))
+        for field in expected[key]:
+          self.assertAlmostEqual(header[key][field], expected[key][field], delta=abs(expected[key][field])*1e-12)
+
+  def test_batch(self):
+    # a record that ends inside the window, in the middle, cuts a batch short
+    make_trc(os.path.join(self.tmpdir, self.names[2]), sine_samples(800, period=12, seed=2),
+             trigtime=(2.0, 0, 12, 1, 1, 2015))
+    reference = self.load_merged()
+    for batch in ('2', '3', '10'):
+      self.assertMergedEqual(self.load_merged('-batch', batch), reference)
+
+  def test_jobs(self):
+    reference = self.load_merged()
+    self.assertMergedEqual(self.load_merged('-jobs', '2'), reference)
+    self.assertMergedEqual(self.load_merged('-jobs', '3', '-batch', '2'), reference)
+
+    # the same spectra are skipped and kept as by one process, stop_after
+    # counts from the first spectrum, not from start_at
+    reference = self.load_merged('-start_at', '1', '-stop_after', '3')
+    self.assertEqual(sorted(reference), self.names[1:3])
+    self.assertMergedEqual(self.load_merged('-start_at', '1', '-stop_after', '3', '-jobs', '2'), reference)
+
+  def test_float32(self):
+    npz, _ = self.merge()
+    reference = np.load(npz)[self.names[0]].item()['data']
+    npz, store = self.merge('-float32', '-merge_format', 'store')
+    self.merge('-float32')
+    data = np.load(npz)[self.names[0]].item()['data']
+    # only the power is single precision
+    self.assertEqual(data.dtype, np.float64)
+    np.testing.assert_array_equal(data[:,0], reference[:,0])
+    np.testing.assert_allclose(data[:,1], reference[:,1], atol=1e-5 * reference[:,1].max())
+
+    store = SpectrumStore(store)
+    self.assertEqual(store.power.dtype, np.float32)
+    np.testing.assert_array_equal(store.freqs, reference[:,0])
+
+class WelchTest(unittest.TestCase):
+  """
+  SpectrumEngine.welch is scipy.signal.welch with a boxcar window, except
+  that power at positive frequencies is not doubled and there is no Nyquist
+  bin, like the periodograms
+  """
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.fs = 1e8
+    self.x = np.sin(2*np.pi*1e7*np.arange(5000)/self.fs) + rng.randn(3, 5000)
+
+  def scipy_welch(self, x, nperseg, hop):
+    from scipy.signal import welch
+    freqs, ps = welch(x, self.fs, window='boxcar', nperseg=nperseg, noverlap=nperseg - hop,
+                      detrend='constant', scaling='density', axis=-1)
+    nbins = (nperseg + 1)//2
+    ps = ps[..., :nbins]
+    ps[..., 1:] /= 2
+    return freqs[:nbins], ps
+
+  def assertWelch(self, x, nperseg, hop, rtol=1e-10, dtype=np.float64):
+    engine = get_engine(dtype)
+    freqs, expected = self.scipy_welch(x, nperseg, hop)
+    ps = engine.welch(x, self.fs, nperseg, hop)
+    self.assertEqual(ps.dtype, dtype)
+    np.testing.assert_allclose(engine.frequencies(nperseg, self.fs), freqs, rtol=1e-12)
+    np.testing.assert_allclose(ps, expected, rtol=rtol, atol=rtol * expected.max())
+
+  def test_segments(self):
+    for nperseg, hop in ((500, 250), (333, 333), (256, 100), (5000, 1)):
+      self.assertWelch(self.x[0], nperseg, hop)
+
+  def test_stack(self):
+    self.assertWelch(self.x, 500, 250)
+
+  def test_float32(self):
+    self.assertWelch(self.x[0], 500, 250, rtol=1e-4, dtype=np.float32)
+
+class WatchReadyTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'C1T00000.trc')
+    make_trc(self.path, sine_samples(1000))
+    with open(self.path, 'rb') as fh:
+      self.content = fh.read()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def ready(self, content):
+    with open(self.path, 'wb') as fh:
+      fh.write(content)
+    return _watch_ready(self.path, len(content))
+
+  def test_partial(self):
+    self.assertTrue(self.ready(self.content))
+    self.assertFalse(self.ready(self.content[:-1]))
+    self.assertFalse(self.ready(self.content[:200]))
+    self.assertFalse(self.ready(b''))
+
+  def test_junk(self):
+    # processed, so the error is reported rather than waited on forever
+    self.assertTrue(self.ready(b'\0' * len(self.content)))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,48 @@
+"""
+Checks the trigger times calc_stft.py gives the windows of a record.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from calc_stft import calc_stft, get_commandline_parser
+from tests.trc_fixtures import make_trc, sine_samples
+
+INTERVAL = 1e-8
+# as saved in the WAVEDESC
+HORIZ_INTERVAL = float(np.float32(INTERVAL))
+
+class STFTTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'long.trc')
+    make_trc(self.path, sine_samples(20000), interval=INTERVAL)
+    self.output = os.path.join(self.tmpdir, 'long.stft.spectra')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def stft(self, *args):
+    cmdargs = vars(get_commandline_parser().parse_args(list(args) + [self.path]))
+    return calc_stft(self.output, **cmdargs)
+
+  def test_windows(self):
+    store = self.stft('-overlap', '0.5', '2u')
+    traces = store.traces
+    # 200 samples every 100 samples
+    self.assertEqual(len(store), 199)
+    self.assertTrue(np.all(np.diff(traces['trigtime']) > 0))
+    np.testing.assert_allclose(np.diff(traces['window_start']), 100 * HORIZ_INTERVAL, rtol=1e-9)
+    np.testing.assert_allclose(traces['window_end'] - traces['window_start'], 199 * HORIZ_INTERVAL, rtol=1e-9)
+
+  def test_unresolvable_hop(self):
+    # windows every 10 ns, far less than trigger times can resolve
+    self.assertRaises(AssertionError, self.stft, '-overlap', '0.99', '1u')
+    self.assertFalse(os.path.exists(self.output))
+
+if __name__ == '__main__':
+  unittest.main()
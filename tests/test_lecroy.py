@@ -0,0 +1,287 @@
+"""
+Checks that LecroyBinaryWaveform reads trc files as the original parser did,
+whichever way they are opened, splits sequence mode files into segments and
+exports samples to npz that read back the same.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+from lecroy import LecroyBinaryWaveform, datetime_to_epoch, epoch_to_datetime
+from tests.trc_fixtures import make_trc, sine_samples
+
+# metadata of the original parser, see LecroyBinaryWaveform.metadata
+BASELINE_METADATA = ['COMM_ORDER', 'COMM_TYPE', 'FIXED_VERT_GAIN',
+                     'HORIZ_INTERVAL', 'HORIZ_OFFSET', 'INSTRUMENT_NAME',
+                     'INSTRUMENT_NUMBER', 'PROCESSING_DONE', 'RECORD_TYPE',
+                     'TEMPLATE_NAME', 'TRACE_LABEL', 'TRIG_TIME',
+                     'VERTICAL_GAIN', 'VERTICAL_OFFSET', 'VERT_COUPLING',
+                     'WAVE_SOURCE']
+
+GAIN = 0.01
+OFFSET = 0.5
+INTERVAL = 1e-8
+HOFFSET = -1e-6
+
+def baseline_volts(raw):
+  """
+  Volts as the original parser computed them, from the float gain and
+  offset of the WAVEDESC
+  """
+  return np.float32(GAIN) * raw - np.float32(OFFSET)
+
+def baseline_time(n):
+  return np.arange(n) * np.float32(INTERVAL) + HOFFSET
+
+class LecroyReaderTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.raw = sine_samples(1000)
+    self.path = os.path.join(self.tmpdir, 'C1T00000.trc')
+    make_trc(self.path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_samples(self):
+    bwf = LecroyBinaryWaveform(self.path)
+    self.assertEqual(bwf.WAVE_ARRAY_1.dtype, np.float32)
+    np.testing.assert_array_equal(bwf.WAVE_ARRAY_1.ravel(), baseline_volts(self.raw))
+    np.testing.assert_allclose(bwf.WAVE_ARRAY_1_time, baseline_time(len(self.raw)), rtol=1e-12)
+
+  def test_mmap(self):
+    eager = LecroyBinaryWaveform(self.path)
+    mapped = LecroyBinaryWaveform(self.path, mmap=True)
+    np.testing.assert_array_equal(mapped.WAVE_ARRAY_1, eager.WAVE_ARRAY_1)
+    self.assertEqual(mapped.metadata, eager.metadata)
+
+  def test_file_content(self):
+    with open(self.path, 'rb') as fh:
+      content = fh.read()
+    bwf = LecroyBinaryWaveform(self.path, content)
+    np.testing.assert_array_equal(bwf.WAVE_ARRAY_1.ravel(), baseline_volts(self.raw))
+
+  def test_metadata(self):
+    bwf = LecroyBinaryWaveform(self.path)
+    self.assertEqual(sorted(bwf.metadata), BASELINE_METADATA)
+    # the original parser truncated seconds to whole microseconds
+    self.assertEqual(bwf.TRIG_TIME, datetime(2014, 6, 5, 14, 30, 12, 345677))
+    self.assertEqual(bwf.VERT_COUPLING, 'DC_50_Ohms')
+    self.assertEqual(bwf.nsamples, len(self.raw))
+
+  def test_header_only(self):
+    eager = LecroyBinaryWaveform(self.path)
+    header = LecroyBinaryWaveform(self.path, header_only=True)
+    self.assertEqual(header.metadata, eager.metadata)
+
+  def test_trig_time_epoch(self):
+    bwf = LecroyBinaryWaveform(self.path, header_only=True)
+    self.assertEqual(bwf.trig_time_epoch, datetime_to_epoch(bwf.TRIG_TIME))
+    self.assertEqual(epoch_to_datetime(bwf.trig_time_epoch), bwf.TRIG_TIME)
+
+  def test_read_window(self):
+    time = baseline_time(len(self.raw))
+    start, end = time[100], time[300]
+    for kwargs in (dict(), dict(mmap=True), dict(header_only=True)):
+      bwf = LecroyBinaryWaveform(self.path, **kwargs)
+      tvec, yvec = bwf.read_window(start, end)
+      self.assertEqual(len(tvec), 200)
+      np.testing.assert_allclose(tvec.values, time[100:300], rtol=1e-12)
+      np.testing.assert_array_equal(yvec, baseline_volts(self.raw[100:300]))
+
+  def test_iter_blocks(self):
+    bwf = LecroyBinaryWaveform(self.path, header_only=True)
+    blocks = [block for _, block in bwf.iter_blocks(128)]
+    np.testing.assert_array_equal(np.concatenate(blocks), baseline_volts(self.raw))
+
+  def test_big_endian(self):
+    path = os.path.join(self.tmpdir, 'big.trc')
+    make_trc(path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET, big_endian=True)
+    bwf = LecroyBinaryWaveform(path, mmap=True)
+    np.testing.assert_array_equal(bwf.WAVE_ARRAY_1.ravel(), baseline_volts(self.raw))
+
+  def test_byte_samples(self):
+    raw = (self.raw//10).astype(np.int8)
+    path = os.path.join(self.tmpdir, 'byte.trc')
+    make_trc(path, raw, GAIN, OFFSET, INTERVAL, HOFFSET, comm_type=0)
+    bwf = LecroyBinaryWaveform(path)
+    np.testing.assert_array_equal(bwf.WAVE_ARRAY_1.ravel(), baseline_volts(raw))
+
+class NpzExportTest(unittest.TestCase):
+  """
+  savenpz keeps the raw samples and scaling, so load_npz and DataLoader read
+  back what the trc file holds
+  """
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.raw = sine_samples(1000)
+    self.path = os.path.join(self.tmpdir, 'C1T00000.trc')
+    make_trc(self.path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET)
+    self.npzpath = self.path + '.npz'
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_round_trip(self):
+    from lecroy import load_npz
+    bwf = LecroyBinaryWaveform(self.path, mmap=True)
+    bwf.savenpz(self.npzpath)
+    time_axis, yvec, header = load_npz(self.npzpath)
+    np.testing.assert_array_equal(yvec, baseline_volts(self.raw))
+    np.testing.assert_array_equal(time_axis.values, bwf.WAVE_ARRAY_1_time)
+    self.assertEqual(header, bwf._export_header())
+
+    npz = np.load(self.npzpath)
+    self.assertEqual(npz['raw'].dtype, np.int16)
+    self.assertNotIn('TRIGTIME_ARRAY', npz.files)
+
+  def test_sequence(self):
+    trigtimes = np.array([[0.0, -1e-6], [2e-3, -1e-6]])
+    make_trc(self.path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET, trigtime_array=trigtimes)
+    LecroyBinaryWaveform(self.path).savenpz(self.npzpath)
+    np.testing.assert_array_equal(np.load(self.npzpath)['TRIGTIME_ARRAY'], trigtimes)
+
+  def test_dataloader(self):
+    from dataloader import DataLoader
+    LecroyBinaryWaveform(self.path).savenpz(self.npzpath)
+    data = DataLoader(self.npzpath)
+    self.assertEqual(data.source, 'lecroy.py')
+    np.testing.assert_array_equal(data.matrix, DataLoader(self.path).matrix)
+
+  def test_jobs(self):
+    import subprocess
+    import sys
+    paths = [self.path] + [os.path.join(self.tmpdir, 'C1T%05d.trc'%(idx)) for idx in (1, 2)]
+    for idx, path in enumerate(paths):
+      make_trc(path, sine_samples(1000, seed=idx), GAIN, OFFSET, INTERVAL, HOFFSET)
+
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lecroy.py')
+    loaded = list()
+    for jobs in ('1', '2'):
+      subprocess.check_output([sys.executable, script, '-npz', '-jobs', jobs] + paths)
+      loaded.append([dict(np.load(path + '.npz')) for path in paths])
+    for serial, parallel in zip(*loaded):
+      self.assertEqual(sorted(serial), sorted(parallel))
+      for name in serial:
+        np.testing.assert_array_equal(serial[name], parallel[name])
+
+class ZipMemberTest(unittest.TestCase):
+  """
+  A zipped copy of a trc file reads the same as the file, whether the
+  member is stored, and memory mapped in place, or deflated and streamed
+  """
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.raw = sine_samples(1000)
+    self.path = os.path.join(self.tmpdir, 'C1T00000.trc')
+    make_trc(self.path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET)
+    self.reference = LecroyBinaryWaveform(self.path)
+
+    self.zips = list()
+    for name, compression in (('stored.zip', zipfile.ZIP_STORED),
+                              ('deflated.zip', zipfile.ZIP_DEFLATED)):
+      zippath = os.path.join(self.tmpdir, name)
+      zf = zipfile.ZipFile(zippath, 'w', compression)
+      zf.write(self.path, 'C1T00000.trc')
+      zf.close()
+      self.zips.append(zipfile.ZipFile(zippath))
+
+  def tearDown(self):
+    for zf in self.zips:
+      zf.close()
+    shutil.rmtree(self.tmpdir)
+
+  def test_samples(self):
+    for zf in self.zips:
+      for kwargs in (dict(), dict(mmap=True)):
+        bwf = LecroyBinaryWaveform('C1T00000.trc', zipfile=zf, **kwargs)
+        np.testing.assert_array_equal(bwf.WAVE_ARRAY_1, self.reference.WAVE_ARRAY_1)
+        self.assertEqual(bwf.metadata, self.reference.metadata)
+
+  def test_read_content(self):
+    # as the original parser was given zip members
+    for zf in self.zips:
+      bwf = LecroyBinaryWaveform('C1T00000.trc', zf.read('C1T00000.trc'))
+      np.testing.assert_array_equal(bwf.WAVE_ARRAY_1, self.reference.WAVE_ARRAY_1)
+
+  def test_read_window(self):
+    time = baseline_time(len(self.raw))
+    for zf in self.zips:
+      bwf = LecroyBinaryWaveform('C1T00000.trc', header_only=True, zipfile=zf)
+      self.assertEqual(bwf.metadata, self.reference.metadata)
+      tvec, yvec = bwf.read_window(time[500], time[700])
+      np.testing.assert_array_equal(yvec, baseline_volts(self.raw[500:700]))
+
+  def test_loadtrc(self):
+    from calc_power_spectrum import _loadtrc
+    (name, tvec, yvec, trigtime), = _loadtrc(self.path)
+    for zf in self.zips:
+      (zname, ztvec, zyvec, ztrigtime), = _loadtrc('C1T00000.trc', zipfile=zf)
+      np.testing.assert_array_equal(zyvec, yvec)
+      np.testing.assert_array_equal(np.asarray(ztvec), np.asarray(tvec))
+      self.assertEqual(ztrigtime, trigtime)
+
+class SequenceTest(unittest.TestCase):
+  """
+  Sequence mode files hold several segments of samples, each with its own
+  trigger time and offset
+  """
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.raw = sine_samples(3000)
+    # trigger time relative to the first trigger, and HORIZ_OFFSET, of each
+    self.trigtimes = np.array([[0.0, -1e-6], [2e-3, -1.5e-6], [5e-3, -0.5e-6]])
+    self.path = os.path.join(self.tmpdir, 'C1T00000.trc')
+    make_trc(self.path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET, trigtime_array=self.trigtimes)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_segments(self):
+    for kwargs in (dict(), dict(mmap=True)):
+      bwf = LecroyBinaryWaveform(self.path, **kwargs)
+      self.assertTrue(bwf.is_sequence)
+      self.assertEqual(bwf.nsegments, 3)
+      self.assertEqual(bwf.samples_per_segment, 1000)
+      np.testing.assert_array_equal(bwf.raw_segments, self.raw.reshape(3, 1000))
+      np.testing.assert_array_equal(bwf.segments, baseline_volts(self.raw).reshape(3, 1000))
+      np.testing.assert_array_equal(bwf.segment_trigger_times, self.trigtimes[:,0])
+      np.testing.assert_array_equal(bwf.segment_trigger_offsets, self.trigtimes[:,1])
+
+  def test_single_segment(self):
+    path = os.path.join(self.tmpdir, 'single.trc')
+    make_trc(path, self.raw, GAIN, OFFSET, INTERVAL, HOFFSET)
+    bwf = LecroyBinaryWaveform(path, header_only=True)
+    self.assertFalse(bwf.is_sequence)
+    self.assertEqual(bwf.nsegments, 1)
+    np.testing.assert_array_equal(bwf.segment_trigger_times, [0.0])
+    np.testing.assert_array_equal(bwf.segment_trigger_offsets, [bwf.HORIZ_OFFSET])
+
+  def test_loadtrc(self):
+    from calc_power_spectrum import _loadtrc
+    trig_time_epoch = LecroyBinaryWaveform(self.path, header_only=True).trig_time_epoch
+    loaded = list(_loadtrc(self.path))
+    self.assertEqual([name for name, _, _, _ in loaded],
+                     [os.path.join(self.tmpdir, 'C1T00000-seg%05d.trc'%(seg)) for seg in range(3)])
+    for seg, (name, tvec, yvec, trigtime) in enumerate(loaded):
+      self.assertEqual(trigtime, trig_time_epoch + self.trigtimes[seg, 0])
+      self.assertEqual(tvec[0], self.trigtimes[seg, 1])
+      np.testing.assert_array_equal(yvec, baseline_volts(self.raw[seg*1000:(seg+1)*1000]))
+
+  def test_loadtrc_window(self):
+    from calc_power_spectrum import _loadtrc
+    # each segment is windowed relative to its own first sample, the end
+    # is between samples so float32 rounding of the interval does not matter
+    for seg, (name, tvec, yvec, trigtime) in enumerate(_loadtrc(self.path, window=('start', '2.005u'))):
+      self.assertEqual(len(tvec), 201)
+      self.assertEqual(tvec[0], self.trigtimes[seg, 1])
+      np.testing.assert_array_equal(yvec, baseline_volts(self.raw[seg*1000:seg*1000+201]))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,78 @@
+"""
+Checks that lecroy_channels.py groups the channels of each trigger and
+refuses channels that do not share a timebase.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from lecroy import LecroyBinaryWaveform
+from lecroy_channels import group_channel_files, iter_channel_groups, load_channel_group, split_channel
+from tests.trc_fixtures import make_trc, sine_samples
+
+class ChannelsTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    for trigger in range(2):
+      for channel in (1, 2, 3):
+        if trigger == 1 and channel == 3:
+          continue
+        make_trc(self.path(channel, trigger), sine_samples(500, seed=10*trigger + channel),
+                 trigtime=(float(trigger), 0, 12, 1, 1, 2015))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def path(self, channel, trigger):
+    return os.path.join(self.tmpdir, 'C%dTrace%05d.trc'%(channel, trigger))
+
+  def key(self, trigger):
+    return os.path.join(self.tmpdir, 'Trace%05d.trc'%(trigger))
+
+  def test_split_channel(self):
+    self.assertEqual(split_channel(self.path(2, 1)), (2, self.key(1)))
+    self.assertIsNone(split_channel(os.path.join(self.tmpdir, 'C5Trace00001.trc')))
+    self.assertIsNone(split_channel(os.path.join(self.tmpdir, 'notes.txt')))
+
+  def test_group(self):
+    files = [self.path(channel, trigger) for trigger, channel in ((1, 2), (0, 3), (1, 1), (0, 1), (0, 2))]
+    files.append(os.path.join(self.tmpdir, 'notes.txt'))
+    self.assertEqual(group_channel_files(files),
+                     [(self.key(0), [(1, self.path(1, 0)), (2, self.path(2, 0)), (3, self.path(3, 0))]),
+                      (self.key(1), [(1, self.path(1, 1)), (2, self.path(2, 1))])])
+
+  def test_load(self):
+    filelist = [(channel, self.path(channel, 0)) for channel in (1, 2, 3)]
+    channels, time_axis, data, trigtime = load_channel_group(filelist)
+    self.assertEqual(channels, [1, 2, 3])
+    self.assertEqual(data.shape, (3, 500))
+    for row, (_, fname) in enumerate(filelist):
+      bwf = LecroyBinaryWaveform(fname)
+      np.testing.assert_array_equal(data[row], bwf.WAVE_ARRAY_1.ravel())
+      self.assertEqual(trigtime, bwf.TRIG_TIME)
+    np.testing.assert_array_equal(np.asarray(time_axis), bwf.WAVE_ARRAY_1_time)
+
+  def test_channels(self):
+    files = [self.path(channel, trigger) for trigger in range(2) for channel in (1, 2, 3)
+             if os.path.exists(self.path(channel, trigger))]
+    groups = list(iter_channel_groups(files))
+    self.assertEqual([(key, channels) for key, channels, _, _, _ in groups],
+                     [(self.key(0), [1, 2, 3]), (self.key(1), [1, 2])])
+    # triggers missing a channel are skipped
+    groups = list(iter_channel_groups(files, channels=[1, 3]))
+    self.assertEqual([(key, channels) for key, channels, _, _, _ in groups], [(self.key(0), [1, 3])])
+
+  def test_mismatch(self):
+    make_trc(self.path(4, 0), sine_samples(400), trigtime=(0.0, 0, 12, 1, 1, 2015))
+    self.assertRaises(AssertionError, load_channel_group, [(1, self.path(1, 0)), (4, self.path(4, 0))])
+    make_trc(self.path(4, 0), sine_samples(500), interval=2e-8, trigtime=(0.0, 0, 12, 1, 1, 2015))
+    self.assertRaises(AssertionError, load_channel_group, [(1, self.path(1, 0)), (4, self.path(4, 0))])
+    # channel 2 of trigger 1 is a second after channel 1 of trigger 0
+    self.assertRaises(AssertionError, load_channel_group, [(1, self.path(1, 0)), (2, self.path(2, 1))])
+
+if __name__ == '__main__':
+  unittest.main()
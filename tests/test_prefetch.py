@@ -0,0 +1,110 @@
+"""
+Checks that prefetch yields results in order however the reader threads
+finish, raises exceptions where they happened and bounds its read-ahead.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from prefetch import prefetch, sizeof
+from tests.trc_fixtures import make_trc, sine_samples
+
+class Recorder(object):
+  """
+  func for prefetch that records how far ahead of the consumer it was called
+  """
+  def __init__(self, delays=None):
+    self.delays = delays or dict()
+    self.consumed = 0
+    self.ahead = 0
+    self.lock = threading.Lock()
+
+  def __call__(self, item):
+    if item == 'fail':
+      raise ValueError(item)
+    with self.lock:
+      self.ahead = max(self.ahead, item - self.consumed)
+    time.sleep(self.delays.get(item, 0))
+    return item
+
+class PrefetchTest(unittest.TestCase):
+  def test_order(self):
+    # later items finish first
+    delays = dict((idx, 0.01 * (10 - idx)) for idx in range(10))
+    for threads in (1, 3):
+      self.assertEqual(list(prefetch(Recorder(delays), range(10), depth=5, threads=threads)), range(10))
+
+  def test_exception(self):
+    results = list()
+    gen = prefetch(Recorder(), [0, 1, 'fail', 3], threads=2)
+    try:
+      for result in gen:
+        results.append(result)
+    except ValueError as e:
+      self.assertEqual(str(e), 'fail')
+    else:
+      self.fail('ValueError not raised')
+    # results before the exception are yielded
+    self.assertEqual(results, [0, 1])
+
+  def test_depth(self):
+    func = Recorder()
+    for item in prefetch(func, range(20), depth=3, threads=4):
+      time.sleep(0.005)
+      func.consumed = item + 1
+    self.assertLessEqual(func.ahead, 3)
+
+  def test_max_bytes(self):
+    started = list()
+    def load(item):
+      started.append(item)
+      return np.zeros(100, dtype=np.uint8)
+
+    gen = prefetch(load, range(10), depth=10, max_bytes=250)
+    self.assertEqual(sizeof(next(gen)), 100)
+    time.sleep(0.05)
+    # the three results read ahead hold 300 bytes, enough to stop reading
+    self.assertEqual(len(started), 4)
+    self.assertEqual(len(list(gen)), 9)
+
+  def test_close(self):
+    before = threading.enumerate()
+    gen = prefetch(Recorder(), range(100), depth=2, threads=2)
+    next(gen)
+    gen.close()
+    time.sleep(0.05)
+    self.assertEqual([thread for thread in threading.enumerate() if thread not in before], [])
+
+  def test_sizeof(self):
+    self.assertEqual(sizeof((np.zeros(3), [np.zeros(2, dtype=np.int16), 'name'], None)), 28)
+
+class LoadInputsTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.inputs = list()
+    for idx in range(6):
+      path = os.path.join(self.tmpdir, 'C1T%05d.trc'%(idx))
+      make_trc(path, sine_samples(1000, seed=idx))
+      self.inputs.append((None, path))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_prefetch(self):
+    from calc_power_spectrum import _load_inputs
+    window = ('start', '5u')
+    serial = list(_load_inputs(self.inputs, window))
+    prefetched = list(_load_inputs(self.inputs, window, prefetch_depth=3, prefetch_threads=2))
+    self.assertEqual([name for name, _, _, _ in prefetched], [name for name, _, _, _ in serial])
+    for (_, tvec, yvec, trigtime), (_, stvec, syvec, strigtime) in zip(prefetched, serial):
+      np.testing.assert_array_equal(yvec, syvec)
+      self.assertEqual(trigtime, strigtime)
+
+if __name__ == '__main__':
+  unittest.main()
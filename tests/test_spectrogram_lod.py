@@ -0,0 +1,110 @@
+"""
+Checks that spectrogram images rendered from the LOD cache are the same as
+those binned straight from the spectra, as plot_spectrogram.py does when
+there is no cache level for the image.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from spectrum_store import SpectrumStore
+from spectrogram_binning import SpectrogramRaster, reduce_blocks
+from spectrogram_lod import open_lod
+
+NSPECTRA = 1000
+NFREQS = 5000
+
+def binned_image(power, freqs, start, stop, colsize, fstart, fstop, rowsize, how='mean', highpass=0, chunksize=100):
+  """
+  The image of spectra start to stop-1 as plot_spectrogram._binned_spectrogram
+  makes it, a chunk of spectra at a time
+  """
+  hpstop = np.searchsorted(freqs, highpass, 'left')
+  raster = SpectrogramRaster(colsize, NSPECTRA, how)
+  for cstart in range(start, stop, chunksize):
+    tile = np.array(power[cstart:min(stop, cstart + chunksize), fstart:fstop])
+    if hpstop > fstart:
+      tile[:,:hpstop-fstart] = 0
+    tile, _ = reduce_blocks(tile, rowsize, axis=1, how=how)
+    raster.add(tile)
+  assert raster.colsize == colsize
+  return raster.finish()
+
+class LODParityTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    self.freqs = np.linspace(0, 50e6, NFREQS)
+    # spectra that change over time, so misaligned columns show
+    self.power = rng.rand(NSPECTRA, NFREQS) * np.linspace(1, 100, NSPECTRA)[:,np.newaxis]
+
+    path = os.path.join(self.tmpdir, 'run.power.spectra')
+    store = SpectrumStore.create(path, self.freqs)
+    records = store.make_records(NSPECTRA)
+    records['input_file'] = ['C1T%05d.trc'%(idx) for idx in range(NSPECTRA)]
+    records['trigtime'] = 1.4e9 + np.arange(NSPECTRA) * 0.2
+    store.append(self.power, records)
+    self.lod = open_lod(path, chunk_bytes=2**20)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def assertParity(self, start, stop, colsize, fstart, fstop, rowsize, how='mean', highpass=0):
+    k = self.lod.choose_level(start, stop, colsize, rowsize, highpass)
+    self.assertIsNotNone(k)
+    image = self.lod.render(k, start, stop, colsize, fstart, fstop, rowsize,
+                            how=how, highpass=highpass, chunk_bytes=2**16)
+    expected = binned_image(self.power, self.freqs, start, stop, colsize,
+                            fstart, fstop, rowsize, how, highpass)
+    self.assertEqual(image.shape, expected.shape)
+    # levels are saved in single precision
+    np.testing.assert_allclose(image, expected, rtol=1e-6)
+
+  def test_levels(self):
+    self.assertEqual(self.lod.freq_blocksize, 4)
+    self.assertEqual(self.lod.levels[-1], 10)
+
+  def test_mean(self):
+    self.assertParity(0, NSPECTRA, 16, 0, NFREQS, 4)
+    self.assertParity(0, NSPECTRA, 64, 0, NFREQS, 32)
+
+  def test_max(self):
+    self.assertParity(0, NSPECTRA, 16, 0, NFREQS, 4, how='max')
+    self.assertParity(0, NSPECTRA, 128, 0, NFREQS, 16, how='max')
+
+  def test_partial(self):
+    # head_skip, -max_bins and -freq_lim crop the image
+    self.assertParity(128, 896, 32, 800, 2400, 8)
+    self.assertParity(256, NSPECTRA, 256, 1024, NFREQS, 64, how='max')
+
+  def test_highpass(self):
+    highpass = self.freqs[400]
+    self.assertParity(0, NSPECTRA, 16, 0, NFREQS, 8, highpass=highpass)
+    self.assertParity(0, NSPECTRA, 64, 0, NFREQS, 8, how='max', highpass=highpass)
+
+  def test_highpass_inside_block(self):
+    # only whole blocks of frequency bins can be zeroed, so the spectra have
+    # to be used
+    self.assertIsNone(self.lod.choose_level(0, NSPECTRA, 16, 8, self.freqs[401]))
+
+  def test_finer_than_cache(self):
+    self.assertIsNone(self.lod.choose_level(0, NSPECTRA, 2, 4))
+    self.assertIsNone(self.lod.choose_level(0, NSPECTRA, 16, 2))
+
+  def test_total(self):
+    np.testing.assert_allclose(self.lod.total, self.power.sum(axis=1), rtol=1e-12)
+    highpass = self.freqs[1001]
+    expected = self.power[:, self.freqs >= highpass].sum(axis=1)
+    np.testing.assert_allclose(self.lod.total_above(highpass), expected, rtol=1e-12)
+
+  def test_cached(self):
+    lod = open_lod(self.lod.source.path)
+    self.assertTrue(lod.is_current())
+    self.assertEqual(lod.levels, self.lod.levels)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,121 @@
+"""
+Checks that calc_power_spectrum.py -resume only computes the spectra of new
+and changed inputs, however the inputs are named on the command line.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+from spectrum_store import SpectrumStore
+from tests.trc_fixtures import make_trc, sine_samples
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'calc_power_spectrum.py')
+
+def calc_power_spectrum(cwd, *args):
+  with open(os.devnull, 'w') as devnull:
+    subprocess.check_call([sys.executable, SCRIPT] + list(args), cwd=cwd, stderr=devnull)
+
+class ResumeTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+    self.datadir = os.path.join(self.tmpdir, 'data')
+    os.mkdir(self.datadir)
+    self.names = ['C1T%05d.trc'%(idx) for idx in range(3)]
+    for idx, name in enumerate(self.names):
+      self.write_trace(name, seed=idx)
+    self.store = os.path.join(self.tmpdir, 'run.power.spectra')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def write_trace(self, name, seed):
+    make_trc(os.path.join(self.datadir, name), sine_samples(1000, seed=seed),
+             trigtime=(float(seed), 0, 12, 1, 1, 2015))
+
+  def resume(self, cwd, inputs):
+    calc_power_spectrum(cwd, '-resume', self.store, '0', '5u', *inputs)
+    return SpectrumStore(self.store)
+
+  def snapshot(self):
+    store = SpectrumStore(self.store)
+    return np.array(store.power), np.array(store.traces)
+
+  def assertUnchanged(self, before):
+    power, traces = self.snapshot()
+    np.testing.assert_array_equal(power, before[0])
+    np.testing.assert_array_equal(traces, before[1])
+
+  def test_rerun(self):
+    store = self.resume(self.datadir, self.names)
+    self.assertEqual(len(store), 3)
+    self.assertEqual(sorted(store.sources()), [os.path.join(self.datadir, name) for name in self.names])
+
+    before = self.snapshot()
+    self.resume(self.datadir, self.names)
+    self.assertUnchanged(before)
+
+  def test_relative_then_absolute(self):
+    self.resume(self.datadir, self.names)
+    before = self.snapshot()
+    self.resume(self.tmpdir, [os.path.join(self.datadir, name) for name in self.names])
+    self.assertUnchanged(before)
+    self.resume(self.tmpdir, [os.path.join('data', name) for name in self.names])
+    self.assertUnchanged(before)
+
+  def test_absolute_then_relative(self):
+    self.resume(self.tmpdir, [os.path.join(self.datadir, name) for name in self.names])
+    before = self.snapshot()
+    self.resume(self.datadir, ['./' + name for name in self.names])
+    self.assertUnchanged(before)
+
+  def test_new_and_changed(self):
+    self.resume(self.datadir, self.names)
+    power, traces = self.snapshot()
+
+    self.write_trace('C1T00003.trc', seed=3)
+    self.write_trace(self.names[1], seed=10)
+    # make sure the mtime changes even on coarse clocks
+    path = os.path.join(self.datadir, self.names[1])
+    os.utime(path, (traces['mtime'][1] + 10, traces['mtime'][1] + 10))
+
+    store = self.resume(self.datadir, self.names + ['C1T00003.trc'])
+    self.assertEqual(len(store), 4)
+    np.testing.assert_array_equal(store.power[[0, 2]], power[[0, 2]])
+    self.assertFalse(np.array_equal(store.power[1], power[1]))
+    self.assertEqual(store.traces['source'][1], path)
+
+  def test_long_paths(self):
+    # longer than the 256 bytes the name fields start out with
+    longdir = os.path.join(self.datadir, 'x' * 200, 'y' * 100)
+    os.makedirs(longdir)
+    for name in self.names:
+      os.rename(os.path.join(self.datadir, name), os.path.join(longdir, name))
+    store = self.resume(longdir, self.names)
+    self.assertEqual(sorted(store.sources()), [os.path.join(longdir, name) for name in self.names])
+
+    before = self.snapshot()
+    self.resume(longdir, self.names)
+    self.assertUnchanged(before)
+
+  def test_zip(self):
+    zippath = os.path.join(self.tmpdir, 'data.zip')
+    zf = zipfile.ZipFile(zippath, 'w')
+    for name in self.names:
+      zf.write(os.path.join(self.datadir, name), name)
+    zf.close()
+
+    store = self.resume(self.tmpdir, ['data.zip'])
+    self.assertEqual(sorted(store.sources()), [zippath + '/' + name for name in self.names])
+    before = self.snapshot()
+    self.resume(self.datadir, [zippath])
+    self.assertUnchanged(before)
+
+if __name__ == '__main__':
+  unittest.main()
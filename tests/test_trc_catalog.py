@@ -0,0 +1,69 @@
+"""
+Checks the trace catalog of directories and zip archives, and the order
+calc_power_spectrum.py -catalog processes inputs in.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+from trc_catalog import build_catalog, load_catalog, sort_by_trigtime
+from tests.trc_fixtures import make_trc, sine_samples
+
+# trigger seconds of each file, so name order is not trigger time order
+SECONDS = [30.0, 10.0, 20.0]
+
+class CatalogTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.names = ['C1T%05d.trc'%(idx) for idx in range(len(SECONDS))]
+    for name, second in zip(self.names, SECONDS):
+      make_trc(os.path.join(self.tmpdir, name), sine_samples(100), trigtime=(second, 0, 12, 1, 1, 2015))
+    # files that are not traces are not catalogued, whatever the glob
+    with open(os.path.join(self.tmpdir, 'notes.txt'), 'w') as fh:
+      fh.write('not a trace\n')
+    os.mkdir(os.path.join(self.tmpdir, 'old.trc'))
+
+    self.zippath = os.path.join(self.tmpdir, 'run.zip')
+    zf = zipfile.ZipFile(self.zippath, 'w')
+    for name in self.names + ['notes.txt']:
+      zf.write(os.path.join(self.tmpdir, name), name)
+    zf.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def paths(self, names):
+    return [os.path.join(self.tmpdir, name) for name in names]
+
+  def test_directory(self):
+    catalog = build_catalog(self.tmpdir, '*')
+    self.assertEqual(list(catalog['name']), ['C1T00001.trc', 'C1T00002.trc', 'C1T00000.trc'])
+    self.assertTrue(np.all(np.diff(catalog['trigtime']) == 10))
+    self.assertTrue(np.all(catalog['nsamples'] == 100))
+    np.testing.assert_array_equal(load_catalog(self.tmpdir), catalog)
+
+  def test_zip(self):
+    catalog = build_catalog(self.zippath, '*')
+    self.assertEqual(list(catalog['name']), ['C1T00001.trc', 'C1T00002.trc', 'C1T00000.trc'])
+
+  def test_sort_by_trigtime(self):
+    self.assertEqual(sort_by_trigtime(self.paths(self.names)),
+                     self.paths(['C1T00001.trc', 'C1T00002.trc', 'C1T00000.trc']))
+    self.assertRaises(AssertionError, sort_by_trigtime, self.paths(self.names + ['notes.txt']))
+
+  def test_list_inputs(self):
+    from calc_power_spectrum import _list_inputs
+    inputs = _list_inputs(self.paths(['notes.txt'] + self.names), '*', catalog=True)
+    self.assertEqual([name for _, name in inputs],
+                     self.paths(['C1T00001.trc', 'C1T00002.trc', 'C1T00000.trc', 'notes.txt']))
+
+    inputs = _list_inputs([self.zippath], '*', catalog=True)
+    self.assertEqual([name for _, name in inputs], ['C1T00001.trc', 'C1T00002.trc', 'C1T00000.trc', 'notes.txt'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+"""
+Writes small Lecroy trc files, template LECROY_2_3, for the tests. Only the
+WAVEDESC fields lecroy.py reads are filled in, the rest are zero.
+"""
+
+import struct
+import numpy as np
+
+TRIG_TIME = (12.345678, 30, 14, 5, 6, 2014)
+
+def make_trc(path, raw, gain=0.01, offset=0.5, interval=1e-8, hoffset=-1e-6,
+             trigtime=TRIG_TIME, big_endian=False, comm_type=1,
+             trigtime_array=None, coupling=0):
+  """
+  Writes raw, the integer samples, to the trc file path.
+
+  trigtime: (seconds, minutes, hours, days, months, year) of TRIGGER_TIME
+  comm_type: 1 for 16 bit samples, 0 for 8 bit
+  trigtime_array: if given, a (segments, 2) array of trigger time and
+                  offset of each segment of a sequence mode file
+  coupling: VERT_COUPLING, 0 is DC_50_Ohms and 2 DC_1MOhm
+  """
+  e = '>' if big_endian else '<'
+  raw = np.asarray(raw)
+  data = raw.astype(e + ('i2' if comm_type else 'i1')).tobytes()
+
+  tta = b''
+  nsegments = 1
+  if trigtime_array is not None:
+    tta = np.asarray(trigtime_array, dtype=e + 'f8').tobytes()
+    nsegments = len(trigtime_array)
+
+  desc = bytearray(346)
+  desc[0:8] = b'WAVEDESC'
+  desc[16:26] = b'LECROY_2_3'
+  struct.pack_into(e + 'H', desc, 32, comm_type)
+  struct.pack_into(e + 'H', desc, 34, 0 if big_endian else 1)
+  struct.pack_into(e + 'i', desc, 36, len(desc))
+  struct.pack_into(e + 'i', desc, 48, len(tta))
+  struct.pack_into(e + 'i', desc, 60, len(data))
+  desc[76:84] = b'LECROYWR'
+  struct.pack_into(e + 'i', desc, 92, 1234)
+  desc[96:101] = b'label'
+  struct.pack_into(e + 'i', desc, 116, raw.size)
+  struct.pack_into(e + 'i', desc, 144, nsegments)
+  struct.pack_into(e + 'f', desc, 156, gain)
+  struct.pack_into(e + 'f', desc, 160, offset)
+  struct.pack_into(e + 'f', desc, 176, interval)
+  struct.pack_into(e + 'd', desc, 180, hoffset)
+  struct.pack_into(e + 'dBBBBh', desc, 296, *trigtime)
+  struct.pack_into(e + 'H', desc, 326, coupling)
+  struct.pack_into(e + 'H', desc, 344, 2)
+
+  with open(path, 'wb') as fh:
+    fh.write(b'#9000000000' + bytes(desc) + tta + data)
+
+def sine_samples(n, period=20, amplitude=1000, seed=0):
+  """
+  Returns n 16 bit samples of a sine with a little noise
+  """
+  rng = np.random.RandomState(seed)
+  x = amplitude * np.sin(2*np.pi*np.arange(n)/period) + rng.randint(-50, 50, n)
+  return x.astype(np.int16)
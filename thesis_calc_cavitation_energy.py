@@ -13,7 +13,9 @@ def pln(s):
   p(s)
   p('\n')
 
-def main(power_file=None, binsize=5, max_bins=601, head_skip=0, variance=False):
+# _integrate_npz, _integrate_store and _integrate_summary return (energy, starttime, endtime,
+# ntotal) where the times are seconds since 1970-01-01
+def _integrate_npz(power_file, ntraces, head_skip, variance, band):
   npz = np.load(power_file)
   filenamelist = npz.keys()
   pln('\t%d merged files'%(len(filenamelist)))
@@ -22,45 +24,129 @@ def main(power_file=None, binsize=5, max_bins=601, head_skip=0, variance=False):
   filenamelist.sort()
 
   energy = 0
-  starttime = None
-  endtime = None
+  first = None
+  last = None
   for fdx, fname in enumerate(filenamelist[head_skip:]):
     datadict = npz[fname].item()
     data = datadict['data']
     powervec = data[:,1]
 
+    header = datadict['header']
     if variance:
       energy += np.var(powervec)
+    elif band in header.get('bands', ()):
+      # computed before -max_freq_bins averaging, like the store's bands
+      energy += header['bands'][band]
     else:
+      assert band == 'total', '%s has no %s band'%(power_file, band)
       energy += sum(powervec)
 
-    header = datadict['header']
-    trigtimestr = header['trigtime']
-    from datetime import datetime
-    # really should standardise on a datetime format, e.g. ISO 8601. However
-    # python is unlikely to change how str(datetime) works so this is probably
-    # ok for now.
-    trigtime = datetime.strptime(trigtimestr, '%Y-%m-%d %H:%M:%S.%f')
-    if starttime is None:
-      starttime = trigtime
-
-    endtime = trigtime
-
-    # binning makes no difference to the actual values, we need it
-    # to know how many traces should we be integrating over
-    if fdx >= binsize * max_bins:
+    if first is None:
+      first = header
+    last = header
+
+    if fdx + 1 >= ntraces:
       break
 
     if (fdx+1)%10 == 0:
       p('.')
 
   pln('')
+  from calc_power_spectrum import header_trigtimes
+  starttime, endtime = header_trigtimes([first, last])
+  return energy, starttime, endtime, len(filenamelist)
+
+def _integrate_summary(summary, ntraces, head_skip, field):
+  """
+  Integrates the summary value field of summary, see
+  calc_power_spectrum.load_summary, so only a few numbers per spectrum are
+  read
+  """
+  pln('\t%d spectra'%(len(summary)))
+  pln('\t%d will be skipped'%(head_skip))
+
+  # same order as the sorted keys of a merged npz
+  order = np.argsort(summary['input_file'], kind='mergesort')
+  order = order[head_skip:][:ntraces]
+
+  energy = summary[field][order].sum()
+  trigtimes = summary['trigtime'][order]
+  return energy, trigtimes[0], trigtimes[-1], len(summary)
+
+def _summary_field(variance, band, highpass):
+  """
+  Returns the field of the summary table to integrate, see
+  calc_power_spectrum.load_summary
+  """
+  if variance:
+    return 'variance'
+  if band != 'total':
+    from calc_power_spectrum import band_field
+    return band_field(band)
+  if highpass is None:
+    return 'total'
+  return 'highpass_%g'%(highpass)
+
+def _integrate_store(power_file, ntraces, head_skip, variance, band, chunksize=256):
+  from spectrum_store import SpectrumStore
+  store = SpectrumStore(power_file)
+  traces = store.traces
+  pln('\t%d spectra'%(len(traces)))
+  pln('\t%d will be skipped'%(head_skip))
+
+  # same order as the sorted keys of a merged npz
+  order = np.argsort(traces['input_file'], kind='mergesort')
+  order = order[head_skip:][:ntraces]
+
+  if not variance and band in store.band_names:
+    # the band integrals were computed with the spectra, so the spectra
+    # themselves are never read
+    energy = store.band(band)[order].sum()
+  else:
+    assert variance or band == 'total', '%s has no %s band'%(power_file, band)
+    power = store.power
+    energy = 0
+    for cdx in xrange(0, len(order), chunksize):
+      chunk = power[order[cdx:cdx+chunksize]]
+      if variance:
+        energy += np.var(chunk, axis=1).sum()
+      else:
+        energy += chunk.sum(dtype=np.float64)
+
+  trigtimes = traces['trigtime'][order]
+  return energy, trigtimes[0], trigtimes[-1], len(traces)
+
+def main(power_file=None, binsize=5, max_bins=601, head_skip=0, variance=False, band='total', highpass=None):
+  from spectrum_store import is_store
+  from calc_power_spectrum import load_summary
+  # binning makes no difference to the actual values, we need it
+  # to know how many traces should we be integrating over
+  ntraces = binsize * max_bins + 1
+  assert highpass is None or (band == 'total' and not variance), '-highpass only applies to total power'
+
+  # summaries, bands and the spectra are tried in that order, so a store
+  # and a merged npz of the same spectra give the same energy
+  field = _summary_field(variance, band, highpass)
+  summary = load_summary(power_file)
+  if summary is not None and field not in summary.dtype.names:
+    summary = None
+
+  if summary is not None:
+    energy, starttime, endtime, ntotal = _integrate_summary(summary, ntraces, head_skip, field)
+  else:
+    assert highpass is None, '%s has no summary of power above %g Hz, see calc_power_spectrum.py -summary_highpass'%(power_file, highpass)
+    if is_store(power_file):
+      integrate = _integrate_store
+    else:
+      integrate = _integrate_npz
+    energy, starttime, endtime, ntotal = integrate(power_file, ntraces, head_skip, variance, band)
+
+  from lecroy import epoch_to_datetime
   duration = endtime - starttime
-  duration = duration.total_seconds()
   pln('\tDuration:%.2f'%(duration))
-  pln('\t\t%s ---> %s'%(starttime, endtime))
+  pln('\t\t%s ---> %s'%(epoch_to_datetime(starttime), epoch_to_datetime(endtime)))
 
-  traces_per_second = len(filenamelist)/duration
+  traces_per_second = ntotal/duration
   pln('\tTraces per second %f'%(traces_per_second))
 
   # need to divide by the number of traces per seconds as sometimes
@@ -80,7 +166,9 @@ def get_commandline_parser():
   parser.add_argument('-binsize', type=int, default=5, help='Perform binning with the given bin size. Bin size does not have to be a integer divisor of the number of samples')
   parser.add_argument('-max_bins', type=int, default=601, help='Plot no more than this number of bins')
   parser.add_argument('-variance', action='store_true', default=False, help='If given the total variance is calculated instead of energy')
-  parser.add_argument('power_file', type=str, help='Merged npz output produced by calc_power_spectrum.py')
+  parser.add_argument('-band', type=str, default='total', help='Band integral to sum instead of total power, e.g. harmonic or broadband. Needs spectra computed with calc_power_spectrum.py -drive_freq. Defaults to total')
+  parser.add_argument('-highpass', type=float, default=None, help='If given only total power at and above this frequency in Hz is integrated. Needs spectra computed with calc_power_spectrum.py -summary_highpass')
+  parser.add_argument('power_file', type=str, help='Merged npz or .power.spectra store produced by calc_power_spectrum.py -merge')
 
   return parser
 
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Maintains an index of Lecroy .trc files so that tools do not have to open
+every trace to learn its trigger time, timebase and size.
+
+A source is either a directory of .trc files or a zip archive of them. The
+catalog of a source is saved as a structured numpy array next to it:
+
+  - directories: DIR/.trc_catalog.npy
+  - zip archives: ARCHIVE.zip.catalog.npy
+
+Each row of the catalog has the fields:
+
+  - name: file name within the directory or zip archive
+  - mtime: modification time of the file, seconds since epoch
+  - size: size of the file in bytes
+  - trigtime: trig_time_epoch, TRIG_TIME as seconds since 1970-01-01
+  - horiz_interval: HORIZ_INTERVAL
+  - horiz_offset: HORIZ_OFFSET
+  - nsamples: number of samples in WAVE_ARRAY_1
+  - data_offset: offset in bytes of the first sample from the start of the
+                 file
+
+Rows are sorted by trigtime. When a catalog is rebuilt only files whose
+mtime or size changed, or which are new, are opened again. Only the WAVEDESC
+block of each trace is read. Only files ending in .trc are catalogued,
+whatever glob is given.
+"""
+
+import os
+import numpy as np
+
+CATALOG_NAME = '.trc_catalog.npy'
+ZIP_CATALOG_EXT = '.catalog.npy'
+
+_CATALOG_FIELDS = [('mtime', 'f8'),
+                   ('size', 'i8'),
+                   ('trigtime', 'f8'),
+                   ('horiz_interval', 'f8'),
+                   ('horiz_offset', 'f8'),
+                   ('nsamples', 'i8'),
+                   ('data_offset', 'i8')]
+
+def _catalog_dtype(namelen):
+  return np.dtype([('name', 'S%d'%(max(namelen, 1)))] + _CATALOG_FIELDS)
+
+def catalog_path(source):
+  """
+  Returns the path the catalog of source is saved to
+  """
+  if os.path.isdir(source):
+    return os.path.join(source, CATALOG_NAME)
+  else:
+    return source + ZIP_CATALOG_EXT
+
+def load_catalog(source):
+  """
+  Returns the saved catalog of source, or None if there isn't one
+  """
+  path = catalog_path(source)
+  if os.path.exists(path):
+    return np.load(path)
+  return None
+
+def is_trc(name):
+  """
+  True if name is a file name that is catalogued, i.e. ends in .trc
+  """
+  return name.endswith('.trc')
+
+def _list_directory(source, glob):
+  import fnmatch
+  for name in sorted(fnmatch.filter(os.listdir(source), glob)):
+    path = os.path.join(source, name)
+    if not is_trc(name) or not os.path.isfile(path):
+      continue
+    st = os.stat(path)
+    yield name, st.st_mtime, st.st_size
+
+def _list_zip(zf, glob):
+  import fnmatch
+  import calendar
+  for info in zf.infolist():
+    if is_trc(info.filename) and fnmatch.fnmatch(info.filename, glob):
+      mtime = calendar.timegm(info.date_time + (0, 0, 0))
+      yield info.filename, mtime, info.file_size
+
+def _catalog_row(name, mtime, size, bwf):
+  return (name,
+          mtime,
+          size,
+          bwf.trig_time_epoch,
+          bwf.HORIZ_INTERVAL,
+          bwf.HORIZ_OFFSET,
+          bwf.nsamples,
+          bwf.data_offset)
+
+def build_catalog(source, glob='*.trc', save=True):
+  """
+  Builds, or incrementally updates, the catalog of source and returns it.
+
+  source: directory or zip archive containing .trc files
+  glob: unix shell glob pattern files must match to be catalogued, as well
+        as ending in .trc
+  save: if True the catalog is written to catalog_path(source)
+
+  Files that are in the existing catalog with the same mtime and size are not
+  opened again. Files that no longer exist are dropped.
+  """
+  from lecroy import LecroyBinaryWaveform
+
+  existing = dict()
+  oldcatalog = load_catalog(source)
+  if oldcatalog is not None:
+    for row in oldcatalog:
+      existing[row['name']] = row
+
+  isdir = os.path.isdir(source)
+  if isdir:
+    listing = _list_directory(source, glob)
+  else:
+    from zipfile import ZipFile
+    zf = ZipFile(source)
+    listing = _list_zip(zf, glob)
+
+  rows = list()
+  nupdated = 0
+  for name, mtime, size in listing:
+    old = existing.get(name)
+    if old is not None and old['mtime'] == mtime and old['size'] == size:
+      rows.append(tuple(old))
+      continue
+
+    if isdir:
+      bwf = LecroyBinaryWaveform(os.path.join(source, name), header_only=True)
+    else:
+      bwf = LecroyBinaryWaveform(name, header_only=True, zipfile=zf)
+
+    rows.append(_catalog_row(name, mtime, size, bwf))
+    nupdated += 1
+
+  namelen = max([len(row[0]) for row in rows] + [1])
+  catalog = np.array(rows, dtype=_catalog_dtype(namelen))
+  catalog = catalog[np.argsort(catalog['trigtime'], kind='mergesort')]
+
+  if save and (nupdated > 0 or oldcatalog is None or len(oldcatalog) != len(catalog)):
+    # np.save adds .npy if it is missing, write to a file handle so the
+    # name is exactly what we want
+    with open(catalog_path(source), 'wb') as fh:
+      np.save(fh, catalog)
+
+  return catalog
+
+def select(catalog, start=None, end=None):
+  """
+  Returns the rows of catalog with start <= trigtime < end. start and end are
+  seconds since epoch, and either may be None to leave that side open.
+  """
+  mask = np.ones(len(catalog), dtype=bool)
+  if start is not None:
+    mask &= catalog['trigtime'] >= start
+  if end is not None:
+    mask &= catalog['trigtime'] < end
+  return catalog[mask]
+
+def sort_by_trigtime(tracefiles, glob='*.trc'):
+  """
+  Returns tracefiles sorted by trigger time, using the catalog of the
+  directory each file is in. tracefiles must end in .trc, see is_trc.
+  """
+  assert all(is_trc(tf) for tf in tracefiles), 'Only .trc files have trigger times'
+  trigtimes = dict()
+  for dirname in set(os.path.dirname(tf) or os.curdir for tf in tracefiles):
+    catalog = build_catalog(dirname, glob)
+    for row in catalog:
+      trigtimes[os.path.join(dirname, row['name'])] = row['trigtime']
+
+  def key(tf):
+    dirname, name = os.path.split(tf)
+    return trigtimes[os.path.join(dirname or os.curdir, name)]
+
+  return sorted(tracefiles, key=key)
+
+def parse_commandline_arguments():
+  parser = get_commandline_parser()
+  cmdargs = vars(parser.parse_args())
+  return cmdargs
+
+def get_commandline_parser():
+  import argparse
+  parser = argparse.ArgumentParser(description='Builds or updates the catalog of directories or zip archives of Lecroy trc files')
+  parser.add_argument('-glob', type=str, default='*.trc', help='Unix shell glob pattern to match files for cataloguing. Defaults to *.trc')
+  parser.add_argument('-list', action='store_true', help='If given the catalog is printed')
+  parser.add_argument('sources', nargs='+', help='Directories or zip archives of trc files')
+
+  return parser
+
+def main(**cmdargs):
+  from datetime import datetime
+  for source in cmdargs['sources']:
+    catalog = build_catalog(source, cmdargs['glob'])
+    print '%s: %d traces, catalog at %s'%(source, len(catalog), catalog_path(source))
+
+    if len(catalog):
+      tstart = datetime.utcfromtimestamp(catalog['trigtime'][0])
+      tend = datetime.utcfromtimestamp(catalog['trigtime'][-1])
+      print '   %s --> %s'%(tstart, tend)
+
+    if cmdargs['list']:
+      for row in catalog:
+        print '%s\t%s\t%d'%(row['name'], datetime.utcfromtimestamp(row['trigtime']), row['nsamples'])
+
+if __name__ == '__main__':
+  import sys
+  cmdargs = parse_commandline_arguments()
+  sys.exit(main(**cmdargs))